@@ -4,7 +4,7 @@
 
 {
     "name": "HR Payroll Period",
-    "version": "14.0.1.1.0",
+    "version": "14.0.1.2.0",
     "license": "AGPL-3",
     "category": "Payroll",
     "summary": "Add payroll periods",
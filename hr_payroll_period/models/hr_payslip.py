@@ -68,14 +68,13 @@ class HrPayslip(models.Model):
             self.date_to = self.hr_period_id.date_end
             self.date_payment = self.hr_period_id.date_payment
 
-    @api.model
-    def create(self, vals):
-        if vals.get("payslip_run_id"):
-            payslip_run = self.env["hr.payslip.run"].browse(vals["payslip_run_id"])
-            self.env["hr.employee"].browse(vals["employee_id"])
-            period = payslip_run.hr_period_id
-            vals["date_payment"] = payslip_run.date_payment
-            vals["hr_period_id"] = period.id
-        elif vals.get("date_to") and not vals.get("date_payment"):
-            vals["date_payment"] = vals["date_to"]
-        return super(HrPayslip, self).create(vals)
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if vals.get("payslip_run_id"):
+                payslip_run = self.env["hr.payslip.run"].browse(vals["payslip_run_id"])
+                vals["date_payment"] = payslip_run.date_payment
+                vals["hr_period_id"] = payslip_run.hr_period_id.id
+            elif vals.get("date_to") and not vals.get("date_payment"):
+                vals["date_payment"] = vals["date_to"]
+        return super(HrPayslip, self).create(vals_list)
@@ -2,10 +2,15 @@
 # Copyright 2017 Serpent Consulting Services Pvt. Ltd.
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
-from odoo import fields, models
+from odoo import api, fields, models
+from odoo.osv import expression
+from odoo.tools.safe_eval import safe_eval
 
 from .hr_fiscal_year import get_schedules
 
+# employees searched and generated together
+EMPLOYEE_CHUNK_SIZE = 1000
+
 
 class HrPayslipEmployees(models.TransientModel):
 
@@ -13,3 +18,38 @@ class HrPayslipEmployees(models.TransientModel):
 
     company_id = fields.Many2one("res.company", "Company", readonly=True)
     schedule_pay = fields.Selection(get_schedules, "Scheduled Pay", readonly=True)
+    employee_domain = fields.Char(
+        "Employees Filter",
+        help="Generate the payslips of the employees matching this filter "
+        "instead of the selected ones",
+    )
+    employee_count = fields.Integer(compute="_compute_employee_count")
+
+    @api.depends("employee_domain", "employee_ids")
+    def _compute_employee_count(self):
+        for wizard in self:
+            if wizard.employee_domain:
+                wizard.employee_count = self.env["hr.employee"].search_count(
+                    safe_eval(wizard.employee_domain)
+                )
+            else:
+                wizard.employee_count = len(wizard.employee_ids)
+
+    def _get_employee_chunks(self):
+        """Search the employees of the filter by chunks of consecutive ids"""
+        self.ensure_one()
+        if not self.employee_domain:
+            yield from super()._get_employee_chunks()
+            return
+        domain = safe_eval(self.employee_domain)
+        last_id = 0
+        while True:
+            employees = self.env["hr.employee"].search(
+                expression.AND([domain, [("id", ">", last_id)]]),
+                order="id",
+                limit=EMPLOYEE_CHUNK_SIZE,
+            )
+            if not employees:
+                return
+            yield employees
+            last_id = employees[-1].id
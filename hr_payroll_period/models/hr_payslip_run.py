@@ -89,30 +89,27 @@ class HrPayslipRun(models.Model):
             self.date_payment = period.date_payment
             self.schedule_pay = period.schedule_pay
 
-    @api.model
-    def create(self, vals):
+    @api.model_create_multi
+    def create(self, vals_list):
         """
         Keep compatibility between modules
         """
-        if vals.get("date_end") and not vals.get("date_payment"):
-            vals.update({"date_payment": vals["date_end"]})
-        return super(HrPayslipRun, self).create(vals)
+        for vals in vals_list:
+            if vals.get("date_end") and not vals.get("date_payment"):
+                vals.update({"date_payment": vals["date_end"]})
+        return super(HrPayslipRun, self).create(vals_list)
 
     def get_payslip_employees_wizard(self):
         """Replace the static action used to call the wizard"""
         self.ensure_one()
         view = self.env.ref("payroll.view_hr_payslip_by_employees")
         company = self.company_id
-        employee_ids = (
-            self.env["hr.employee"]
-            .search(
-                [
-                    ("company_id", "=", company.id),
-                    ("contract_id.schedule_pay", "=", self.schedule_pay),
-                ]
-            )
-            .ids
-        )
+        # the employees are searched by the wizard when it generates the
+        # payslips, the action doesn't carry their ids
+        employee_domain = [
+            ("company_id", "=", company.id),
+            ("contract_id.schedule_pay", "=", self.schedule_pay),
+        ]
         return {
             "type": "ir.actions.act_window",
             "name": _("Generate Payslips"),
@@ -123,7 +120,7 @@ class HrPayslipRun(models.Model):
             "context": {
                 "default_company_id": company.id,
                 "default_schedule_pay": self.schedule_pay,
-                "default_employee_ids": [(6, 0, employee_ids)],
+                "default_employee_domain": repr(employee_domain),
             },
         }
 
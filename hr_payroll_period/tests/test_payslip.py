@@ -1,6 +1,8 @@
 # Copyright 2015 Savoir-faire Linux. All Rights Reserved.
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
+from unittest.mock import patch
+
 from odoo.exceptions import UserError
 from odoo.tools import DEFAULT_SERVER_DATE_FORMAT as DF
 
@@ -202,3 +204,47 @@ class PayslipCase(test_hr_fiscalyear.TestHrFiscalyear):
         payslip.onchange_contract_period()
         period = self.env["hr.period"].get_next_period(self.company.id, "quarterly")
         self.assertEqual(payslip.hr_period_id, period)
+
+    def test_payslip_employees_domain(self):
+        fy = self.create_fiscal_year({"type_id": self.type_fy.id})
+        fy.create_periods()
+        fy.button_confirm()
+        periods = self.get_periods(fy)
+        run = self.run_obj.create(self._prepare_payslip_run_data(periods[0]))
+        self.contract.write({"schedule_pay": run.schedule_pay, "state": "open"})
+        employee2 = self.env["hr.employee"].create({"name": "Employee 2"})
+        self.env["hr.contract"].create(
+            {
+                "name": "Contract 3",
+                "employee_id": employee2.id,
+                "wage": 10.0,
+                "schedule_pay": run.schedule_pay,
+                "state": "open",
+            }
+        )
+        other_schedule = self.env["hr.employee"].create({"name": "Employee 3"})
+        self.env["hr.contract"].create(
+            {
+                "name": "Contract 4",
+                "employee_id": other_schedule.id,
+                "wage": 10.0,
+                "schedule_pay": "annually",
+                "state": "open",
+            }
+        )
+        action = run.get_payslip_employees_wizard()
+        self.assertNotIn("default_employee_ids", action["context"])
+        wizard = self.wzd_obj.with_context(**action["context"]).create({})
+        self.assertFalse(wizard.employee_ids)
+        self.assertEqual(wizard.employee_count, 2)
+        # the employees are searched and generated by chunks
+        with patch(
+            "odoo.addons.hr_payroll_period.models.hr_payslip_employees"
+            ".EMPLOYEE_CHUNK_SIZE",
+            1,
+        ):
+            wizard.with_context(active_id=run.id).compute_sheet()
+        self.assertEqual(run.slip_ids.employee_id, self.employee | employee2)
+        # the payslips created together all get the period of the batch
+        self.assertEqual(run.slip_ids.hr_period_id, run.hr_period_id)
+        self.assertEqual(set(run.slip_ids.mapped("date_payment")), {run.date_payment})
@@ -2,7 +2,7 @@
 
 {
     "name": "Payroll",
-    "version": "14.0.6.2.4",
+    "version": "14.0.6.4.0",
     "category": "Payroll",
     "website": "https://github.com/OCA/payroll",
     "sequence": 38,
@@ -19,6 +19,7 @@
         "security/ir.model.access.csv",
         "data/hr_payroll_sequence.xml",
         "data/hr_payroll_data.xml",
+        "data/hr_payslip_run_job_cron.xml",
         "wizard/hr_payroll_contribution_register_report_views.xml",
         "wizard/hr_payroll_payslips_by_employees_views.xml",
         "views/menus.xml",
@@ -29,6 +30,7 @@
         "views/hr_salary_rule_views.xml",
         "views/hr_payslip_line_views.xml",
         "views/hr_payslip_views.xml",
+        "views/hr_payslip_run_job_views.xml",
         "views/hr_payslip_run_views.xml",
         "views/hr_employee_views.xml",
         "views/report_contributionregister.xml",
@@ -0,0 +1,7 @@
+from openupgradelib import openupgrade
+
+
+@openupgrade.migrate()
+def migrate(env, version):
+    # compute the year to date totals of the payslips confirmed until now
+    env["hr.payslip.ytd"].rebuild()
@@ -3,14 +3,23 @@
 from . import hr_contract
 from . import hr_employee
 from . import hr_payroll_structure
+from . import rule_code_cache
+from . import rule_program
+from . import rule_dependency
+from . import rule_batch
 from . import hr_salary_rule
 from . import hr_salary_rule_category
+from . import hr_salary_rule_snapshot
 from . import hr_rule_input
 from . import hr_contribution_register
+from . import payslip_history
 from . import base_browsable
 from . import hr_payslip
 from . import hr_payslip_line
+from . import hr_payslip_aggregate
+from . import hr_payslip_ytd
 from . import hr_payslip_input
 from . import hr_payslip_worked_days
 from . import hr_payslip_run
+from . import hr_payslip_run_job
 from . import res_config_settings
@@ -4,6 +4,8 @@ import logging
 
 from odoo import fields
 
+from .payslip_history import aggregate, query_history
+
 _logger = logging.getLogger(__name__)
 
 
@@ -41,6 +43,11 @@ class InputLine(BrowsableObject):
     def sum(self, code, from_date, to_date=None):
         if to_date is None:
             to_date = fields.Date.today()
+        res = self.env["hr.payslip.aggregate"]._get_sums(
+            "input", self.employee_id, code, from_date, to_date
+        )
+        if res is not None:
+            return res[0] or 0.0
         self.env.cr.execute(
             """
             SELECT sum(amount) as sum
@@ -52,6 +59,16 @@ class InputLine(BrowsableObject):
         )
         return self.env.cr.fetchone()[0] or 0.0
 
+    def query(self, codes, windows):
+        """
+        Sum the amounts of many input codes over several date windows at once
+        @param windows: dict {window name: (from_date, to_date)}
+        @return: HistoryResult, e.g. result.get("BONUS", "ytd")
+        """
+        return query_history(
+            self.env, "input", [self.employee_id], codes, windows
+        ).for_employee(self.employee_id)
+
 
 class WorkedDays(BrowsableObject):
     """a class that will be used into the python code, mainly for
@@ -60,6 +77,11 @@ class WorkedDays(BrowsableObject):
     def _sum(self, code, from_date, to_date=None):
         if to_date is None:
             to_date = fields.Date.today()
+        res = self.env["hr.payslip.aggregate"]._get_sums(
+            "worked_days", self.employee_id, code, from_date, to_date
+        )
+        if res is not None:
+            return res
         self.env.cr.execute(
             """
             SELECT sum(number_of_days) as number_of_days,
@@ -80,14 +102,92 @@ class WorkedDays(BrowsableObject):
         res = self._sum(code, from_date, to_date)
         return res and res[1] or 0.0
 
+    def query(self, codes, windows):
+        """
+        Sum the worked days of many codes over several date windows at once
+        @param windows: dict {window name: (from_date, to_date)}
+        @return: HistoryResult, e.g. result.get("WORK100", "ytd", "hours")
+        """
+        return query_history(
+            self.env, "worked_days", [self.employee_id], codes, windows
+        ).for_employee(self.employee_id)
+
 
 class Payslips(BrowsableObject):
     """a class that will be used into the python code, mainly for
     usability purposes"""
 
+    def __init__(self, employee_id, vals_dict, env, history=None):
+        super().__init__(employee_id, vals_dict, env)
+        self.base_fields += ["history"]
+        # optional PayslipHistory shared by the payslips of a batch
+        self.history = history
+
+    def _rule_history(self, code, from_date, to_date, function, monthly=False):
+        """
+        @return: the aggregate of the rule totals from the loaded history or
+                 from the monthly aggregates, or None when none of them
+                 covers the dates
+        """
+        if self.history is None or not self.history.covers(from_date, to_date):
+            return self.env["hr.payslip.aggregate"]._get_line_value(
+                self.employee_id,
+                from_date,
+                to_date,
+                "monthly_" + function if monthly else function,
+                code=code,
+            )
+        return aggregate(
+            self.history.rule_totals(
+                self.employee_id, code, from_date, to_date, monthly
+            ),
+            function,
+        )
+
+    def _get_category_codes(self, code):
+        """@return: the codes of the categories summed by the *_category()
+        helpers, i.e. the code and the codes of all the categories below"""
+        return self.env["hr.salary.rule.category"]._get_descendant_codes(code)
+
+    def _category_history(self, codes, from_date, to_date, function, monthly=False):
+        """
+        @return: the aggregate of the category totals from the loaded history
+                 or from the monthly aggregates, or None when none of them
+                 covers the dates
+        """
+        if self.history is None or not self.history.covers(from_date, to_date):
+            return self.env["hr.payslip.aggregate"]._get_line_value(
+                self.employee_id,
+                from_date,
+                to_date,
+                "monthly_" + function if monthly else function,
+                categories=codes,
+            )
+        return aggregate(
+            self.history.category_totals(
+                self.employee_id, codes, from_date, to_date, monthly
+            ),
+            function,
+        )
+
+    def query_rules(self, codes, windows):
+        """
+        Aggregate the lines of many rule codes over several date windows at
+        once, instead of calling the *_rule() helpers for each of them
+        @param windows: dict {window name: (from_date, to_date)}, e.g.
+                        {"ytd": (date(2024, 1, 1), payslip.date_to)}
+        @return: HistoryResult, e.g. result.get("GROSS", "ytd", "avg")
+        """
+        return query_history(
+            self.env, "rule", [self.employee_id], codes, windows
+        ).for_employee(self.employee_id)
+
     def sum_rule(self, code, from_date, to_date=None):
         if to_date is None:
             to_date = fields.Date.today()
+        res = self._rule_history(code, from_date, to_date, "sum")
+        if res is not None:
+            return res
         self.env.cr.execute(
             """SELECT sum(case when hp.credit_note = False then
             (pl.total) else (-pl.total) end)
@@ -109,6 +209,9 @@ class Payslips(BrowsableObject):
     def average_rule(self, code, from_date, to_date=None):
         if to_date is None:
             to_date = fields.Date.today()
+        res = self._rule_history(code, from_date, to_date, "avg")
+        if res is not None:
+            return res
         self.env.cr.execute(
             """SELECT avg(case when hp.credit_note = False then
             (pl.total) else (-pl.total) end)
@@ -124,13 +227,19 @@ class Payslips(BrowsableObject):
     def average_rule_monthly(self, code, from_date, to_date=None):
         if to_date is None:
             to_date = fields.Date.today()
+        res = self._rule_history(code, from_date, to_date, "avg", monthly=True)
+        if res is not None:
+            return res
         self.env.cr.execute(
-            """SELECT avg(total) FROM (SELECT max(case when hp.credit_note = False then
-            (pl.total) else (-pl.total) end)
-                    FROM hr_payslip as hp, hr_payslip_line as pl
-                    WHERE hp.employee_id = %s AND hp.state = 'done'
-                    AND hp.date_from >= %s AND hp.date_to <= %s AND
-                     hp.id = pl.slip_id AND pl.code = %s) AS monthly_sum""",
+            """SELECT avg(total) FROM (
+                SELECT DATE_TRUNC('month',hp.date_from) AS date_month,
+                    sum(case when hp.credit_note = False then
+                        (pl.total) else (-pl.total) end) AS total
+                FROM hr_payslip as hp, hr_payslip_line as pl
+                WHERE hp.employee_id = %s AND hp.state = 'done'
+                AND hp.date_from >= %s AND hp.date_to <= %s AND
+                 hp.id = pl.slip_id AND pl.code = %s
+                GROUP BY date_month) AS monthly_sum""",
             (self.employee_id, from_date, to_date, code),
         )
         res = self.env.cr.fetchone()
@@ -139,6 +248,9 @@ class Payslips(BrowsableObject):
     def max_rule(self, code, from_date, to_date=None):
         if to_date is None:
             to_date = fields.Date.today()
+        res = self._rule_history(code, from_date, to_date, "max")
+        if res is not None:
+            return res
         self.env.cr.execute(
             """SELECT max(case when hp.credit_note = False then
             (pl.total) else (-pl.total) end)
@@ -154,13 +266,19 @@ class Payslips(BrowsableObject):
     def max_rule_monthly(self, code, from_date, to_date=None):
         if to_date is None:
             to_date = fields.Date.today()
+        res = self._rule_history(code, from_date, to_date, "max", monthly=True)
+        if res is not None:
+            return res
         self.env.cr.execute(
-            """SELECT max(total) FROM (SELECT max(case when hp.credit_note = False then
-            (pl.total) else (-pl.total) end)
-                    FROM hr_payslip as hp, hr_payslip_line as pl
-                    WHERE hp.employee_id = %s AND hp.state = 'done'
-                    AND hp.date_from >= %s AND hp.date_to <= %s AND
-                     hp.id = pl.slip_id AND pl.code = %s) AS monthly_sum""",
+            """SELECT max(total) FROM (
+                SELECT DATE_TRUNC('month',hp.date_from) AS date_month,
+                    sum(case when hp.credit_note = False then
+                        (pl.total) else (-pl.total) end) AS total
+                FROM hr_payslip as hp, hr_payslip_line as pl
+                WHERE hp.employee_id = %s AND hp.state = 'done'
+                AND hp.date_from >= %s AND hp.date_to <= %s AND
+                 hp.id = pl.slip_id AND pl.code = %s
+                GROUP BY date_month) AS monthly_sum""",
             (self.employee_id, from_date, to_date, code),
         )
         res = self.env.cr.fetchone()
@@ -169,6 +287,9 @@ class Payslips(BrowsableObject):
     def min_rule(self, code, from_date, to_date=None):
         if to_date is None:
             to_date = fields.Date.today()
+        res = self._rule_history(code, from_date, to_date, "min")
+        if res is not None:
+            return res
         self.env.cr.execute(
             """SELECT min(case when hp.credit_note = False then
             (pl.total) else (-pl.total) end)
@@ -184,13 +305,19 @@ class Payslips(BrowsableObject):
     def min_rule_monthly(self, code, from_date, to_date=None):
         if to_date is None:
             to_date = fields.Date.today()
+        res = self._rule_history(code, from_date, to_date, "min", monthly=True)
+        if res is not None:
+            return res
         self.env.cr.execute(
-            """SELECT min(total) FROM (SELECT max(case when hp.credit_note = False then
-            (pl.total) else (-pl.total) end)
-                    FROM hr_payslip as hp, hr_payslip_line as pl
-                    WHERE hp.employee_id = %s AND hp.state = 'done'
-                    AND hp.date_from >= %s AND hp.date_to <= %s AND
-                     hp.id = pl.slip_id AND pl.code = %s) AS monthly_sum""",
+            """SELECT min(total) FROM (
+                SELECT DATE_TRUNC('month',hp.date_from) AS date_month,
+                    sum(case when hp.credit_note = False then
+                        (pl.total) else (-pl.total) end) AS total
+                FROM hr_payslip as hp, hr_payslip_line as pl
+                WHERE hp.employee_id = %s AND hp.state = 'done'
+                AND hp.date_from >= %s AND hp.date_to <= %s AND
+                 hp.id = pl.slip_id AND pl.code = %s
+                GROUP BY date_month) AS monthly_sum""",
             (self.employee_id, from_date, to_date, code),
         )
         res = self.env.cr.fetchone()
@@ -200,12 +327,10 @@ class Payslips(BrowsableObject):
         if to_date is None:
             to_date = fields.Date.today()
 
-        hierarchy_codes = (
-            self.env["hr.salary.rule.category"]
-            .search([("code", "=", code)])
-            .children_ids.mapped("code")
-        )
-        hierarchy_codes.append(code)
+        hierarchy_codes = self._get_category_codes(code)
+        res = self._category_history(hierarchy_codes, from_date, to_date, "sum")
+        if res is not None:
+            return res
 
         self.env.cr.execute(
             """SELECT sum(case when hp.credit_note is not True then
@@ -223,12 +348,10 @@ class Payslips(BrowsableObject):
         if to_date is None:
             to_date = fields.Date.today()
 
-        hierarchy_codes = (
-            self.env["hr.salary.rule.category"]
-            .search([("code", "=", code)])
-            .children_ids.mapped("code")
-        )
-        hierarchy_codes.append(code)
+        hierarchy_codes = self._get_category_codes(code)
+        res = self._category_history(hierarchy_codes, from_date, to_date, "avg")
+        if res is not None:
+            return res
 
         self.env.cr.execute(
             """SELECT avg(case when hp.credit_note is not True then
@@ -246,12 +369,12 @@ class Payslips(BrowsableObject):
         if to_date is None:
             to_date = fields.Date.today()
 
-        hierarchy_codes = (
-            self.env["hr.salary.rule.category"]
-            .search([("code", "=", code)])
-            .children_ids.mapped("code")
+        hierarchy_codes = self._get_category_codes(code)
+        res = self._category_history(
+            hierarchy_codes, from_date, to_date, "avg", monthly=True
         )
-        hierarchy_codes.append(code)
+        if res is not None:
+            return res
 
         self.env.cr.execute(
             """SELECT avg(total) FROM (
@@ -272,12 +395,10 @@ class Payslips(BrowsableObject):
         if to_date is None:
             to_date = fields.Date.today()
 
-        hierarchy_codes = (
-            self.env["hr.salary.rule.category"]
-            .search([("code", "=", code)])
-            .children_ids.mapped("code")
-        )
-        hierarchy_codes.append(code)
+        hierarchy_codes = self._get_category_codes(code)
+        res = self._category_history(hierarchy_codes, from_date, to_date, "max")
+        if res is not None:
+            return res
 
         self.env.cr.execute(
             """SELECT max(case when hp.credit_note is not True then
@@ -295,12 +416,12 @@ class Payslips(BrowsableObject):
         if to_date is None:
             to_date = fields.Date.today()
 
-        hierarchy_codes = (
-            self.env["hr.salary.rule.category"]
-            .search([("code", "=", code)])
-            .children_ids.mapped("code")
+        hierarchy_codes = self._get_category_codes(code)
+        res = self._category_history(
+            hierarchy_codes, from_date, to_date, "max", monthly=True
         )
-        hierarchy_codes.append(code)
+        if res is not None:
+            return res
 
         self.env.cr.execute(
             """SELECT max(total) FROM (
@@ -321,12 +442,10 @@ class Payslips(BrowsableObject):
         if to_date is None:
             to_date = fields.Date.today()
 
-        hierarchy_codes = (
-            self.env["hr.salary.rule.category"]
-            .search([("code", "=", code)])
-            .children_ids.mapped("code")
-        )
-        hierarchy_codes.append(code)
+        hierarchy_codes = self._get_category_codes(code)
+        res = self._category_history(hierarchy_codes, from_date, to_date, "min")
+        if res is not None:
+            return res
 
         self.env.cr.execute(
             """SELECT min(case when hp.credit_note is not True then
@@ -344,12 +463,12 @@ class Payslips(BrowsableObject):
         if to_date is None:
             to_date = fields.Date.today()
 
-        hierarchy_codes = (
-            self.env["hr.salary.rule.category"]
-            .search([("code", "=", code)])
-            .children_ids.mapped("code")
+        hierarchy_codes = self._get_category_codes(code)
+        res = self._category_history(
+            hierarchy_codes, from_date, to_date, "min", monthly=True
         )
-        hierarchy_codes.append(code)
+        if res is not None:
+            return res
 
         self.env.cr.execute(
             """SELECT min(total) FROM (
@@ -365,3 +484,27 @@ class Payslips(BrowsableObject):
         )
         res = self.env.cr.fetchone()
         return res and res[0] or 0.0
+
+
+class YearToDate(BrowsableObject):
+    """year to date totals of the done payslips of the employee, without the
+    computed payslip, read from hr.payslip.ytd the first time they are used"""
+
+    def __init__(self, employee_id, year, env):
+        super().__init__(employee_id, {}, env)
+        self.base_fields += ["year", "totals"]
+        self.year = year
+        self.totals = None
+
+    def _get(self, kind, code):
+        if self.totals is None:
+            self.totals = self.env["hr.payslip.ytd"]._get_totals(
+                self.employee_id, self.year
+            )
+        return self.totals.get((kind, code), 0.0)
+
+    def rule(self, code):
+        return self._get("rule", code)
+
+    def category(self, code):
+        return self._get("category", code)
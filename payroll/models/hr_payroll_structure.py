@@ -1,8 +1,40 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-from odoo import _, api, fields, models
+import functools
+import logging
+import uuid
+
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import ValidationError
 
+from .rule_batch import BATCH_ROOTS, BatchRule, RuleBatch, batch_getter, numpy
+from .rule_dependency import build_rule_graph
+from .rule_program import RuleLine, RuleProgram, build_program
+
+_logger = logging.getLogger(__name__)
+
+# parameter holding the version of the salary rules and structures, part of the
+# keys of their cached plans, programs and graphs
+RULE_CACHE_VERSION_KEY = "payroll.rule_cache_version"
+
+
+class RulePlan(object):
+    """
+    Execution plan of the salary rules of a set of structures. It only holds
+    ids, so it can be cached across transactions:
+    - rule_ids: the rules to apply, ordered by sequence and without duplicates
+    - descendant_ids: rule id => frozenset of the rule id and all its children,
+      that have to be skipped when the rule condition is not satisfied
+    - parent_ids: rule id => tuple of its parent rule ids, nearest first
+    """
+
+    __slots__ = ("rule_ids", "descendant_ids", "parent_ids")
+
+    def __init__(self, rule_ids, descendant_ids, parent_ids):
+        self.rule_ids = rule_ids
+        self.descendant_ids = descendant_ids
+        self.parent_ids = parent_ids
+
 
 class HrPayrollStructure(models.Model):
     """
@@ -42,6 +74,21 @@ class HrPayrollStructure(models.Model):
         "rule_id",
         string="Salary Rules",
     )
+    rule_engine = fields.Selection(
+        [("interpreter", "Rule by rule"), ("compiled", "Compiled program")],
+        string="Rule Engine",
+        required=True,
+        default="interpreter",
+        help="Compiled program: the salary rules applied to the payslips of "
+        "this structure, including the ones of its parent structures, are "
+        "compiled into a single sandboxed program, evaluated once per "
+        "contract. It is regenerated when a rule or a structure is modified.",
+    )
+    rule_order_warning = fields.Text(
+        compute="_compute_rule_order_warning",
+        help="Rules reading the result of a rule computed after them in the "
+        "sequence order.",
+    )
     require_code = fields.Boolean(
         "Require code",
         compute="_compute_require_code",
@@ -57,6 +104,88 @@ class HrPayrollStructure(models.Model):
         self.require_code = require
         return require
 
+    @api.depends("rule_ids", "parent_id")
+    def _compute_rule_order_warning(self):
+        rule_obj = self.env["hr.salary.rule"]
+        for struct in self:
+            if not struct._origin.id:
+                struct.rule_order_warning = False
+                continue
+            messages = []
+            for rule_id, read_id in struct._origin.get_rule_graph().violation_ids:
+                rule, read = rule_obj.browse(rule_id), rule_obj.browse(read_id)
+                messages.append(
+                    _(
+                        "%s (%s, sequence %s) reads %s (%s, sequence %s), which "
+                        "is computed after it."
+                    )
+                    % (
+                        rule.name,
+                        rule.code,
+                        rule.sequence,
+                        read.name,
+                        read.code,
+                        read.sequence,
+                    )
+                )
+            struct.rule_order_warning = "\n".join(messages) or False
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self._invalidate_rule_caches()
+        return super().create(vals_list)
+
+    def write(self, vals):
+        self._invalidate_rule_caches()
+        return super().write(vals)
+
+    def unlink(self):
+        self._invalidate_rule_caches()
+        return super().unlink()
+
+    @api.model
+    def _get_rule_cache_version(self):
+        """
+        @return: the current version of the salary rules and structures. It
+                 is part of the keys of the cached plans, programs and graphs,
+                 which are rebuilt when it changes. It is read once per
+                 transaction and kept in the cache of the cursor.
+        """
+        cr = self.env.cr
+        if RULE_CACHE_VERSION_KEY not in cr.cache:
+            cr.execute(
+                "SELECT value FROM ir_config_parameter WHERE key = %s",
+                (RULE_CACHE_VERSION_KEY,),
+            )
+            row = cr.fetchone()
+            cr.cache[RULE_CACHE_VERSION_KEY] = row and row[0]
+            # the next transaction sees the versions committed meanwhile
+            forget = functools.partial(cr.cache.pop, RULE_CACHE_VERSION_KEY, None)
+            cr.after("commit", forget)
+            cr.after("rollback", forget)
+        return cr.cache[RULE_CACHE_VERSION_KEY]
+
+    @api.model
+    def _invalidate_rule_caches(self):
+        """
+        Give the salary rules and structures a new version, which drops their
+        cached plans, programs and graphs in every worker once committed,
+        without clearing the other caches of the registry. A version is never
+        reused, so the entries cached by a rolled back transaction are never
+        read again.
+        """
+        self.env.cr.execute(
+            """
+            INSERT INTO ir_config_parameter
+                (key, value, create_uid, create_date, write_uid, write_date)
+            VALUES (%s, %s, %s, now() at time zone 'UTC',
+                %s, now() at time zone 'UTC')
+            ON CONFLICT (key) DO UPDATE
+            SET value = EXCLUDED.value, write_date = EXCLUDED.write_date""",
+            (RULE_CACHE_VERSION_KEY, uuid.uuid4().hex, self.env.uid, self.env.uid),
+        )
+        self.env.cr.cache.pop(RULE_CACHE_VERSION_KEY, None)
+
     @api.constrains("parent_id")
     def _check_parent_id(self):
         if not self._check_recursion():
@@ -83,3 +212,202 @@ class HrPayrollStructure(models.Model):
         if parent:
             parent = parent._get_parent_structure()
         return parent + self
+
+    @api.model
+    @tools.ormcache(
+        "self._get_rule_cache_version()",
+        "structure_ids",
+        "tuple(self.env.companies.ids)",
+    )
+    def _get_rule_plan(self, structure_ids):
+        """
+        @param structure_ids: sorted tuple of structure ids, parents included
+        @return: the RulePlan of these structures. It is built once and shared
+                 by all the payslips using the same structures, until a
+                 structure or a salary rule is modified.
+        """
+        rule_ids = self.browse(structure_ids).get_all_rules()
+        sorted_rule_ids = []
+        seen = set()
+        for rule_id, _sequence in sorted(rule_ids, key=lambda x: x[1]):
+            if rule_id not in seen:
+                seen.add(rule_id)
+                sorted_rule_ids.append(rule_id)
+        return self._get_rules_plan(tuple(sorted_rule_ids))
+
+    @api.model
+    @tools.ormcache(
+        "self._get_rule_cache_version()", "rule_ids", "tuple(self.env.companies.ids)"
+    )
+    def _get_rules_plan(self, rule_ids):
+        """
+        @param rule_ids: tuple of the ids of the rules to apply, in order and
+                         without duplicates, e.g. the ones of
+                         hr.payslip._get_salary_rules()
+        @return: the RulePlan of these rules
+        """
+        descendant_ids = {}
+        parent_ids = {}
+        for rule in self.env["hr.salary.rule"].browse(rule_ids):
+            descendant_ids[rule.id] = frozenset(
+                id for id, seq in rule._recursive_search_of_rules()
+            )
+            parents = []
+            parent = rule.parent_rule_id
+            while parent:
+                parents.append(parent.id)
+                parent = parent.parent_rule_id
+            parent_ids[rule.id] = tuple(parents)
+        return RulePlan(rule_ids, descendant_ids, parent_ids)
+
+    @api.model
+    @tools.ormcache(
+        "self._get_rule_cache_version()",
+        "structure_ids",
+        "tuple(self.env.companies.ids)",
+        "self.env.lang",
+    )
+    def _get_rule_program(self, structure_ids):
+        """
+        @param structure_ids: sorted tuple of structure ids, parents included
+        @return: the RuleProgram of the rules of these structures, or None when
+                 they can't be compiled and have to be computed one by one
+        """
+        plan = self._get_rule_plan(structure_ids)
+        rules = self.env["hr.salary.rule"].browse(plan.rule_ids)
+        payslip_model = self.env["hr.payslip"]
+        overrides = payslip_model._get_rule_program_overrides()
+        steps = rules._get_program_steps()
+        if steps is None:
+            return None
+        if "_compute_payslip_line" in overrides:
+            for step in steps:
+                step.amount, step.amount_sources = "call", []
+        try:
+            code = build_program(steps)
+        except Exception as e:
+            _logger.warning(
+                "Salary structures %s can't be compiled, their rules are "
+                "computed one by one: %s",
+                structure_ids,
+                e,
+            )
+            return None
+        lines = []
+        for rule in rules:
+            lines.append(
+                RuleLine(
+                    code=rule.code or rule.id,
+                    key=(rule.code or "id" + str(rule.id)) + "-",
+                    name=rule.name,
+                    amount_fix=rule.amount_fix,
+                    amount_percentage=rule.amount_percentage,
+                    range_min=rule.condition_range_min,
+                    range_max=rule.condition_range_max,
+                    category_codes=rule.category_id._get_sum_codes(),
+                    values=payslip_model._get_rule_line_values(rule),
+                )
+            )
+        return RuleProgram(plan, code, lines, not overrides)
+
+    @api.model
+    def _get_rule_graph(self, structure_ids):
+        """
+        @param structure_ids: sorted tuple of structure ids, parents included
+        @return: the RuleGraph of the rules of these structures
+        """
+        return self._get_rules_graph(self._get_rule_plan(structure_ids).rule_ids)
+
+    @api.model
+    @tools.ormcache(
+        "self._get_rule_cache_version()", "rule_ids", "tuple(self.env.companies.ids)"
+    )
+    def _get_rules_graph(self, rule_ids):
+        """
+        @param rule_ids: tuple of the ids of the rules, in order
+        @return: the RuleGraph of these rules, built from the python code of
+                 their conditions and amounts
+        """
+        return build_rule_graph(
+            [
+                (
+                    rule.id,
+                    rule.code,
+                    rule.category_id._get_sum_codes(),
+                    rule._get_code_references(),
+                )
+                for rule in self.env["hr.salary.rule"].browse(rule_ids)
+            ]
+        )
+
+    @api.model
+    @tools.ormcache(
+        "self._get_rule_cache_version()",
+        "structure_ids",
+        "tuple(self.env.companies.ids)",
+        "self.env.lang",
+    )
+    def _get_rule_batch(self, structure_ids):
+        """
+        @param structure_ids: sorted tuple of structure ids, parents included
+        @return: the RuleBatch of the fix and percentage rules of these
+                 structures that can be computed for many payslips at once,
+                 or None when there is none, or numpy isn't installed
+        """
+        if numpy is None:
+            return None
+        plan = self._get_rule_plan(structure_ids)
+        graph = self._get_rule_graph(structure_ids)
+        if any(
+            references.stores & set(BATCH_ROOTS)
+            for references in graph.references.values()
+        ):
+            # a rule replaces a value read by the batch
+            return None
+        if (
+            "_compute_payslip_line"
+            in self.env["hr.payslip"]._get_rule_program_overrides()
+        ):
+            return None
+        rules = self.env["hr.salary.rule"].browse(plan.rule_ids)
+        steps = rules._get_program_steps()
+        if steps is None:
+            return None
+        batch_rules = []
+        for rule, step in zip(rules, steps):
+            if step.condition not in ("none", "range") or step.amount not in (
+                "fix",
+                "percentage",
+            ):
+                continue
+            getters = [
+                batch_getter(source)
+                for source, _mode in step.condition_sources + step.amount_sources
+            ]
+            if not all(getters):
+                continue
+            range_getter = getters.pop(0) if step.condition == "range" else None
+            batch_rules.append(
+                BatchRule(
+                    rule_id=rule.id,
+                    name=rule.name,
+                    amount_select=step.amount,
+                    amount_fix=rule.amount_fix,
+                    amount_percentage=rule.amount_percentage,
+                    range_min=rule.condition_range_min,
+                    range_max=rule.condition_range_max,
+                    range_getter=range_getter,
+                    quantity_getter=getters[0],
+                    base_getter=getters[1] if len(getters) > 1 else None,
+                )
+            )
+        return RuleBatch(batch_rules) if batch_rules else None
+
+    def get_rule_graph(self):
+        """
+        @return: the RuleGraph of the rules of the structure and of its
+                 parents: the codes they refer to, their dependencies, the
+                 sequence order violations and the topological levels
+        """
+        self.ensure_one()
+        return self._get_rule_graph(tuple(sorted(self._get_parent_structure().ids)))
@@ -1,12 +1,14 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+import json
 import logging
 import math
+from collections import defaultdict
 from datetime import date, datetime, time
 
 import babel
 from dateutil.relativedelta import relativedelta
-from pytz import timezone
+from pytz import timezone, utc
 
 from odoo import _, api, fields, models, tools
 from odoo.exceptions import UserError, ValidationError
@@ -18,7 +20,11 @@ from .base_browsable import (
     InputLine,
     Payslips,
     WorkedDays,
+    YearToDate,
 )
+from .hr_salary_rule_snapshot import LEAN_LINE_FIELDS
+from .payslip_history import PayslipHistory
+from .rule_program import RuleProgramRunner, is_overridden
 
 _logger = logging.getLogger(__name__)
 
@@ -168,6 +174,19 @@ class HrPayslip(models.Model):
         string="Show only lines that appear on payslip", default=False
     )
     compute_date = fields.Date("Compute Date")
+    line_values = fields.Text(
+        copy=False,
+        readonly=True,
+        help="Unrounded name, quantity, rate and amount of the lines, by line "
+        "key, saved by the last computation for the incremental recomputation, "
+        "with the versions of the rules and contracts they were computed from",
+    )
+    recompute_codes = fields.Char(
+        copy=False,
+        readonly=True,
+        help="Inputs and worked days changed since the last computation, like "
+        "'inputs.SALEURO worked_days.WORK100'",
+    )
     refunded_id = fields.Many2one(
         "hr.payslip", string="Refunded Payslip", readonly=True
     )
@@ -178,6 +197,23 @@ class HrPayslip(models.Model):
         "Prevent Compute on Confirm", compute="_compute_prevent_compute_on_confirm"
     )
 
+    def init(self):
+        super().init()
+        # history of the salary rules, see base_browsable
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS hr_payslip_done_employee_dates_idx
+            ON hr_payslip (employee_id, date_from, date_to)
+            WHERE state = 'done'"""
+        )
+        # done payslips of a period, e.g. the contribution register report
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS hr_payslip_done_dates_idx
+            ON hr_payslip (date_from, date_to)
+            WHERE state = 'done'"""
+        )
+
     def _compute_allow_cancel_payslips(self):
         self.allow_cancel_payslips = (
             self.env["ir.config_parameter"]
@@ -285,25 +321,336 @@ class HrPayslip(models.Model):
             )
         return super(HrPayslip, self).unlink()
 
+    def write(self, vals):
+        if set(vals) & set(self._get_full_recompute_fields()):
+            # the lines saved by the last computation can't be reused
+            vals = dict(vals, line_values=False, recompute_codes=False)
+        aggregates = self.env["hr.payslip.aggregate"]
+        refresh = set(vals) & set(self._get_aggregate_fields())
+        refresh = refresh and aggregates._is_enabled()
+        keys = self._get_aggregate_keys() if refresh else set()
+        done = "state" in vals and self.filtered(lambda p: p.state == "done")
+        res = super().write(vals)
+        if "state" in vals:
+            # update the year to date totals of the confirmed or cancelled
+            # payslips, refunds included
+            ytd = self.env["hr.payslip.ytd"]
+            ytd._add_payslips(done.filtered(lambda p: p.state != "done"), -1)
+            ytd._add_payslips(self.filtered(lambda p: p.state == "done") - done)
+        if refresh:
+            # the payslips moved in or out of the done state or of a month
+            aggregates._refresh(keys | self._get_aggregate_keys())
+        return res
+
+    def _get_aggregate_fields(self):
+        """@return: the fields of the payslips changing their monthly
+        aggregates, see hr.payslip.aggregate"""
+        return ["state", "employee_id", "date_from", "date_to", "credit_note"]
+
+    def _get_aggregate_keys(self):
+        """@return: set of the hr.payslip.aggregate keys of the done payslips"""
+        return {
+            (
+                payslip.employee_id.id,
+                payslip.date_from.replace(day=1),
+                payslip.date_to.replace(day=1),
+            )
+            for payslip in self
+            if payslip.state == "done"
+        }
+
+    def _get_full_recompute_fields(self):
+        return [
+            "employee_id",
+            "contract_id",
+            "struct_id",
+            "date_from",
+            "date_to",
+            "credit_note",
+            "company_id",
+        ]
+
     def compute_sheet(self):
-        for payslip in self:
-            # delete old payslip lines
-            payslip.line_ids.unlink()
-            # write payslip lines
-            number = payslip.number or self.env["ir.sequence"].next_by_code(
-                "salary.slip"
+        incremental = (
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("payroll.incremental_recompute")
+        )
+        # payslips computed together share the batched rules and the history
+        together = len(self) > 1 and not is_overridden(
+            self, HrPayslip, "get_lines_dict"
+        )
+        payslips = self.browse(
+            [
+                payslip.id
+                for payslip in self
+                if not (incremental and payslip._compute_sheet_incremental())
+            ]
+        )
+        # only the payslips computed in full use the batched rules, computed
+        # on the same localdicts as the other rules
+        history = together and payslips._get_payslip_history()
+        localdicts = (
+            {
+                payslip.id: payslip._get_contract_localdicts(history)
+                for payslip in payslips
+            }
+            if together
+            else {}
+        )
+        batch = payslips._compute_batch_rules(localdicts) if together else {}
+        # delete old payslip lines
+        payslips.mapped("line_ids").unlink()
+        line_vals_list = []
+        payslip_vals = {}
+        for payslip in payslips:
+            vals = payslip_vals.setdefault(payslip.id, {})
+            if not payslip.number:
+                vals["number"] = self.env["ir.sequence"].next_by_code("salary.slip")
+            if together:
+                lines_dict = payslip._compute_lines_dict(
+                    {},
+                    set(),
+                    batch=batch.get(payslip.id),
+                    localdicts=localdicts[payslip.id],
+                )
+            else:
+                lines_dict = payslip.get_lines_dict()
+            for line in lines_dict.values():
+                line_vals_list.append(dict(line, slip_id=payslip.id))
+            if incremental:
+                vals["line_values"] = payslip._dump_line_values(lines_dict)
+        # write payslip lines
+        self.env["hr.payslip.line"].create(self._prepare_line_vals_list(line_vals_list))
+        header_vals = {
+            "state": "verify",
+            "compute_date": fields.Date.today(),
+            "recompute_codes": False,
+        }
+        if not incremental:
+            header_vals["line_values"] = False
+        payslips.write(header_vals)
+        for payslip in payslips:
+            if payslip_vals[payslip.id]:
+                payslip.write(payslip_vals[payslip.id])
+        return True
+
+    def _get_payslip_history(self):
+        """
+        @return: the PayslipHistory of the employees of the payslips, from the
+                 start of the year before their first payslip, to cover the
+                 year-to-date and yearly history of the rules. None when there
+                 is no payslip.
+        """
+        if not self:
+            return None
+        date_start = min(self.mapped("date_from"))
+        date_end = max(self.mapped("date_to") + [fields.Date.today()])
+        return PayslipHistory(
+            self.env,
+            self.mapped("employee_id").ids,
+            date_start.replace(year=date_start.year - 1, month=1, day=1),
+            date_end,
+        )
+
+    @api.model
+    def _prepare_line_vals_list(self, vals_list):
+        """
+        Give the lines their stored total and, in lean line mode, link them
+        to the snapshot of their rule definition instead of copying the
+        definition on the lines
+        @param vals_list: list of the values of the lines to create, updated
+                          in place
+        @return: vals_list
+        """
+        line_model = self.env["hr.payslip.line"]
+        for vals in vals_list:
+            vals["total"] = line_model._prepare_total(vals)
+        if (
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("payroll.lean_payslip_lines")
+        ):
+            snapshot_ids = self.env["hr.salary.rule.snapshot"]._get_snapshot_ids(
+                vals_list
             )
-            lines = [(0, 0, line) for line in list(payslip.get_lines_dict().values())]
-            payslip.write(
-                {
-                    "line_ids": lines,
-                    "number": number,
-                    "state": "verify",
-                    "compute_date": fields.Date.today(),
-                }
+            for vals, snapshot_id in zip(vals_list, snapshot_ids):
+                vals["rule_snapshot_id"] = snapshot_id
+                vals.update(dict.fromkeys(LEAN_LINE_FIELDS, False))
+        return vals_list
+
+    @api.model
+    def _dump_line_values(self, lines_dict):
+        return json.dumps(
+            {
+                "source": self._get_line_values_source(),
+                "lines": {
+                    key: [line[name] for name in ("name", "quantity", "rate", "amount")]
+                    for key, line in lines_dict.items()
+                },
+            }
+        )
+
+    def _get_line_values_source(self):
+        """
+        @return: what the saved line values were computed from, besides the
+                 payslip: the version of the salary rules, structures and
+                 categories, and the last update of the contracts. The values
+                 are stale when it changes.
+        """
+        self.ensure_one()
+        return {
+            "rules": self.env["hr.payroll.structure"]._get_rule_cache_version(),
+            "contracts": {
+                str(contract.id): str(contract.write_date)
+                for contract in self._get_employee_contracts()
+            },
+        }
+
+    def _load_line_values(self):
+        """
+        @return: the line values saved by the last computation, by line key,
+                 or None when they are stale
+        """
+        self.ensure_one()
+        saved = json.loads(self.line_values or "{}")
+        if saved.get("source") != self._get_line_values_source():
+            return None
+        return saved["lines"]
+
+    def _add_recompute_codes(self, codes):
+        """
+        Record inputs or worked days changes, as "inputs.CODE" or
+        "worked_days.CODE", for the incremental recomputation
+        """
+        codes = set(codes)
+        for payslip in self.filtered("line_values"):
+            payslip.recompute_codes = " ".join(
+                sorted(set((payslip.recompute_codes or "").split()) | codes)
             )
+
+    def _get_incremental_unsafe_attributes(self):
+        # payslip values changed by the computation itself
+        return {
+            "payslip.line_ids",
+            "payslip.get_salary_line_total",
+            "payslip.dynamic_filtered_payslip_lines",
+        }
+
+    def _get_recompute_rule_ids(self, plan, graph, codes):
+        """
+        @param codes: the changed inputs and worked days
+        @return: set of the ids of the rules reading the changed inputs and
+                 worked days directly or through other rules and categories,
+                 with their children, or None if the payslip has to be fully
+                 computed
+        """
+        self.ensure_one()
+        rules = self.env["hr.salary.rule"].browse(plan.rule_ids)
+        if len(set(rules.mapped(lambda r: r.code or r.id))) != len(rules):
+            # lines of rules with the same code overwrite each other
+            return None
+        unsafe = self._get_incremental_unsafe_attributes()
+        rule_ids = set()
+        readers = {}
+        for rule_id in plan.rule_ids:
+            references = graph.references[rule_id]
+            if references.attributes & unsafe:
+                return None
+            for read_id in graph.dependency_ids[rule_id]:
+                readers.setdefault(read_id, set()).add(rule_id)
+            # rules assigning localdict values are always evaluated
+            if (
+                references.opaque
+                or references.stores
+                or any("inputs." + code in codes for code in references.inputs)
+                or any(
+                    "worked_days." + code in codes for code in references.worked_days
+                )
+            ):
+                rule_ids.add(rule_id)
+        todo = list(rule_ids)
+        while todo:
+            rule_id = todo.pop()
+            for other_id in readers.get(rule_id, set()) | plan.descendant_ids[rule_id]:
+                if other_id not in rule_ids:
+                    rule_ids.add(other_id)
+                    todo.append(other_id)
+        return rule_ids
+
+    def _compute_sheet_incremental(self):
+        """
+        Evaluate again only the rules affected by the inputs and worked days
+        changed since the last computation. The values of the other rules are
+        taken from that computation, and only the changed lines are written.
+        @return: False when the payslip has to be fully computed instead,
+                 e.g. when no input or worked day was changed
+        """
+        self.ensure_one()
+        codes = set((self.recompute_codes or "").split())
+        if not self.line_values or not self.line_ids or not codes:
+            return False
+        old_values = self._load_line_values()
+        if old_values is None:
+            # a rule or a contract changed since the last computation
+            return False
+        contracts = self._get_employee_contracts()
+        plan = self._get_rule_plan(contracts)
+        graph = self._get_rule_graph(contracts)
+        rule_ids = self._get_recompute_rule_ids(plan, graph, codes)
+        if rule_ids is None:
+            return False
+        replay = {}
+        for rule in self.env["hr.salary.rule"].browse(plan.rule_ids):
+            if rule.id not in rule_ids:
+                prefix = (rule.code or "id" + str(rule.id)) + "-"
+                replay[rule.id] = {
+                    contract.id: old_values.get(prefix + str(contract.id))
+                    for contract in contracts
+                }
+        lines_dict = {}
+        self._compute_lines_dict(lines_dict, set(), replay=replay)
+        self._update_lines(lines_dict, old_values)
+        self.write(
+            {
+                "state": "verify",
+                "compute_date": fields.Date.today(),
+                "line_values": self._dump_line_values(lines_dict),
+                "recompute_codes": False,
+            }
+        )
         return True
 
+    def _update_lines(self, lines_dict, old_values):
+        """
+        Write the changes of lines_dict on the payslip lines
+        @param old_values: the line values of the previous computation
+        """
+        self.ensure_one()
+        lines = {
+            (line.code or "id" + str(line.salary_rule_id.id))
+            + "-"
+            + str(line.contract_id.id): line
+            for line in self.line_ids
+        }
+        new_vals_list = []
+        for key, line_dict in lines_dict.items():
+            line = lines.pop(key, None)
+            values = [
+                line_dict[name] for name in ("name", "quantity", "rate", "amount")
+            ]
+            if not line:
+                new_vals_list.append(dict(line_dict))
+            elif values != old_values.get(key):
+                line.write(dict(zip(("name", "quantity", "rate", "amount"), values)))
+        new_lines = [
+            (0, 0, vals) for vals in self._prepare_line_vals_list(new_vals_list)
+        ]
+        for line in lines.values():
+            new_lines.append((2, line.id))
+        if new_lines:
+            self.write({"line_ids": new_lines})
+
     @api.model
     def get_worked_day_lines(self, contracts, date_from, date_to):
         """
@@ -339,15 +686,27 @@ class HrPayslip(models.Model):
         @return: returns a list containing the leave inputs for the period
         of the payslip. One record per leave type.
         """
+        day_leave_intervals = contract.employee_id.list_leaves(
+            day_from, day_to, calendar=contract.resource_calendar_id
+        )
+        return self._get_leave_day_lines(contract, day_leave_intervals)
+
+    def _get_leave_day_lines(self, contract, day_leave_intervals, work_hours=None):
+        """
+        @param day_leave_intervals: list of (day, hours, leaves) of the
+                                    list_leaves() of the employee
+        @param work_hours: dict caching the work hours of the calendar days,
+                           shared by the contracts of the same calendar
+        @return: the leave lines of the intervals, one per leave type
+        """
         leaves_positive = (
             self.env["ir.config_parameter"].sudo().get_param("payroll.leaves_positive")
         )
+        if work_hours is None:
+            work_hours = {}
         leaves = {}
         calendar = contract.resource_calendar_id
         tz = timezone(calendar.tz)
-        day_leave_intervals = contract.employee_id.list_leaves(
-            day_from, day_to, calendar=contract.resource_calendar_id
-        )
         for day, hours, leave in day_leave_intervals:
             holiday = leave[:1].holiday_id
             current_leave_struct = leaves.setdefault(
@@ -365,16 +724,18 @@ class HrPayslip(models.Model):
                 current_leave_struct["number_of_hours"] += hours
             else:
                 current_leave_struct["number_of_hours"] -= hours
-            work_hours = calendar.get_work_hours_count(
-                tz.localize(datetime.combine(day, time.min)),
-                tz.localize(datetime.combine(day, time.max)),
-                compute_leaves=False,
-            )
-            if work_hours:
+            if (calendar.id, day) not in work_hours:
+                work_hours[calendar.id, day] = calendar.get_work_hours_count(
+                    tz.localize(datetime.combine(day, time.min)),
+                    tz.localize(datetime.combine(day, time.max)),
+                    compute_leaves=False,
+                )
+            day_hours = work_hours[calendar.id, day]
+            if day_hours:
                 if leaves_positive:
-                    current_leave_struct["number_of_days"] += hours / work_hours
+                    current_leave_struct["number_of_days"] += hours / day_hours
                 else:
-                    current_leave_struct["number_of_days"] -= hours / work_hours
+                    current_leave_struct["number_of_days"] -= hours / day_hours
         return leaves.values()
 
     def _compute_worked_days(self, contract, day_from, day_to):
@@ -415,12 +776,11 @@ class HrPayslip(models.Model):
         structure_ids = contracts.get_all_structures()
         if current_structure:
             structure_ids = list(set(current_structure._get_parent_structure().ids))
-        rule_ids = (
-            self.env["hr.payroll.structure"].browse(structure_ids).get_all_rules()
+        plan = self.env["hr.payroll.structure"]._get_rule_plan(
+            tuple(sorted(set(structure_ids)))
         )
-        sorted_rule_ids = [id for id, sequence in sorted(rule_ids, key=lambda x: x[1])]
         payslip_inputs = (
-            self.env["hr.salary.rule"].browse(sorted_rule_ids).mapped("input_ids")
+            self.env["hr.salary.rule"].browse(plan.rule_ids).mapped("input_ids")
         )
         for contract in contracts:
             for payslip_input in payslip_inputs:
@@ -460,8 +820,8 @@ class HrPayslip(models.Model):
 
     def get_current_contract_dict(self, contract, contracts):
         """Contract dependent dictionary values.
-        This method is called just before the salary rules are evaluated for
-        contract.
+        This method is called when the localdict of the contract is built,
+        before the salary rules of the payslip are evaluated.
 
         This method is evaluated once for every contract in the payslip.
 
@@ -518,25 +878,91 @@ class HrPayslip(models.Model):
             "tools": BrowsableObject(
                 self.employee_id.id, self._get_tools_dict(), self.env
             ),
+            "ytd": YearToDate(self.employee_id.id, self.date_from.year, self.env),
         }
         return localdict
 
+    def _get_structure_ids(self, contracts):
+        """
+        @param contracts: Recordset of all hr.contract records in this payslip
+        @return: sorted tuple of the ids of the structures applied to this
+                 payslip, parents included
+        """
+        self.ensure_one()
+        if len(contracts) == 1 and self.struct_id:
+            structure_ids = self.struct_id._get_parent_structure().ids
+        else:
+            structure_ids = contracts.get_all_structures()
+        return tuple(sorted(set(structure_ids)))
+
+    def _get_rule_plan(self, contracts):
+        """
+        @param contracts: Recordset of all hr.contract records in this payslip
+        @return: the cached RulePlan of the structures applied to this payslip,
+                 or of the rules of _get_salary_rules() when another module
+                 overrides it
+        """
+        structure_model = self.env["hr.payroll.structure"]
+        if is_overridden(self, HrPayslip, "_get_salary_rules"):
+            return structure_model._get_rules_plan(tuple(self._get_salary_rules().ids))
+        return structure_model._get_rule_plan(self._get_structure_ids(contracts))
+
+    def _get_rule_graph(self, contracts):
+        """
+        @param contracts: Recordset of all hr.contract records in this payslip
+        @return: the cached RuleGraph of the rules of the plan of the payslip
+        """
+        return self.env["hr.payroll.structure"]._get_rules_graph(
+            self._get_rule_plan(contracts).rule_ids
+        )
+
+    def _get_rule_program(self, contracts):
+        """
+        @param contracts: Recordset of all hr.contract records in this payslip
+        @return: the cached RuleProgram of the structures applied to this
+                 payslip when they use the compiled engine, None otherwise
+        """
+        self.ensure_one()
+        if len(contracts) == 1 and self.struct_id:
+            structures = self.struct_id
+        else:
+            structures = contracts.mapped("struct_id")
+        if (
+            not structures
+            or any(struct.rule_engine != "compiled" for struct in structures)
+            or is_overridden(self, HrPayslip, "_get_salary_rules")
+        ):
+            return None
+        return self.env["hr.payroll.structure"]._get_rule_program(
+            self._get_structure_ids(contracts)
+        )
+
+    @api.model
+    def _get_rule_program_overrides(self):
+        """
+        @return: set of the line bookkeeping methods overridden by other
+                 modules. A RuleProgram calls them instead of doing their work
+                 itself.
+        """
+        return {
+            method
+            for method in (
+                "_compute_payslip_line",
+                "_get_lines_dict",
+                "_sum_salary_rule_category",
+            )
+            if is_overridden(self, HrPayslip, method)
+        }
+
     def _get_salary_rules(self):
         rule_obj = self.env["hr.salary.rule"]
         sorted_rules = rule_obj
         for payslip in self:
             contracts = payslip._get_employee_contracts()
-            if len(contracts) == 1 and payslip.struct_id:
-                structure_ids = list(set(payslip.struct_id._get_parent_structure().ids))
-            else:
-                structure_ids = contracts.get_all_structures()
-            rule_ids = (
-                self.env["hr.payroll.structure"].browse(structure_ids).get_all_rules()
+            plan = self.env["hr.payroll.structure"]._get_rule_plan(
+                payslip._get_structure_ids(contracts)
             )
-            sorted_rule_ids = [
-                id for id, sequence in sorted(rule_ids, key=lambda x: x[1])
-            ]
-            sorted_rules |= rule_obj.browse(sorted_rule_ids)
+            sorted_rules |= rule_obj.browse(plan.rule_ids)
         return sorted_rules
 
     def _compute_payslip_line(self, rule, localdict, lines_dict):
@@ -553,8 +979,11 @@ class HrPayslip(models.Model):
     def _get_lines_dict(
         self, rule, localdict, lines_dict, key, values, previous_amount
     ):
-        total = values["quantity"] * values["rate"] * values["amount"] / 100.0
-        values["total"] = total
+        if "total" in values:
+            total = values["total"]
+        else:
+            total = values["quantity"] * values["rate"] * values["amount"] / 100.0
+            values["total"] = total
         # set/overwrite the amount computed for this rule in the localdict
         code = rule.code or rule.id
         localdict[code] = total
@@ -569,6 +998,19 @@ class HrPayslip(models.Model):
             "salary_rule_id": rule.id,
             "employee_id": localdict["employee"].id,
             "contract_id": localdict["contract"].id,
+        }
+        line_dict.update(self._get_rule_line_values(rule))
+        line_dict.update(values)
+        lines_dict[key] = line_dict
+        return localdict, lines_dict
+
+    @api.model
+    def _get_rule_line_values(self, rule):
+        """
+        @return: the values of the payslip lines of the rule that don't depend
+                 on the computation
+        """
+        return {
             "code": rule.code,
             "category_id": rule.category_id.id,
             "sequence": rule.sequence,
@@ -586,9 +1028,6 @@ class HrPayslip(models.Model):
             "amount_percentage_base": rule.amount_percentage_base,
             "register_id": rule.register_id.id,
         }
-        line_dict.update(values)
-        lines_dict[key] = line_dict
-        return localdict, lines_dict
 
     @api.model
     def _get_payslip_lines(self, _contract_ids, payslip_id):
@@ -600,43 +1039,259 @@ class HrPayslip(models.Model):
 
     def get_lines_dict(self):
         lines_dict = {}
-        blacklist = []
+        blacklist = set()
         for payslip in self:
-            contracts = payslip._get_employee_contracts()
-            baselocaldict = payslip._get_baselocaldict(contracts)
-            for contract in contracts:
-                # assign "current_contract" dict
-                baselocaldict["current_contract"] = BrowsableObject(
-                    payslip.employee_id.id,
-                    payslip.get_current_contract_dict(contract, contracts),
-                    payslip.env,
-                )
-                # set up localdict with current contract and employee values
-                localdict = dict(
-                    baselocaldict,
-                    employee=contract.employee_id,
-                    contract=contract,
-                    payslip=payslip,
+            payslip._compute_lines_dict(lines_dict, blacklist)
+        return lines_dict
+
+    def _compute_lines_dict(
+        self,
+        lines_dict,
+        blacklist,
+        replay=None,
+        rule_ids=None,
+        batch=None,
+        history=None,
+        localdicts=None,
+    ):
+        """
+        Compute the lines of all the contracts of the payslip into lines_dict
+        @param replay: optional dict {rule id: {contract id: line values}} of
+                       the rules not to evaluate, with the name, quantity,
+                       rate and amount of their line, or None when the rule
+                       wasn't applied
+        @param rule_ids: optional set of the ids of the only rules to evaluate
+        @param batch: optional dict {contract id: {rule id: (condition, line
+                      values)}} of the rules computed by a RuleBatch, see
+                      _compute_batch_rules()
+        @param history: optional PayslipHistory answering the payslips
+                        helpers of the rules
+        @param localdicts: optional result of _get_contract_localdicts()
+                           already built for this payslip
+        """
+        self.ensure_one()
+        contracts = self._get_employee_contracts()
+        if localdicts is None:
+            localdicts = self._get_contract_localdicts(history)
+        plan = self._get_rule_plan(contracts)
+        rules = self.env["hr.salary.rule"].browse(
+            [rule_id for rule_id in plan.rule_ids if rule_id in rule_ids]
+            if rule_ids is not None
+            else plan.rule_ids
+        )
+        program = (
+            not replay
+            and rule_ids is None
+            and not batch
+            and self._get_rule_program(contracts)
+        )
+        for contract, localdict in localdicts:
+            if program:
+                localdict = RuleProgramRunner(
+                    program, self, localdict, lines_dict, blacklist
+                ).run()
+            else:
+                localdict = self._compute_rules(
+                    rules,
+                    plan,
+                    localdict,
+                    lines_dict,
+                    blacklist,
+                    replay,
+                    batch and batch.get(contract.id),
                 )
-                for rule in payslip._get_salary_rules():
-                    localdict = rule._reset_localdict_values(localdict)
-                    # check if the rule can be applied
-                    if rule._satisfy_condition(localdict) and rule.id not in blacklist:
-                        localdict, _dict = payslip._compute_payslip_line(
-                            rule, localdict, lines_dict
-                        )
-                        lines_dict.update(_dict)
-                    else:
-                        # blacklist this rule and its children
-                        blacklist += [
-                            id for id, seq in rule._recursive_search_of_rules()
-                        ]
-                # call localdict_hook
-                localdict = payslip.localdict_hook(localdict)
-                # reset "current_contract" dict
-                baselocaldict["current_contract"] = {}
+            # call localdict_hook
+            localdict = self.localdict_hook(localdict)
         return lines_dict
 
+    def _get_contract_localdicts(self, history=None):
+        """
+        @param history: optional PayslipHistory answering the payslips
+                        helpers of the rules
+        @return: list of (contract, localdict) with the localdict the rules of
+                 each contract of the payslip are evaluated with
+        """
+        self.ensure_one()
+        contracts = self._get_employee_contracts()
+        baselocaldict = self._get_baselocaldict(contracts)
+        if history and isinstance(baselocaldict["payslips"], Payslips):
+            baselocaldict["payslips"].history = history
+        result = []
+        for contract in contracts:
+            # set up localdict with current contract and employee values
+            localdict = dict(
+                baselocaldict,
+                current_contract=BrowsableObject(
+                    self.employee_id.id,
+                    self.get_current_contract_dict(contract, contracts),
+                    self.env,
+                ),
+                employee=contract.employee_id,
+                contract=contract,
+                payslip=self,
+            )
+            result.append((contract, localdict))
+        return result
+
+    def _compute_rules(
+        self, rules, plan, localdict, lines_dict, blacklist, replay=None, batch=None
+    ):
+        """
+        Compute the rules of the plan one by one for the contract of localdict
+        @param replay: see _compute_lines_dict()
+        @param batch: optional dict {rule id: (condition, line values)} of the
+                      rules already computed for this contract by a RuleBatch
+        @return: the updated localdict
+        """
+        self.ensure_one()
+        replay = replay or {}
+        batch = batch or {}
+        # results of the rule conditions evaluated for this contract
+        satisfied = {rule_id: condition for rule_id, (condition, _l) in batch.items()}
+        for rule in rules:
+            localdict = rule._reset_localdict_values(localdict)
+            if rule.id in replay:
+                # reuse the line of the previous computation
+                values = rule.id not in blacklist and replay[rule.id].get(
+                    localdict["contract"].id
+                )
+                if values:
+                    localdict, _dict = self._replay_payslip_line(
+                        rule, localdict, lines_dict, values
+                    )
+                    lines_dict.update(_dict)
+                else:
+                    blacklist |= plan.descendant_ids[rule.id]
+            # check if the rule can be applied
+            elif rule.id not in blacklist and rule._satisfy_condition(
+                localdict, satisfied
+            ):
+                if rule.id in batch and batch[rule.id][1]:
+                    localdict, _dict = self._replay_payslip_line(
+                        rule, localdict, lines_dict, batch[rule.id][1]
+                    )
+                else:
+                    localdict, _dict = self._compute_payslip_line(
+                        rule, localdict, lines_dict
+                    )
+                lines_dict.update(_dict)
+            else:
+                # blacklist this rule and its children
+                blacklist |= plan.descendant_ids[rule.id]
+        return localdict
+
+    def _compute_batch_rules(self, localdicts):
+        """
+        Compute the fix and percentage rules of the payslips that only read
+        their contract, employee, worked days and inputs for all the payslips
+        at once, see RuleBatch. Payslips using the compiled engine are left
+        out.
+        @param localdicts: dict {payslip id: result of
+                           _get_contract_localdicts()}
+        @return: dict {payslip id: {contract id: {rule id: (condition, line
+                 values)}}}
+        """
+        if is_overridden(self, HrPayslip, "_get_salary_rules"):
+            # the batches are built from the rules of the structures
+            return {}
+        groups = {}
+        for payslip in self:
+            contracts = payslip._get_employee_contracts()
+            if payslip._get_rule_program(contracts):
+                continue
+            structure_ids = payslip._get_structure_ids(contracts)
+            groups.setdefault(structure_ids, []).append((payslip, contracts))
+        result = {}
+        for structure_ids, payslips in groups.items():
+            batch = self.env["hr.payroll.structure"]._get_rule_batch(structure_ids)
+            if not batch:
+                continue
+            rows = [
+                ((payslip.id, contract.id), localdict)
+                for payslip, _contracts in payslips
+                for contract, localdict in localdicts[payslip.id]
+            ]
+            for (payslip_id, contract_id), values in batch.compute(rows).items():
+                result.setdefault(payslip_id, {})[contract_id] = values
+        return result
+
+    def _replay_payslip_line(self, rule, localdict, lines_dict, values):
+        """
+        Same as _compute_payslip_line(), with the [name, quantity, rate,
+        amount] of the line of a previous computation, and its total when it
+        is already computed, see RuleBatch
+        """
+        self.ensure_one()
+        previous_amount = rule.code in localdict and localdict[rule.code] or 0.0
+        values = dict(zip(("name", "quantity", "rate", "amount", "total"), values))
+        key = (rule.code or "id" + str(rule.id)) + "-" + str(localdict["contract"].id)
+        return self._get_lines_dict(
+            rule, localdict, lines_dict, key, values, previous_amount
+        )
+
+    def compute_codes(self, codes):
+        """
+        Evaluate only the rules needed to get the given rule or category codes,
+        e.g. for a preview of the net salary. Nothing is written.
+        @param codes: list of rule or category codes, like ["NET"]
+        @return: dict {code: total of the rule, or sum of the category}
+        """
+        self.ensure_one()
+        codes = set(codes)
+        contracts = self._get_employee_contracts()
+        plan = self._get_rule_plan(contracts)
+        graph = self._get_rule_graph(contracts)
+        rules = self.env["hr.salary.rule"].browse(plan.rule_ids)
+        rule_ids = self._get_needed_rule_ids(plan, graph, codes)
+        lines_dict = {}
+        self._compute_lines_dict(lines_dict, set(), rule_ids=rule_ids)
+        rule_codes = set(rules.mapped("code"))
+        result = dict.fromkeys(codes, 0.0)
+        for line in lines_dict.values():
+            category = self.env["hr.salary.rule.category"].browse(line["category_id"])
+            for code in codes:
+                if (
+                    line["code"] == code
+                    if code in rule_codes
+                    else code in category._get_sum_codes()
+                ):
+                    result[code] += line["total"]
+        return result
+
+    def _get_needed_rule_ids(self, plan, graph, codes):
+        """
+        @param codes: set of rule or category codes
+        @return: set of the ids of the rules having these codes or adding to
+                 these categories, and of all the rules they need: the rules
+                 they read, their parents, and the rules before them having
+                 the same code
+        """
+        rules = self.env["hr.salary.rule"].browse(plan.rule_ids)
+        position = {rule_id: index for index, rule_id in enumerate(plan.rule_ids)}
+        by_code = {}
+        for rule in rules:
+            by_code.setdefault(rule.code, set()).add(rule.id)
+        rule_ids = {
+            rule.id
+            for rule in rules
+            if rule.code in codes or codes & set(rule.category_id._get_sum_codes())
+        }
+        todo = list(rule_ids)
+        while todo:
+            rule = self.env["hr.salary.rule"].browse(todo.pop())
+            needed = graph.dependency_ids[rule.id] | set(plan.parent_ids[rule.id])
+            if rule.code:
+                needed |= by_code[rule.code]
+            if rule.id in graph.opaque_ids:
+                needed |= set(plan.rule_ids[: position[rule.id]])
+            for rule_id in needed - rule_ids:
+                if rule_id not in position:
+                    # parent rule outside of the structures
+                    continue
+                rule_ids.add(rule_id)
+                todo.append(rule_id)
+        return rule_ids
+
     def localdict_hook(self, localdict):
         # This hook is called when the function _get_lines_dict ends the loop
         # and before its returns. This method by itself don't add any functionality
@@ -697,16 +1352,180 @@ class HrPayslip(models.Model):
         )
         return res
 
-    def _sum_salary_rule_category(self, localdict, category, amount):
-        self.ensure_one()
-        if category.parent_id:
-            localdict = self._sum_salary_rule_category(
-                localdict, category.parent_id, amount
+    @api.model
+    def get_payslip_vals_batch(self, employees, date_from, date_to, struct_id=False):
+        """
+        Values of get_payslip_vals() for the payslips of many employees, with
+        the contracts, worked days and inputs of all of them resolved together
+        and their name
+        @param struct_id: id of the structure of every payslip, the one of
+                          their contract when False
+        @return: dict {employee id: values of the new payslip}
+        """
+        if self.env.context.get("contract") or is_overridden(
+            self, HrPayslip, "get_payslip_vals"
+        ):
+            res = {
+                employee.id: self.get_payslip_vals(
+                    date_from,
+                    date_to,
+                    employee.id,
+                    struct_id=struct_id and [struct_id],
+                )["value"]
+                for employee in employees
+            }
+        else:
+            res = self._get_payslip_vals_batch(employees, date_from, date_to, struct_id)
+        if date_from:
+            name = _("Salary Slip of %s for %s")
+            month = self._get_name_month(date_from)
+            for employee in employees:
+                if not res[employee.id]["name"]:
+                    res[employee.id]["name"] = name % (employee.name, month)
+        return res
+
+    @api.model
+    def _get_payslip_vals_batch(self, employees, date_from, date_to, struct_id):
+        res = {}
+        # values of the payslips with a contract and a structure
+        contract_vals = {}
+        for employee in employees:
+            res[employee.id] = values = {
+                "line_ids": [],
+                "input_line_ids": [],
+                "worked_days_line_ids": [],
+                "name": "",
+                "contract_id": False,
+                "struct_id": False,
+            }
+            # the contracts of all the employees are read together
+            contract = employee.contract_id
+            if not date_from or not date_to or not contract:
+                continue
+            values["contract_id"] = contract.id
+            values["struct_id"] = struct_id or contract.struct_id.id
+            if values["struct_id"]:
+                contract_vals[contract.id] = values
+        contracts = self.env["hr.contract"].browse(list(contract_vals))
+        worked_days = self._get_worked_day_lines_batch(contracts, date_from, date_to)
+        inputs = self._get_inputs_batch(contracts, date_from, date_to)
+        for contract_id, values in contract_vals.items():
+            values["worked_days_line_ids"] = worked_days.get(contract_id, [])
+            values["input_line_ids"] = inputs.get(contract_id, [])
+        return res
+
+    @api.model
+    def _get_worked_day_lines_batch(self, contracts, date_from, date_to):
+        """
+        @return: dict {contract id: lines of get_worked_day_lines()} of the
+                 payslips of each contract. The attendance and leave intervals
+                 of the employees are computed together for the contracts of
+                 the same calendar and start day.
+        """
+        if any(
+            is_overridden(self, HrPayslip, method)
+            for method in (
+                "get_worked_day_lines",
+                "_compute_leave_days",
+                "_compute_worked_days",
+            )
+        ):
+            return {
+                contract.id: self.get_worked_day_lines(contract, date_from, date_to)
+                for contract in contracts
+            }
+        res = {contract.id: [] for contract in contracts}
+        day_to = datetime.combine(date_to, time.max)
+        contract_ids = defaultdict(list)
+        for contract in contracts.filtered(
+            lambda contract: contract.resource_calendar_id
+        ):
+            # only use payslip day_from if it's greather than contract start date
+            day_from = max(
+                datetime.combine(date_from, time.min),
+                datetime.combine(contract.date_start, time.min),
+            )
+            contract_ids[contract.resource_calendar_id, day_from].append(contract.id)
+        work_hours = {}
+        for (calendar, day_from), ids in contract_ids.items():
+            # Support for the hr_public_holidays module.
+            group = (
+                self.env["hr.contract"]
+                .browse(ids)
+                .with_context(
+                    employee_id=self.employee_id.id, exclude_public_holidays=True
+                )
+            )
+            calendar = calendar.with_env(group.env)
+            day_leave_intervals = self._list_leaves_batch(
+                group.employee_id, calendar, day_from, day_to
             )
-        if category.code:
-            localdict["categories"].dict[category.code] = (
-                localdict["categories"].dict.get(category.code, 0) + amount
+            work_data = group.employee_id._get_work_days_data_batch(
+                day_from, day_to, compute_leaves=False, calendar=calendar
             )
+            for contract in group:
+                employee = contract.employee_id
+                res[contract.id].extend(
+                    self._get_leave_day_lines(
+                        contract, day_leave_intervals[employee.id], work_hours
+                    )
+                )
+                res[contract.id].append(
+                    {
+                        "name": _("Normal Working Days paid at 100%"),
+                        "sequence": 1,
+                        "code": "WORK100",
+                        "number_of_days": work_data[employee.id]["days"],
+                        "number_of_hours": work_data[employee.id]["hours"],
+                        "contract_id": contract.id,
+                    }
+                )
+        return res
+
+    @api.model
+    def _list_leaves_batch(self, employees, calendar, day_from, day_to):
+        """
+        list_leaves() of many employees, with the intervals of all of them
+        computed together
+        @return: dict {employee id: list of (day, hours, leaves)}
+        """
+        # naive datetimes are made explicit in UTC
+        start_dt = day_from.replace(tzinfo=utc)
+        end_dt = day_to.replace(tzinfo=utc)
+        resources = employees.resource_id
+        attendances = calendar._attendance_intervals_batch(start_dt, end_dt, resources)
+        leaves = calendar._leave_intervals_batch(start_dt, end_dt, resources)
+        res = {}
+        for employee in employees:
+            resource_id = employee.resource_id.id
+            res[employee.id] = [
+                (start.date(), (stop - start).total_seconds() / 3600, leave)
+                for start, stop, leave in leaves[resource_id] & attendances[resource_id]
+            ]
+        return res
+
+    @api.model
+    def _get_inputs_batch(self, contracts, date_from, date_to):
+        """
+        @return: dict {contract id: lines of get_inputs()} of the payslips of
+                 each contract, computed once for the contracts of a structure
+        """
+        contract_ids = defaultdict(list)
+        for contract in contracts:
+            contract_ids[contract.struct_id].append(contract.id)
+        res = {contract.id: [] for contract in contracts}
+        for ids in contract_ids.values():
+            for line in self.get_inputs(
+                self.env["hr.contract"].browse(ids), date_from, date_to
+            ):
+                res[line["contract_id"]].append(line)
+        return res
+
+    def _sum_salary_rule_category(self, localdict, category, amount):
+        self.ensure_one()
+        sums = localdict["categories"].dict
+        for code in category._get_sum_codes():
+            sums[code] = sums.get(code, 0) + amount
         return localdict
 
     def _get_employee_contracts(self):
@@ -776,18 +1595,24 @@ class HrPayslip(models.Model):
             # Assign company_id automatically based on employee selected.
             payslip.company_id = payslip.employee_id.company_id
 
+    @api.model
+    def _get_name_month(self, date_from):
+        return tools.ustr(
+            babel.dates.format_date(
+                date=datetime.combine(date_from, time.min),
+                format="MMMM-y",
+                locale=self.env.context.get("lang") or "en_US",
+            )
+        )
+
     def _compute_name(self):
+        name = _("Salary Slip of %s for %s")
+        # payslips of a batch share their month, format it once
+        months = {}
         for record in self:
-            record.name = _("Salary Slip of %s for %s") % (
-                record.employee_id.name,
-                tools.ustr(
-                    babel.dates.format_date(
-                        date=datetime.combine(record.date_from, time.min),
-                        format="MMMM-y",
-                        locale=record.env.context.get("lang") or "en_US",
-                    )
-                ),
-            )
+            if record.date_from not in months:
+                months[record.date_from] = self._get_name_month(record.date_from)
+            record.name = name % (record.employee_id.name, months[record.date_from])
 
     @api.onchange("contract_id")
     def onchange_contract(self):
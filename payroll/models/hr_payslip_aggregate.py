@@ -0,0 +1,263 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+from .payslip_history import _to_date
+
+# SELECT of the aggregates of each kind, from the lines of the done payslips.
+# {where} restricts the payslips.
+AGGREGATE_QUERIES = {
+    "rule": """
+        SELECT hp.employee_id, 'rule', pl.code, pl.category_id,
+            date_trunc('month', hp.date_from)::date,
+            date_trunc('month', hp.date_to)::date, hp.credit_note,
+            count(*), sum(pl.total), min(pl.total), max(pl.total), 0
+        FROM hr_payslip as hp, hr_payslip_line as pl
+        WHERE hp.state = 'done' AND hp.id = pl.slip_id {where}
+        GROUP BY hp.employee_id, pl.code, pl.category_id, 5, 6, hp.credit_note
+    """,
+    "input": """
+        SELECT hp.employee_id, 'input', pi.code, NULL,
+            date_trunc('month', hp.date_from)::date,
+            date_trunc('month', hp.date_to)::date, hp.credit_note,
+            count(*), sum(pi.amount), min(pi.amount), max(pi.amount), 0
+        FROM hr_payslip as hp, hr_payslip_input as pi
+        WHERE hp.state = 'done' AND hp.id = pi.payslip_id {where}
+        GROUP BY hp.employee_id, pi.code, 5, 6, hp.credit_note
+    """,
+    "worked_days": """
+        SELECT hp.employee_id, 'worked_days', pi.code, NULL,
+            date_trunc('month', hp.date_from)::date,
+            date_trunc('month', hp.date_to)::date, hp.credit_note,
+            count(*), sum(pi.number_of_days), min(pi.number_of_days),
+            max(pi.number_of_days), sum(pi.number_of_hours)
+        FROM hr_payslip as hp, hr_payslip_worked_days as pi
+        WHERE hp.state = 'done' AND hp.id = pi.payslip_id {where}
+        GROUP BY hp.employee_id, pi.code, 5, 6, hp.credit_note
+    """,
+}
+
+# unique key of the aggregates, so the refreshes of concurrent transactions
+# conflict instead of adding the same aggregates twice. The nullable columns
+# are coalesced as NULLs never conflict.
+AGGREGATE_KEY = """employee_id, kind, COALESCE(code, ''), COALESCE(category_id, 0),
+    month_from, month_to, COALESCE(credit_note::int, -1)"""
+
+# sign of the totals of the Payslips *_rule() and *_category() helpers,
+# which don't handle an empty credit_note the same way
+SIGNS = {
+    "rule": "CASE WHEN a.credit_note = False THEN 1 ELSE -1 END",
+    "category": "CASE WHEN a.credit_note IS NOT True THEN 1 ELSE -1 END",
+}
+
+# aggregate of the line totals from the monthly aggregates
+FUNCTIONS = {
+    "sum": "sum({sign} * a.total)",
+    "avg": "sum({sign} * a.total) / NULLIF(sum(a.line_count), 0)",
+    "max": "max(CASE WHEN {sign} = 1 THEN a.max_total ELSE -a.min_total END)",
+    "min": "min(CASE WHEN {sign} = 1 THEN a.min_total ELSE -a.max_total END)",
+}
+
+
+class HrPayslipAggregate(models.Model):
+    """
+    Totals of the lines, inputs and worked days of the done payslips, by
+    employee, code, category, month of the payslip start and end dates and
+    credit note. The history helpers of the salary rules read them instead of
+    the payslip lines for date ranges made of whole months.
+    """
+
+    _name = "hr.payslip.aggregate"
+    _description = "Payslip Monthly Aggregate"
+    _order = "employee_id, month_from, code"
+
+    employee_id = fields.Many2one(
+        "hr.employee", required=True, readonly=True, index=True, ondelete="cascade"
+    )
+    kind = fields.Selection(
+        [("rule", "Salary Rule"), ("input", "Input"), ("worked_days", "Worked Days")],
+        required=True,
+        readonly=True,
+    )
+    code = fields.Char(readonly=True, index=True)
+    category_id = fields.Many2one(
+        "hr.salary.rule.category", readonly=True, ondelete="cascade"
+    )
+    month_from = fields.Date(
+        readonly=True, help="First day of the month of the payslip start date"
+    )
+    month_to = fields.Date(
+        readonly=True, help="First day of the month of the payslip end date"
+    )
+    credit_note = fields.Boolean(readonly=True)
+    line_count = fields.Integer(readonly=True)
+    total = fields.Float(
+        readonly=True, help="Sum of the line totals, input amounts or worked days"
+    )
+    min_total = fields.Float(readonly=True)
+    max_total = fields.Float(readonly=True)
+    hours = fields.Float(readonly=True, help="Sum of the worked hours")
+
+    def init(self):
+        super().init()
+        self.env.cr.execute(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS hr_payslip_aggregate_key_idx
+            ON hr_payslip_aggregate ({})""".format(
+                AGGREGATE_KEY
+            )
+        )
+
+    @api.model
+    def _is_enabled(self):
+        return bool(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("payroll.history_aggregate")
+        )
+
+    @api.model
+    def _insert(self, where="", params=()):
+        cr = self.env.cr
+        for query in AGGREGATE_QUERIES.values():
+            cr.execute(
+                """
+                INSERT INTO hr_payslip_aggregate (employee_id, kind, code,
+                    category_id, month_from, month_to, credit_note, line_count,
+                    total, min_total, max_total, hours)
+                """
+                + query.format(where=where)
+                + """
+                ON CONFLICT ({}) DO UPDATE SET line_count = EXCLUDED.line_count,
+                    total = EXCLUDED.total, min_total = EXCLUDED.min_total,
+                    max_total = EXCLUDED.max_total, hours = EXCLUDED.hours
+                """.format(
+                    AGGREGATE_KEY
+                ),
+                params,
+            )
+
+    @api.model
+    def rebuild(self):
+        """Compute all the aggregates again from the done payslips"""
+        self.flush()
+        self.env.cr.execute("DELETE FROM hr_payslip_aggregate")
+        self._insert()
+        self.invalidate_cache()
+        return True
+
+    @api.model
+    def _refresh(self, keys):
+        """
+        Compute again the aggregates of some employees and months, after
+        payslips of these months were confirmed, cancelled or changed
+        @param keys: set of (employee id, first day of the month of the start
+                     date, first day of the month of the end date)
+
+        The aggregates inserted by a concurrent transaction are invisible to
+        the DELETE, the upsert then fails on the unique key with a
+        serialization error and the transaction is retried, instead of
+        counting them twice.
+        """
+        if not keys or not self._is_enabled():
+            return
+        self.flush()
+        keys = tuple(keys)
+        self.env.cr.execute(
+            """
+            DELETE FROM hr_payslip_aggregate
+            WHERE (employee_id, month_from, month_to) IN %s""",
+            (keys,),
+        )
+        self._insert(
+            """AND (hp.employee_id, date_trunc('month', hp.date_from)::date,
+                date_trunc('month', hp.date_to)::date) IN %s""",
+            (keys,),
+        )
+        self.invalidate_cache()
+
+    @api.model
+    def _get_months(self, from_date, to_date):
+        """
+        @return: (first month, first day of the last month) of the date range
+                 when the aggregates cover it, i.e. when it is made of whole
+                 months, None otherwise
+        """
+        if not self._is_enabled():
+            return None
+        from_date, to_date = _to_date(from_date), _to_date(to_date)
+        if (
+            not from_date
+            or not to_date
+            or from_date.day != 1
+            or (to_date + timedelta(days=1)).day != 1
+        ):
+            return None
+        return from_date, to_date.replace(day=1)
+
+    @api.model
+    def _get_line_value(
+        self, employee_id, from_date, to_date, function, code=None, categories=None
+    ):
+        """
+        Same as the Payslips *_rule() and *_category() helpers
+        @param function: "sum", "avg", "max", "min", or "monthly_" followed by
+                         one of them to aggregate the monthly sums
+        @param code: the rule code, for the *_rule() helpers
+        @param categories: the category codes, for the *_category() helpers
+        @return: the aggregate, or None when the date range isn't covered
+        """
+        months = self._get_months(from_date, to_date)
+        if months is None:
+            return None
+        sign = SIGNS["rule" if categories is None else "category"]
+        if categories is None:
+            condition, param = "a.code = %s", code
+        else:
+            condition = """a.category_id IN (
+                SELECT id FROM hr_salary_rule_category WHERE code IN %s)"""
+            param = tuple(categories)
+        where = (
+            """a.kind = 'rule' AND a.employee_id = %s AND a.month_from >= %s
+            AND a.month_to <= %s AND """
+            + condition
+        )
+        params = (employee_id,) + months + (param,)
+        if function.startswith("monthly_"):
+            query = """SELECT {function}(total) FROM (
+                SELECT a.month_from, sum({sign} * a.total) AS total
+                FROM hr_payslip_aggregate as a WHERE {where}
+                GROUP BY a.month_from) AS monthly_sum""".format(
+                function=function[len("monthly_") :], sign=sign, where=where
+            )
+        else:
+            query = "SELECT {} FROM hr_payslip_aggregate as a WHERE {}".format(
+                FUNCTIONS[function].format(sign=sign), where
+            )
+        self.flush()
+        self.env.cr.execute(query, params)
+        res = self.env.cr.fetchone()
+        return res and res[0] or 0.0
+
+    @api.model
+    def _get_sums(self, kind, employee_id, code, from_date, to_date):
+        """
+        Same as the InputLine and WorkedDays sum helpers
+        @param kind: "input" or "worked_days"
+        @return: (sum of the amounts or worked days, sum of the worked hours),
+                 or None when the date range isn't covered
+        """
+        months = self._get_months(from_date, to_date)
+        if months is None:
+            return None
+        self.flush()
+        self.env.cr.execute(
+            """
+            SELECT sum(a.total), sum(a.hours) FROM hr_payslip_aggregate as a
+            WHERE a.kind = %s AND a.employee_id = %s AND a.month_from >= %s
+            AND a.month_to <= %s AND a.code = %s""",
+            (kind, employee_id) + months + (code,),
+        )
+        return self.env.cr.fetchone()
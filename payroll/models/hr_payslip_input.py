@@ -1,6 +1,6 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-from odoo import fields, models
+from odoo import api, fields, models
 
 
 class HrPayslipInput(models.Model):
@@ -30,3 +30,27 @@ class HrPayslipInput(models.Model):
         required=True,
         help="The contract for which applied this input",
     )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._add_recompute_codes()
+        return records
+
+    def write(self, vals):
+        self._add_recompute_codes()
+        res = super().write(vals)
+        self._add_recompute_codes()
+        return res
+
+    def unlink(self):
+        self._add_recompute_codes()
+        return super().unlink()
+
+    def _add_recompute_codes(self):
+        for payslip in self.mapped("payslip_id"):
+            payslip._add_recompute_codes(
+                "inputs." + record.code
+                for record in self
+                if record.payslip_id == payslip
+            )
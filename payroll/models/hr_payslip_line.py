@@ -3,6 +3,8 @@
 from odoo import _, api, fields, models
 from odoo.exceptions import UserError
 
+from .hr_salary_rule_snapshot import LEAN_LINE_FIELDS, SNAPSHOT_FIELDS
+
 
 class HrPayslipLine(models.Model):
     _name = "hr.payslip.line"
@@ -36,14 +38,48 @@ class HrPayslipLine(models.Model):
     quantity = fields.Float(digits="Payroll", default=1.0)
     total = fields.Float(
         compute="_compute_total",
+        inverse="_inverse_total",
         string="Total",
         digits="Payroll",
         store=True,
+        readonly=True,
+    )
+    rule_snapshot_id = fields.Many2one(
+        "hr.salary.rule.snapshot",
+        string="Rule Definition",
+        readonly=True,
+        ondelete="restrict",
+        help="Definition of the salary rule when the line was computed",
     )
+    # emptied in lean line mode, see _move_rule_definitions_to_snapshots()
+    condition_python = fields.Text(required=False)
     allow_edit_payslip_lines = fields.Boolean(
         "Allow editing", compute="_compute_allow_edit_payslip_lines"
     )
 
+    # Payslip lines inherit hr.salary.rule but are never evaluated
+    def _invalidate_rule_caches(self):
+        return
+
+    def _precompile_rule_code(self):
+        return
+
+    def init(self):
+        super().init()
+        # lines of the history of the salary rules, see base_browsable
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS hr_payslip_line_slip_id_code_idx
+            ON hr_payslip_line (slip_id, code)"""
+        )
+        # lines of the contribution register report
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS hr_payslip_line_register_id_idx
+            ON hr_payslip_line (register_id, slip_id)
+            WHERE register_id IS NOT NULL"""
+        )
+
     def _compute_allow_edit_payslip_lines(self):
         self.allow_edit_payslip_lines = (
             self.env["ir.config_parameter"]
@@ -51,23 +87,74 @@ class HrPayslipLine(models.Model):
             .get_param("payroll.allow_edit_payslip_lines")
         )
 
+    @api.model
+    def _move_rule_definitions_to_snapshots(self):
+        """
+        In lean line mode, link the lines computed without snapshot to the
+        snapshot of their rule definition values, and empty these values on
+        all the lines having a snapshot.
+        """
+        if (
+            not self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("payroll.lean_payslip_lines")
+        ):
+            return
+        self.flush()
+        cr = self.env.cr
+        # the lines are matched to their definition by the hash of the row of
+        # their values, so the update can join them without comparing each
+        # field
+        row_hash = "md5(ROW({})::text)".format(", ".join(SNAPSHOT_FIELDS))
+        cr.execute(
+            "SELECT DISTINCT {} AS row_hash, {} FROM hr_payslip_line "
+            "WHERE rule_snapshot_id IS NULL".format(
+                row_hash, ", ".join(SNAPSHOT_FIELDS)
+            )
+        )
+        rows = cr.dictfetchall()
+        if rows:
+            snapshot_ids = self.env["hr.salary.rule.snapshot"]._get_snapshot_ids(rows)
+            cr.execute(
+                """
+                UPDATE hr_payslip_line SET rule_snapshot_id = definition.snapshot_id
+                FROM (VALUES {}) AS definition (row_hash, snapshot_id)
+                WHERE rule_snapshot_id IS NULL
+                AND {} = definition.row_hash""".format(
+                    ", ".join(["(%s, %s)"] * len(rows)), row_hash
+                ),
+                [
+                    value
+                    for row, snapshot_id in zip(rows, snapshot_ids)
+                    for value in (row["row_hash"], snapshot_id)
+                ],
+            )
+        cr.execute(
+            "UPDATE hr_payslip_line SET {} WHERE rule_snapshot_id IS NOT NULL".format(
+                ", ".join("{} = NULL".format(name) for name in LEAN_LINE_FIELDS)
+            )
+        )
+        self.invalidate_cache()
+
     @api.depends("parent_rule_id", "contract_id", "slip_id")
     def _compute_parent_line_id(self):
+        # index the lines of the payslips once, instead of searching the
+        # parent among the lines of the payslip for each line
+        line_ids = {}
+        for line in self.mapped("slip_id.line_ids"):
+            key = (line.slip_id.id, line.contract_id.id, line.salary_rule_id.id)
+            line_ids.setdefault(key, []).append(line.id)
         for line in self:
             if line.parent_rule_id:
-                parent_line = line.slip_id.line_ids.filtered(
-                    lambda l: l.salary_rule_id == line.parent_rule_id
-                    and l.contract_id == line.contract_id
-                    and l.slip_id == line.slip_id
+                parent_line_ids = line_ids.get(
+                    (line.slip_id.id, line.contract_id.id, line.parent_rule_id.id), []
                 )
-                if parent_line and len(parent_line) > 1:
+                if len(parent_line_ids) > 1:
                     raise UserError(
                         _("Recursion error. Only one line should be parent of %s")
                         % line.parent_rule_id.name
                     )
-                line.parent_line_id = (
-                    parent_line[0].id if len(parent_line) == 1 else False
-                )
+                line.parent_line_id = parent_line_ids[0] if parent_line_ids else False
             else:
                 line.parent_line_id = False
 
@@ -76,6 +163,25 @@ class HrPayslipLine(models.Model):
         for line in self:
             line.total = float(line.quantity) * line.amount * line.rate / 100
 
+    def _inverse_total(self):
+        # The payroll engine gives the total when creating the lines (see
+        # _prepare_total()), so it doesn't have to be recomputed afterwards.
+        # Changing the quantity, amount or rate still recomputes it.
+        return
+
+    @api.model
+    def _prepare_total(self, vals):
+        """
+        @param vals: values of a line to create
+        @return: the total that _compute_total() gives once the quantity,
+                 amount and rate are stored, i.e. rounded
+        """
+        quantity, amount, rate = (
+            self._fields[name].convert_to_cache(vals[name], self)
+            for name in ("quantity", "amount", "rate")
+        )
+        return float(quantity) * amount * rate / 100
+
     @api.model_create_multi
     def create(self, vals_list):
         for values in vals_list:
@@ -4,6 +4,9 @@ from dateutil.relativedelta import relativedelta
 
 from odoo import fields, models
 
+from .hr_payslip_run_job import JOB_CHUNK_SIZE
+from .payslip_history import query_history
+
 
 class HrPayslipRun(models.Model):
     _name = "hr.payslip.run"
@@ -71,8 +74,51 @@ class HrPayslipRun(models.Model):
         "of the employee valid for the chosen period",
     )
 
+    job_ids = fields.One2many(
+        "hr.payslip.run.job", "run_id", string="Background Jobs", readonly=True
+    )
+
     def draft_payslip_run(self):
         return self.write({"state": "draft"})
 
     def close_payslip_run(self):
         return self.write({"state": "close"})
+
+    def query_history(self, kind, codes, windows):
+        """
+        Aggregate the history of all the employees of the batches at once
+        @param kind: "rule", "input" or "worked_days"
+        @param windows: dict {window name: (from_date, to_date)}
+        @return: HistoryResult, e.g. result.get("NET", "ytd", employee_id=id)
+        """
+        return query_history(
+            self.env, kind, self.mapped("slip_ids.employee_id").ids, codes, windows
+        )
+
+    def action_compute_job(self):
+        self.env["hr.payslip.run.job"]._enqueue(self, "compute")
+
+    def action_confirm_job(self):
+        self.env["hr.payslip.run.job"]._enqueue(self, "confirm")
+
+    def action_cancel_job(self):
+        self.env["hr.payslip.run.job"]._enqueue(self, "cancel")
+
+    def _get_compute_workers(self):
+        return int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("payroll.payslip_run_workers", 0)
+        )
+
+    def _compute_payslips(self, payslips):
+        """
+        Compute the payslips of the batch, or let the cron workers compute
+        them in the background when the payslip batch workers setting is set
+        and there are more payslips than in a chunk
+        """
+        self.ensure_one()
+        if self._get_compute_workers() <= 1 or len(payslips) <= JOB_CHUNK_SIZE:
+            return payslips.compute_sheet()
+        self.env["hr.payslip.run.job"]._enqueue(self, "compute")
+        return True
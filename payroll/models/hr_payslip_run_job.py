@@ -0,0 +1,293 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import logging
+import math
+import threading
+
+from odoo import _, api, fields, models
+from odoo.tools import split_every
+
+_logger = logging.getLogger(__name__)
+
+# payslips processed and committed together
+JOB_CHUNK_SIZE = 50
+
+# key of the advisory locks of the jobs being processed by a cron worker
+JOB_LOCK_KEY = 4270131
+
+# states of the payslips processed by each job action
+JOB_PAYSLIP_STATES = {
+    "compute": ("draft", "verify"),
+    "confirm": ("draft", "verify"),
+    "cancel": ("draft", "verify", "done"),
+}
+
+
+def is_testing():
+    """@return: whether the code runs in tests, which must not commit"""
+    return getattr(threading.current_thread(), "testing", False)
+
+
+class HrPayslipRunJob(models.Model):
+    """
+    Computation, confirmation or cancellation of the payslips of a batch in
+    the background, by the payroll cron jobs. The payslips are processed by
+    chunks, each committed with the payslips it processed, so an interrupted
+    job resumes after its last committed chunk.
+    The payslips of a batch are split in a job per payslip batch worker, and
+    there is a payroll cron job per worker, so several cron workers process
+    the jobs in parallel.
+    """
+
+    _name = "hr.payslip.run.job"
+    _description = "Payslip Batch Job"
+    _order = "id desc"
+
+    run_id = fields.Many2one(
+        "hr.payslip.run",
+        string="Payslip Batch",
+        required=True,
+        readonly=True,
+        index=True,
+        ondelete="cascade",
+    )
+    action = fields.Selection(
+        [("compute", "Compute"), ("confirm", "Confirm"), ("cancel", "Cancel")],
+        required=True,
+        readonly=True,
+    )
+    state = fields.Selection(
+        [
+            ("queued", "Queued"),
+            ("running", "Running"),
+            ("done", "Done"),
+            ("failed", "Failed"),
+        ],
+        required=True,
+        readonly=True,
+        default="queued",
+        index=True,
+    )
+    chunk_size = fields.Integer(required=True, readonly=True, default=JOB_CHUNK_SIZE)
+    payslip_ids = fields.Many2many(
+        "hr.payslip",
+        "hr_payslip_run_job_payslip_rel",
+        "job_id",
+        "payslip_id",
+        string="Payslips",
+        readonly=True,
+    )
+    done_payslip_ids = fields.Many2many(
+        "hr.payslip",
+        "hr_payslip_run_job_done_payslip_rel",
+        "job_id",
+        "payslip_id",
+        string="Processed Payslips",
+        readonly=True,
+        help="Payslips of the chunks already committed, with or without error",
+    )
+    error_ids = fields.One2many(
+        "hr.payslip.run.job.error", "job_id", string="Errors", readonly=True
+    )
+    # the job is processed as the user who requested it, with their
+    # language, timezone and companies, see _cron_process()
+    user_id = fields.Many2one(
+        "res.users",
+        string="Requested By",
+        required=True,
+        readonly=True,
+        default=lambda self: self.env.user,
+    )
+    lang = fields.Char(readonly=True, default=lambda self: self.env.context.get("lang"))
+    tz = fields.Char(readonly=True, default=lambda self: self.env.context.get("tz"))
+    company_ids = fields.Many2many(
+        "res.company",
+        "hr_payslip_run_job_company_rel",
+        "job_id",
+        "company_id",
+        string="Companies",
+        readonly=True,
+        default=lambda self: self.env.companies,
+    )
+    progress = fields.Float(compute="_compute_progress")
+    error_count = fields.Integer(compute="_compute_progress")
+
+    @api.depends("payslip_ids", "done_payslip_ids", "error_ids")
+    def _compute_progress(self):
+        for job in self:
+            total = len(job.payslip_ids)
+            job.progress = total and 100.0 * len(job.done_payslip_ids) / total
+            job.error_count = len(job.error_ids)
+
+    @api.model
+    def _enqueue(self, runs, action):
+        """
+        Create the jobs processing the payslips of the batches and wake the
+        payroll cron jobs up
+        """
+        states = JOB_PAYSLIP_STATES[action]
+        vals_list = []
+        for run in runs:
+            payslip_ids = run.slip_ids.filtered(lambda p: p.state in states).ids
+            workers = max(run._get_compute_workers(), 1)
+            size = max(math.ceil(len(payslip_ids) / workers), 1)
+            for job_payslip_ids in list(split_every(size, payslip_ids, list)) or [[]]:
+                vals_list.append(
+                    {
+                        "run_id": run.id,
+                        "action": action,
+                        "payslip_ids": [(6, 0, job_payslip_ids)],
+                    }
+                )
+        jobs = self.create(vals_list)
+        for cron in self._get_crons():
+            cron._trigger()
+        return jobs
+
+    @api.model
+    def _get_crons(self):
+        """@return: the payroll cron jobs processing the jobs, the one of the
+        module data first"""
+        cron = self.env.ref("payroll.ir_cron_payslip_run_job").sudo()
+        return cron | cron.with_context(active_test=False).search(
+            [("model_id", "=", cron.model_id.id), ("code", "=", cron.code)],
+            order="id",
+        )
+
+    @api.model
+    def _set_cron_count(self, count):
+        """Keep a payroll cron job per payslip batch worker"""
+        crons = self._get_crons()
+        count = max(count, 1)
+        for number in range(len(crons) + 1, count + 1):
+            crons[0].copy({"name": "%s (%s)" % (crons[0].name, number)})
+        crons[count:].unlink()
+
+    @api.model
+    def _cron_process(self):
+        # running jobs were interrupted, e.g. by a restart, and are resumed.
+        # The jobs locked by other cron workers are left to them.
+        for job in self.search([("state", "in", ("queued", "running"))], order="id"):
+            if not job._lock():
+                continue
+            try:
+                if job.state in ("queued", "running"):
+                    job.with_user(job.user_id).with_context(
+                        **job._get_requester_context()
+                    )._process()
+            except Exception:
+                # the transaction may be aborted, the lock is released after
+                # the rollback, and the job resumes from its last committed
+                # chunk on the next run
+                _logger.exception("Payslip batch job %s failed", job.id)
+                job._rollback()
+            finally:
+                job._unlock()
+
+    def _lock(self):
+        """
+        Lock the job for the current cron worker. The lock is kept by the
+        commits of the chunks and by rollbacks, until _unlock().
+        @return: False when another cron worker processes the job
+        """
+        self.ensure_one()
+        self.env.cr.execute(
+            "SELECT pg_try_advisory_lock(%s, %s)", (JOB_LOCK_KEY, self.id)
+        )
+        if not self.env.cr.fetchone()[0]:
+            return False
+        # see what the cron worker which held the lock committed
+        self._commit()
+        self.invalidate_cache()
+        return True
+
+    def _unlock(self):
+        self.ensure_one()
+        self.env.cr.execute(
+            "SELECT pg_advisory_unlock(%s, %s)", (JOB_LOCK_KEY, self.id)
+        )
+
+    def _commit(self):
+        if not is_testing():
+            self.env.cr.commit()  # pylint: disable=invalid-commit
+
+    def _rollback(self):
+        if not is_testing():
+            self.env.cr.rollback()
+        self.invalidate_cache()
+
+    def _process(self):
+        self.ensure_one()
+        self.state = "running"
+        self._commit()
+        todo = self.payslip_ids - self.done_payslip_ids
+        for payslip_ids in split_every(self.chunk_size, todo.ids, list):
+            self._process_chunk(self.env["hr.payslip"].browse(payslip_ids).exists())
+            self.done_payslip_ids = [(4, payslip_id) for payslip_id in payslip_ids]
+            self._commit()
+            _logger.info(
+                "Payslip batch job %s: %s/%s payslips processed",
+                self.id,
+                len(self.done_payslip_ids),
+                len(self.payslip_ids),
+            )
+        self.state = "failed" if self.error_ids else "done"
+        self.run_id.message_post(
+            body=_("%(action)s of %(count)s payslips finished with %(errors)s errors.")
+            % {
+                "action": self._fields["action"].convert_to_export(self.action, self),
+                "count": len(self.payslip_ids),
+                "errors": len(self.error_ids),
+            }
+        )
+        self._commit()
+
+    def _process_chunk(self, payslips):
+        """
+        Process the payslips together, or one by one in their own savepoints
+        when it fails, to record the errors of the failing payslips
+        """
+        try:
+            with self.env.cr.savepoint():
+                self._process_payslips(payslips)
+        except Exception:
+            for payslip in payslips:
+                try:
+                    with self.env.cr.savepoint():
+                        self._process_payslips(payslip)
+                except Exception as e:
+                    self.env["hr.payslip.run.job.error"].create(
+                        {"job_id": self.id, "payslip_id": payslip.id, "message": str(e)}
+                    )
+
+    def _get_requester_context(self):
+        """@return: the context keys of the user who requested the job"""
+        self.ensure_one()
+        context = {"allowed_company_ids": self.company_ids.ids}
+        if self.lang:
+            context["lang"] = self.lang
+        if self.tz:
+            context["tz"] = self.tz
+        return context
+
+    def _process_payslips(self, payslips):
+        payslips = payslips.filtered(
+            lambda p: p.state in JOB_PAYSLIP_STATES[self.action]
+        )
+        if self.action == "compute":
+            payslips.compute_sheet()
+        elif self.action == "confirm":
+            payslips.action_payslip_done()
+        else:
+            payslips.action_payslip_cancel()
+
+
+class HrPayslipRunJobError(models.Model):
+    _name = "hr.payslip.run.job.error"
+    _description = "Payslip Batch Job Error"
+
+    job_id = fields.Many2one(
+        "hr.payslip.run.job", required=True, index=True, ondelete="cascade"
+    )
+    payslip_id = fields.Many2one("hr.payslip", ondelete="cascade")
+    message = fields.Text()
@@ -0,0 +1,209 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import logging
+
+from odoo import api, fields, models
+from odoo.tools import float_compare
+
+_logger = logging.getLogger(__name__)
+
+
+class HrPayslipYtd(models.Model):
+    """
+    Year to date totals of the rule and category codes of the done payslips of
+    an employee, by calendar year of the payslip start date. They are updated
+    when payslips are confirmed or cancelled, and read by the salary rules
+    through the ytd object of their localdict.
+    """
+
+    _name = "hr.payslip.ytd"
+    _description = "Payslip Year to Date Total"
+    _order = "employee_id, year desc, kind, code"
+
+    employee_id = fields.Many2one(
+        "hr.employee", required=True, readonly=True, index=True, ondelete="cascade"
+    )
+    year = fields.Integer(required=True, readonly=True)
+    kind = fields.Selection(
+        [("rule", "Salary Rule"), ("category", "Salary Rule Category")],
+        required=True,
+        readonly=True,
+    )
+    code = fields.Char(required=True, readonly=True)
+    total = fields.Float(digits="Payroll", readonly=True)
+
+    _sql_constraints = [
+        (
+            "ytd_uniq",
+            "unique(employee_id, year, kind, code)",
+            "Year to date totals must be unique.",
+        )
+    ]
+
+    @api.model
+    def _get_payslip_totals(self, payslips):
+        """
+        @return: dict {(employee id, year, kind, code): total} of the lines of
+                 the payslips, negative for credit notes like in the Payslips
+                 history helpers
+        """
+        totals = {}
+        for payslip in payslips:
+            sign = -1 if payslip.credit_note else 1
+            employee_id = payslip.employee_id.id
+            year = payslip.date_from.year
+            for line in payslip.line_ids:
+                keys = [
+                    (employee_id, year, "category", code)
+                    for code in (line.category_id._get_sum_codes())
+                ]
+                if line.code:
+                    keys.append((employee_id, year, "rule", line.code))
+                for key in keys:
+                    totals[key] = totals.get(key, 0.0) + sign * line.total
+        return totals
+
+    @api.model
+    def _add(self, totals, sign=1):
+        """
+        Add totals to the stored ones
+        @param totals: dict {(employee id, year, kind, code): total}
+        @param sign: -1 to remove them
+        """
+        if not totals:
+            return
+        self.flush()
+        query = """
+            INSERT INTO hr_payslip_ytd (employee_id, year, kind, code, total)
+            VALUES {}
+            ON CONFLICT (employee_id, year, kind, code)
+            DO UPDATE SET total = hr_payslip_ytd.total + EXCLUDED.total
+        """.format(
+            ", ".join(["(%s, %s, %s, %s, %s)"] * len(totals))
+        )
+        params = []
+        for key, total in totals.items():
+            params += key + (sign * total,)
+        self.env.cr.execute(query, params)
+        self.invalidate_cache()
+
+    @api.model
+    def _add_payslips(self, payslips, sign=1):
+        """Add the totals of done payslips, or remove them when sign is -1"""
+        self._add(self._get_payslip_totals(payslips), sign)
+
+    @api.model
+    def _get_totals(self, employee_id, year):
+        """@return: dict {(kind, code): total} of an employee and year"""
+        self.flush()
+        self.env.cr.execute(
+            """
+            SELECT kind, code, total FROM hr_payslip_ytd
+            WHERE employee_id = %s AND year = %s""",
+            (employee_id, year),
+        )
+        return {(kind, code): total for kind, code, total in self.env.cr.fetchall()}
+
+    @api.model
+    def _get_expected_totals_query(self, employee_ids=None):
+        """
+        Same totals as _get_payslip_totals(), grouped in SQL for all the done
+        payslips at once
+        @param employee_ids: the employees to total, all of them when None
+        @return: (query, params) selecting the employee_id, year, kind, code
+                 and total columns
+        """
+        where = "hp.state = 'done'"
+        params = []
+        if employee_ids is not None:
+            where += " AND hp.employee_id IN %s"
+            params.append(tuple(employee_ids) or (None,))
+        query = """
+            WITH RECURSIVE category_code (category_id, parent_id, code) AS (
+                SELECT id, parent_id, code FROM hr_salary_rule_category
+                UNION ALL
+                SELECT cc.category_id, c.parent_id, c.code
+                FROM category_code cc
+                JOIN hr_salary_rule_category c ON c.id = cc.parent_id
+            ), line AS (
+                SELECT hp.employee_id,
+                    EXTRACT(YEAR FROM hp.date_from)::integer AS year,
+                    hpl.code,
+                    hpl.category_id,
+                    CASE WHEN hp.credit_note THEN -hpl.total ELSE hpl.total END
+                        AS total
+                FROM hr_payslip_line hpl
+                JOIN hr_payslip hp ON hp.id = hpl.slip_id
+                WHERE {}
+            )
+            SELECT employee_id, year, 'rule', code, SUM(total)
+            FROM line
+            WHERE COALESCE(code, '') != ''
+            GROUP BY employee_id, year, code
+            UNION ALL
+            SELECT line.employee_id, line.year, 'category', cc.code,
+                SUM(line.total)
+            FROM line
+            JOIN category_code cc ON cc.category_id = line.category_id
+            WHERE COALESCE(cc.code, '') != ''
+            GROUP BY line.employee_id, line.year, cc.code
+        """.format(
+            where
+        )
+        return query, params
+
+    @api.model
+    def _get_expected_totals(self, employee_ids=None):
+        """@return: the totals computed from the lines of the done payslips"""
+        self.flush()
+        query, params = self._get_expected_totals_query(employee_ids)
+        self.env.cr.execute(query, params)
+        return {
+            (employee_id, year, kind, code): float(total)
+            for employee_id, year, kind, code, total in self.env.cr.fetchall()
+        }
+
+    @api.model
+    def check_consistency(self, employee_ids=None):
+        """
+        Compare the stored totals to the lines of the done payslips
+        @param employee_ids: the employees to check, all of them when None
+        @return: list of the (employee id, year, kind, code, stored total,
+                 expected total) which differ
+        """
+        expected = self._get_expected_totals(employee_ids)
+        domain = []
+        if employee_ids is not None:
+            domain.append(("employee_id", "in", employee_ids))
+        stored = {
+            (ytd.employee_id.id, ytd.year, ytd.kind, ytd.code): ytd.total
+            for ytd in self.search(domain)
+        }
+        precision = self.env["decimal.precision"].precision_get("Payroll")
+        errors = []
+        for key in sorted(set(expected) | set(stored)):
+            stored_total = stored.get(key, 0.0)
+            expected_total = expected.get(key, 0.0)
+            if float_compare(stored_total, expected_total, precision_digits=precision):
+                errors.append(key + (stored_total, expected_total))
+                _logger.warning(
+                    "Year to date total %s is %s instead of %s",
+                    key,
+                    stored_total,
+                    expected_total,
+                )
+        return errors
+
+    @api.model
+    def rebuild(self):
+        """Compute all the totals again from the done payslips"""
+        self.flush()
+        query, params = self._get_expected_totals_query()
+        self.env.cr.execute("DELETE FROM hr_payslip_ytd")
+        self.env.cr.execute(
+            "INSERT INTO hr_payslip_ytd (employee_id, year, kind, code, total) "
+            + query,
+            params,
+        )
+        self.invalidate_cache()
+        return True
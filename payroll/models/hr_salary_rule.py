@@ -1,8 +1,15 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+import logging
+
 from odoo import _, api, fields, models
 from odoo.exceptions import UserError, ValidationError
-from odoo.tools.safe_eval import safe_eval
+
+from .rule_code_cache import eval_code, rule_code_cache
+from .rule_dependency import CodeReferences, analyze_code
+from .rule_program import RuleStep, is_overridden
+
+_logger = logging.getLogger(__name__)
 
 
 class HrSalaryRule(models.Model):
@@ -172,6 +179,134 @@ class HrSalaryRule(models.Model):
                 _("Error! You cannot create recursive hierarchy of Salary Rules.")
             )
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        rules = super().create(vals_list)
+        rules._invalidate_rule_caches()
+        rules._precompile_rule_code()
+        return rules
+
+    def write(self, vals):
+        res = super().write(vals)
+        self._invalidate_rule_caches()
+        self._precompile_rule_code()
+        return res
+
+    def unlink(self):
+        self._invalidate_rule_caches()
+        return super().unlink()
+
+    def _invalidate_rule_caches(self):
+        rule_code_cache.invalidate(self.ids)
+        # drop the structure rule plans
+        self.env["hr.payroll.structure"]._invalidate_rule_caches()
+
+    def _get_rule_code_fields(self):
+        """
+        @return: list of (field name, safe_eval mode) of the python code
+                 evaluated by the rule for its condition and amount types
+        """
+        self.ensure_one()
+        code_fields = []
+        if self.condition_select == "range":
+            code_fields.append(("condition_range", "eval"))
+        elif self.condition_select == "python":
+            code_fields.append(("condition_python", "exec"))
+        if self.amount_select in ("fix", "percentage"):
+            code_fields.append(("quantity", "eval"))
+        if self.amount_select == "percentage":
+            code_fields.append(("amount_percentage_base", "eval"))
+        elif self.amount_select == "code":
+            code_fields.append(("amount_python_compute", "exec"))
+        return code_fields
+
+    def _precompile_rule_code(self):
+        """
+        Compile the code of the rules when they are saved, so that trivial
+        expressions like contract.wage or 1.0 are turned into direct getters
+        before the first payslip computation.
+        """
+        for rule in self:
+            for field_name, mode in rule._get_rule_code_fields():
+                try:
+                    rule_code_cache.get(rule.id, field_name, rule[field_name], mode)
+                except Exception as e:
+                    # the error is raised when the payslips are computed
+                    _logger.warning(
+                        "Invalid %s of salary rule %s (%s): %s",
+                        field_name,
+                        rule.name,
+                        rule.code,
+                        e,
+                    )
+
+    @api.model
+    def get_code_cache_stats(self):
+        """
+        @return: hit and miss counters of the compiled rule code cache
+        """
+        return rule_code_cache.stats()
+
+    def _eval_rule_code(self, field_name, localdict, mode="eval", nocopy=False):
+        """
+        Evaluate the python code stored in field_name through the compiled
+        code cache, with the same sandbox rules as safe_eval.
+        """
+        self.ensure_one()
+        code = rule_code_cache.get(self.id, field_name, self[field_name], mode=mode)
+        return eval_code(code, localdict, nocopy=nocopy)
+
+    def _get_code_references(self):
+        """
+        @return: the CodeReferences of the python code of the condition and of
+                 the amount of the rule
+        """
+        self.ensure_one()
+        references = CodeReferences()
+        for field_name, mode in self._get_rule_code_fields():
+            references.update(analyze_code(self[field_name] or "", mode))
+        return references
+
+    def _get_program_steps(self):
+        """
+        @return: list of the RuleStep of each rule, to compile them in a
+                 RuleProgram, or None when the rules can't be compiled because
+                 _satisfy_condition() is overridden. The condition and amount
+                 types whose method is overridden are delegated to it.
+        """
+        if is_overridden(self, HrSalaryRule, "_satisfy_condition"):
+            return None
+        reset = (
+            "call"
+            if is_overridden(self, HrSalaryRule, "_reset_localdict_values")
+            else "inline"
+        )
+        steps = []
+        for rule in self:
+            condition = rule.condition_select
+            if condition not in ("none", "range", "python") or is_overridden(
+                rule, HrSalaryRule, "_satisfy_condition_{}".format(condition)
+            ):
+                condition = "call"
+            amount = rule.amount_select
+            if (
+                amount not in ("fix", "percentage", "code")
+                or is_overridden(rule, HrSalaryRule, "_compute_rule_{}".format(amount))
+                or is_overridden(rule, HrSalaryRule, "_compute_rule")
+            ):
+                amount = "call"
+            condition_sources, amount_sources = [], []
+            for field_name, mode in rule._get_rule_code_fields():
+                if field_name.startswith("condition_"):
+                    if condition != "call":
+                        condition_sources.append((rule[field_name] or "", mode))
+                elif amount != "call":
+                    amount_sources.append((rule[field_name] or "", mode))
+            steps.append(
+                RuleStep(reset, condition, condition_sources, amount, amount_sources)
+            )
+        return steps
+
     def _recursive_search_of_rules(self):
         """
         @return: returns a list of tuple (id, sequence) which are all the
@@ -209,55 +344,40 @@ class HrSalaryRule(models.Model):
         """
         self.ensure_one()
         method = "_compute_rule_{}".format(self.amount_select)
-        return api.call_kw(self, method, [self.ids, localdict], {})
+        return getattr(self, method)(localdict)
 
     def _compute_rule_fix(self, localdict):
         try:
             return {
                 "name": self.name,
-                "quantity": float(safe_eval(self.quantity, localdict)),
+                "quantity": float(self._eval_rule_code("quantity", localdict)),
                 "rate": 100.0,
                 "amount": self.amount_fix,
             }
-        except Exception:
-            raise UserError(
-                _("Wrong quantity defined for salary rule %s (%s) for employee %s.")
-                % (self.name, self.code, localdict["employee"].name)
-            )
+        except Exception as ex:
+            raise self._get_amount_error(localdict, ex)
 
     def _compute_rule_percentage(self, localdict):
         try:
             return {
                 "name": self.name,
-                "quantity": float(safe_eval(self.quantity, localdict)),
+                "quantity": float(self._eval_rule_code("quantity", localdict)),
                 "rate": self.amount_percentage,
-                "amount": float(safe_eval(self.amount_percentage_base, localdict)),
+                "amount": float(
+                    self._eval_rule_code("amount_percentage_base", localdict)
+                ),
             }
-        except Exception:
-            raise UserError(
-                _(
-                    "Wrong percentage base or quantity defined for salary "
-                    "rule %s (%s) for employee %s."
-                )
-                % (self.name, self.code, localdict["employee"].name)
-            )
+        except Exception as ex:
+            raise self._get_amount_error(localdict, ex)
 
     def _compute_rule_code(self, localdict):
         try:
-            safe_eval(self.amount_python_compute, localdict, mode="exec", nocopy=True)
+            self._eval_rule_code(
+                "amount_python_compute", localdict, mode="exec", nocopy=True
+            )
             return self._get_rule_dict(localdict)
         except Exception as ex:
-            raise UserError(
-                _(
-                    """
-Wrong python code defined for salary rule %s (%s) for employee %s.
-Here is the error received:
-
-%s
-"""
-                )
-                % (self.name, self.code, localdict["employee"].name, repr(ex))
-            )
+            raise self._get_amount_error(localdict, ex)
 
     def _get_rule_dict(self, localdict):
         name = localdict.get("result_name") or self.name
@@ -270,50 +390,126 @@ Here is the error received:
             "amount": float(localdict["result"]),
         }
 
-    def _satisfy_condition(self, localdict):
+    def _satisfy_condition(self, localdict, satisfied=None):
         """
         @param contract_id: id of hr.contract to be tested
+        @param satisfied: optional dict {rule id: result of the rule's own
+                          condition} of the rules already visited, in sequence
+                          order, for the same contract. The condition of the
+                          rule is stored in it, and the ones of its parents
+                          visited before it are read from it.
         @return: returns True if the given rule match the condition for the
                  given contract. Return False otherwise.
         """
+        self.ensure_one()
+        if satisfied is None:
+            satisfied = {}
+        if self.id not in satisfied:
+            satisfied[self.id] = self._satisfy_own_condition(localdict)
+        return satisfied[self.id] and self._satisfy_parent_conditions(
+            localdict, satisfied
+        )
+
+    def _satisfy_own_condition(self, localdict):
         self.ensure_one()
         method = "_satisfy_condition_{}".format(self.condition_select)
-        if self.parent_rule_id:
-            current_result = api.call_kw(self, method, [self.ids, localdict], {})
-            parent_result = self.parent_rule_id._satisfy_condition(localdict)
-            return current_result and parent_result
-        return api.call_kw(self, method, [self.ids, localdict], {})
+        return getattr(self, method)(localdict)
+
+    def _satisfy_parent_conditions(self, localdict, satisfied):
+        """
+        @param satisfied: see _satisfy_condition()
+        @return: whether the conditions of all the parents of the rule are
+                 satisfied. The parents not visited yet, i.e. with a higher
+                 sequence, are evaluated at the position of this rule and not
+                 memoized: they are evaluated again at their own position.
+        """
+        self.ensure_one()
+        parent = self.parent_rule_id
+        while parent:
+            if parent.id in satisfied:
+                result = satisfied[parent.id]
+            else:
+                result = parent._satisfy_own_condition(localdict)
+            if not result:
+                return result
+            parent = parent.parent_rule_id
+        return True
 
     def _satisfy_condition_none(self, localdict):
         return True
 
     def _satisfy_condition_range(self, localdict):
         try:
-            result = safe_eval(self.condition_range, localdict)
+            result = self._eval_rule_code("condition_range", localdict)
             return (
                 self.condition_range_min <= result <= self.condition_range_max or False
             )
-        except Exception:
-            raise UserError(
-                _(
-                    "Wrong range condition defined for salary rule %s (%s) for employee %s."
-                )
-                % (self.name, self.code, localdict["employee"].name)
-            )
+        except Exception as ex:
+            raise self._get_condition_error(localdict, ex)
 
     def _satisfy_condition_python(self, localdict):
         try:
-            safe_eval(self.condition_python, localdict, mode="exec", nocopy=True)
+            self._eval_rule_code(
+                "condition_python", localdict, mode="exec", nocopy=True
+            )
             return "result" in localdict and localdict["result"] or False
         except Exception as ex:
-            raise UserError(
+            raise self._get_condition_error(localdict, ex)
+
+    def _get_condition_error(self, localdict, error):
+        """
+        @param error: exception raised while evaluating the condition
+        @return: the UserError reporting it for the employee of localdict
+        """
+        self.ensure_one()
+        employee_name = localdict["employee"].name
+        if self.condition_select == "range":
+            return UserError(
                 _(
-                    """
+                    "Wrong range condition defined for salary rule %s (%s) for employee %s."
+                )
+                % (self.name, self.code, employee_name)
+            )
+        return UserError(
+            _(
+                """
 Wrong python condition defined for salary rule %s (%s) for employee %s.
 Here is the error received:
 
 %s
 """
+            )
+            % (self.name, self.code, employee_name, repr(error))
+        )
+
+    def _get_amount_error(self, localdict, error):
+        """
+        @param error: exception raised while computing the amount
+        @return: the UserError reporting it for the employee of localdict
+        """
+        self.ensure_one()
+        employee_name = localdict["employee"].name
+        if self.amount_select == "fix":
+            return UserError(
+                _("Wrong quantity defined for salary rule %s (%s) for employee %s.")
+                % (self.name, self.code, employee_name)
+            )
+        if self.amount_select == "percentage":
+            return UserError(
+                _(
+                    "Wrong percentage base or quantity defined for salary "
+                    "rule %s (%s) for employee %s."
                 )
-                % (self.name, self.code, localdict["employee"].name, repr(ex))
+                % (self.name, self.code, employee_name)
+            )
+        return UserError(
+            _(
+                """
+Wrong python code defined for salary rule %s (%s) for employee %s.
+Here is the error received:
+
+%s
+"""
             )
+            % (self.name, self.code, employee_name, repr(error))
+        )
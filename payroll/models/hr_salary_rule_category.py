@@ -1,6 +1,6 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-from odoo import _, api, fields, models
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import ValidationError
 
 
@@ -43,6 +43,83 @@ class HrSalaryRuleCategory(models.Model):
         self.require_code = require
         return require
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        categories = super().create(vals_list)
+        categories._invalidate_rule_caches()
+        return categories
+
+    def write(self, vals):
+        res = super().write(vals)
+        self._invalidate_rule_caches()
+        return res
+
+    def unlink(self):
+        self._invalidate_rule_caches()
+        return super().unlink()
+
+    def _invalidate_rule_caches(self):
+        # drop the compiled rule programs and the category closure
+        self.env["hr.payroll.structure"]._invalidate_rule_caches()
+
+    @api.model
+    @tools.ormcache(
+        "self.env['hr.payroll.structure']._get_rule_cache_version()",
+        "tuple(self.env.companies.ids)",
+    )
+    def _get_closure(self):
+        """
+        @return: (ancestors, descendants) of the category tree:
+                 - ancestors: dict {category id: tuple of the codes of the
+                   category and of its parents}
+                 - descendants: dict {code: tuple of the codes of the
+                   categories of this code and of all their children}
+        """
+        categories = self.search([])
+        parents = {category.id: category.parent_id.id for category in categories}
+        codes = {category.id: category.code for category in categories}
+        ancestors = {}
+        descendants = {}
+        for category_id in parents:
+            chain = []
+            parent_id = category_id
+            while parent_id in parents:
+                if codes[parent_id]:
+                    chain.append(codes[parent_id])
+                parent_id = parents[parent_id]
+            ancestors[category_id] = tuple(chain)
+            if codes[category_id]:
+                for code in chain:
+                    descendants.setdefault(code, set()).add(codes[category_id])
+        descendants = {code: tuple(sorted(sub)) for code, sub in descendants.items()}
+        return ancestors, descendants
+
+    @api.model
+    def _get_descendant_codes(self, code):
+        """
+        @return: tuple of the code and of the codes of all the categories
+                 below the categories of this code, i.e. the categories summed
+                 by the history helpers of the code
+        """
+        return self._get_closure()[1].get(code) or (code,)
+
+    def _get_sum_codes(self):
+        """
+        @return: tuple of the codes of the category and of its parents, i.e.
+                 the category sums the rules of this category are added to
+        """
+        if len(self) == 1:
+            codes = self._get_closure()[0].get(self.id)
+            if codes is not None:
+                return codes
+        codes = []
+        category = self
+        while category:
+            if category.code:
+                codes.append(category.code)
+            category = category.parent_id
+        return tuple(codes)
+
     @api.constrains("parent_id")
     def _check_parent_id(self):
         if not self._check_recursion():
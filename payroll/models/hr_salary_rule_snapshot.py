@@ -0,0 +1,138 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import hashlib
+import json
+
+from odoo import api, fields, models
+
+# rule definition fields copied on the payslip lines, see
+# HrPayslip._get_rule_line_values()
+SNAPSHOT_FIELDS = (
+    "condition_select",
+    "condition_python",
+    "condition_range",
+    "condition_range_min",
+    "condition_range_max",
+    "amount_select",
+    "amount_fix",
+    "amount_python_compute",
+    "amount_percentage",
+    "amount_percentage_base",
+)
+
+# fields emptied on the payslip lines in lean line mode. The condition and
+# amount types are small and still used by the line views.
+LEAN_LINE_FIELDS = tuple(
+    name
+    for name in SNAPSHOT_FIELDS
+    if name not in ("condition_select", "amount_select")
+)
+
+
+def _rule_selection(field_name):
+    return lambda self: self.env["hr.salary.rule"]._fields[field_name].selection
+
+
+class HrSalaryRuleSnapshot(models.Model):
+    """
+    Definition of a salary rule, as it was when payslip lines were computed.
+    Snapshots are identified by the hash of their values, so all the lines
+    computed with the same definition share the same snapshot.
+    """
+
+    _name = "hr.salary.rule.snapshot"
+    _description = "Salary Rule Definition Snapshot"
+    _rec_name = "hash"
+
+    hash = fields.Char(required=True, readonly=True, index=True)
+    condition_select = fields.Selection(
+        _rule_selection("condition_select"),
+        string="Condition Based on",
+        readonly=True,
+    )
+    condition_python = fields.Text(string="Python Condition", readonly=True)
+    condition_range = fields.Char(string="Range Based on", readonly=True)
+    condition_range_min = fields.Float(string="Minimum Range", readonly=True)
+    condition_range_max = fields.Float(string="Maximum Range", readonly=True)
+    amount_select = fields.Selection(
+        _rule_selection("amount_select"), string="Amount Type", readonly=True
+    )
+    amount_fix = fields.Float(string="Fixed Amount", digits="Payroll", readonly=True)
+    amount_python_compute = fields.Text(string="Python Code", readonly=True)
+    amount_percentage = fields.Float(
+        string="Percentage (%)", digits="Payroll Rate", readonly=True
+    )
+    amount_percentage_base = fields.Char(string="Percentage based on", readonly=True)
+
+    _sql_constraints = [
+        ("hash_uniq", "unique(hash)", "Salary rule snapshots must be unique.")
+    ]
+
+    @api.model
+    def _get_hash(self, values):
+        """
+        @param values: dict of rule definition values, as copied on the lines
+        @return: the hash identifying these values. Floats are rounded like
+                 stored values, and empty values are all the same.
+        """
+        normalized = []
+        for name in SNAPSHOT_FIELDS:
+            field = self._fields[name]
+            value = values.get(name)
+            if field.type == "float":
+                value = field.convert_to_cache(value, self)
+            normalized.append(value or None)
+        return hashlib.sha256(json.dumps(normalized).encode()).hexdigest()
+
+    @api.model
+    def _get_snapshot_ids(self, values_list):
+        """
+        @param values_list: list of dicts of rule definition values
+        @return: list of the ids of the snapshots of these values. The missing
+                 snapshots are inserted, and the ones inserted meanwhile by
+                 concurrent transactions are reused.
+        """
+        hashes = {}
+        keys = []
+        missing = {}
+        for values in values_list:
+            key = tuple(values.get(name) for name in SNAPSHOT_FIELDS)
+            if key not in hashes:
+                hash_ = hashes[key] = self._get_hash(values)
+                missing.setdefault(hash_, values)
+            keys.append(key)
+        if not keys:
+            return []
+        self.flush()
+        query = """
+            INSERT INTO hr_salary_rule_snapshot
+                (hash, {}, create_uid, create_date, write_uid, write_date)
+            VALUES {}
+            ON CONFLICT (hash) DO NOTHING
+        """.format(
+            ", ".join(SNAPSHOT_FIELDS),
+            ", ".join(
+                [
+                    "(%s, {}, %s, now() at time zone 'UTC', %s, "
+                    "now() at time zone 'UTC')".format(
+                        ", ".join(["%s"] * len(SNAPSHOT_FIELDS))
+                    )
+                ]
+                * len(missing)
+            ),
+        )
+        params = []
+        for hash_, values in missing.items():
+            params.append(hash_)
+            params += [
+                self._fields[name].convert_to_column(values.get(name), self)
+                for name in SNAPSHOT_FIELDS
+            ]
+            params += [self.env.uid, self.env.uid]
+        self.env.cr.execute(query, params)
+        self.env.cr.execute(
+            "SELECT hash, id FROM hr_salary_rule_snapshot WHERE hash IN %s",
+            (tuple(missing),),
+        )
+        snapshot_ids = dict(self.env.cr.fetchall())
+        return [snapshot_ids[hashes[key]] for key in keys]
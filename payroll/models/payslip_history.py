@@ -0,0 +1,264 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import math
+from bisect import bisect_left
+from datetime import date, datetime
+
+from odoo import fields
+
+
+def _to_date(value):
+    """@return: the date of value, or None when it isn't a plain date"""
+    if isinstance(value, datetime):
+        # compared as a timestamp by the SQL queries
+        return None
+    if isinstance(value, date):
+        return value
+    try:
+        return fields.Date.to_date(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def aggregate(values, function):
+    """
+    Aggregate values like the SQL functions of the history queries
+    @param function: "sum", "avg", "max" or "min"
+    @return: the aggregate, 0.0 when there is no value
+    """
+    if not values:
+        return 0.0
+    if function == "sum":
+        return math.fsum(values) or 0.0
+    if function == "avg":
+        return math.fsum(values) / len(values) or 0.0
+    return (max if function == "max" else min)(values) or 0.0
+
+
+def _signed_totals(rows, is_refund, monthly):
+    """
+    @param is_refund: function telling whether the credit_note value of a
+                      payslip is a refund. The rule and category queries
+                      don't handle empty values the same way.
+    @return: list of the totals of the rows, negative for refunds, summed by
+             month of the payslip start date when monthly is set
+    """
+    if not monthly:
+        return [
+            -total if is_refund(credit_note) else total
+            for _date_from, _date_to, credit_note, total in rows
+        ]
+    months = {}
+    for date_from, _date_to, credit_note, total in rows:
+        months.setdefault((date_from.year, date_from.month), []).append(
+            -total if is_refund(credit_note) else total
+        )
+    return [math.fsum(totals) for totals in months.values()]
+
+
+class _Series(object):
+    """Lines of an employee, sorted by payslip start date"""
+
+    __slots__ = ("dates_from", "rows")
+
+    def __init__(self):
+        self.dates_from = []
+        self.rows = []
+
+    def select(self, from_date, to_date):
+        """@return: the (date_from, date_to, credit_note, total) rows of the
+        payslips within from_date and to_date"""
+        index = bisect_left(self.dates_from, from_date)
+        return [row for row in self.rows[index:] if row[1] <= to_date]
+
+
+class PayslipHistory(object):
+    """
+    Totals of the lines of the done payslips of a set of employees, e.g. the
+    employees of a payslip run, between date_start and date_end. The lines of
+    a rule or category code are loaded for all the employees with a single
+    query the first time the code is asked, so the Payslips helpers of all
+    the payslips of the batch answer from memory.
+    """
+
+    def __init__(self, env, employee_ids, date_start, date_end):
+        self.env = env
+        self.employee_ids = tuple(sorted(set(employee_ids)))
+        self.date_start = date_start
+        self.date_end = date_end
+        # code => {employee id: _Series}
+        self._rules = {}
+        # tuple of category codes => {employee id: _Series}
+        self._categories = {}
+
+    def covers(self, from_date, to_date):
+        """@return: whether all the payslips between from_date and to_date
+        are loaded"""
+        from_date, to_date = _to_date(from_date), _to_date(to_date)
+        return bool(
+            from_date
+            and to_date
+            and self.date_start <= from_date
+            and to_date <= self.date_end
+        )
+
+    def _load(self, query, params):
+        self.env.cr.execute(query, params)
+        series = {}
+        for employee_id, date_from, *values in self.env.cr.fetchall():
+            employee_series = series.get(employee_id)
+            if employee_series is None:
+                employee_series = series[employee_id] = _Series()
+            employee_series.dates_from.append(date_from)
+            employee_series.rows.append((date_from, *values))
+        return series
+
+    def _rule_series(self, code):
+        if code not in self._rules:
+            self._rules[code] = self._load(
+                """SELECT hp.employee_id, hp.date_from, hp.date_to,
+                    hp.credit_note, pl.total
+                FROM hr_payslip as hp, hr_payslip_line as pl
+                WHERE hp.employee_id IN %s AND hp.state = 'done'
+                AND hp.date_from >= %s AND hp.date_to <= %s
+                AND hp.id = pl.slip_id AND pl.code = %s
+                ORDER BY hp.date_from, pl.id""",
+                (self.employee_ids, self.date_start, self.date_end, code),
+            )
+        return self._rules[code]
+
+    def _category_series(self, codes):
+        codes = tuple(sorted(set(codes)))
+        if codes not in self._categories:
+            self._categories[codes] = self._load(
+                """SELECT hp.employee_id, hp.date_from, hp.date_to,
+                    hp.credit_note, pl.total
+                FROM hr_payslip as hp, hr_payslip_line as pl,
+                    hr_salary_rule_category as rc
+                WHERE hp.employee_id IN %s AND hp.state = 'done'
+                AND hp.date_from >= %s AND hp.date_to <= %s
+                AND hp.id = pl.slip_id AND rc.id = pl.category_id
+                AND rc.code IN %s
+                ORDER BY hp.date_from, pl.id""",
+                (self.employee_ids, self.date_start, self.date_end, codes),
+            )
+        return self._categories[codes]
+
+    def rule_totals(self, employee_id, code, from_date, to_date, monthly=False):
+        """
+        @param monthly: sum the totals by month of the payslip start date
+        @return: list of the totals of the lines of the rule code, negative
+                 for credit notes, like the Payslips *_rule() queries
+        """
+        series = self._rule_series(code).get(employee_id)
+        if not series:
+            return []
+        rows = series.select(_to_date(from_date), _to_date(to_date))
+        return _signed_totals(
+            rows, lambda credit_note: credit_note is not False, monthly
+        )
+
+    def category_totals(self, employee_id, codes, from_date, to_date, monthly=False):
+        """
+        @param codes: the category codes, like the Payslips *_category()
+                      queries
+        @param monthly: sum the totals by month of the payslip start date
+        @return: list of the totals of the lines of these categories,
+                 negative for credit notes
+        """
+        series = self._category_series(codes).get(employee_id)
+        if not series:
+            return []
+        rows = series.select(_to_date(from_date), _to_date(to_date))
+        return _signed_totals(rows, lambda credit_note: credit_note is True, monthly)
+
+
+# value, hours and joined table of the history queries of each kind. The line
+# totals are negative for credit notes, like in the Payslips *_rule() helpers.
+QUERY_KINDS = {
+    "rule": (
+        "CASE WHEN hp.credit_note = False THEN x.total ELSE -x.total END",
+        "0",
+        "hr_payslip_line as x ON x.slip_id = hp.id",
+    ),
+    "input": ("x.amount", "0", "hr_payslip_input as x ON x.payslip_id = hp.id"),
+    "worked_days": (
+        "x.number_of_days",
+        "x.number_of_hours",
+        "hr_payslip_worked_days as x ON x.payslip_id = hp.id",
+    ),
+}
+
+# aggregates of the history queries, in the order of the query columns
+QUERY_FUNCTIONS = ("sum", "avg", "max", "min", "count", "hours")
+
+
+class HistoryResult(object):
+    """
+    Aggregates of the done payslips of some employees, by employee, code and
+    date window, returned by query_history()
+    """
+
+    __slots__ = ("values", "employee_id")
+
+    def __init__(self, values, employee_id=None):
+        # {(employee id, code, window): {function: value}}
+        self.values = values
+        self.employee_id = employee_id
+
+    def for_employee(self, employee_id):
+        """@return: the result of an employee, whose get() doesn't need the
+        employee anymore"""
+        return HistoryResult(self.values, employee_id)
+
+    def get(self, code, window, function="sum", employee_id=None):
+        """
+        @param window: name of a window of the query
+        @param function: "sum", "avg", "max", "min", "count", or "hours" for
+                         the sum of the worked hours
+        @return: the aggregate, 0.0 when there is no value
+        """
+        if employee_id is None:
+            employee_id = self.employee_id
+        values = self.values.get((employee_id, code, window))
+        return values and values[function] or 0.0
+
+
+def query_history(env, kind, employee_ids, codes, windows):
+    """
+    Aggregate the done payslips of many employees, codes and date windows
+    with a single query
+    @param kind: "rule" for the payslip lines, "input" or "worked_days"
+    @param codes: list of the rule, input or worked days codes
+    @param windows: dict {window name: (from_date, to_date)} of the payslip
+                    dates to aggregate, to_date being today when empty
+    @return: HistoryResult
+    """
+    value, hours, table = QUERY_KINDS[kind]
+    employee_ids, codes = tuple(set(employee_ids)), tuple(set(codes))
+    if not employee_ids or not codes or not windows:
+        return HistoryResult({})
+    today = fields.Date.today()
+    window_params = []
+    for name, (from_date, to_date) in windows.items():
+        window_params += [name, from_date, to_date or today]
+    query = """
+        SELECT hp.employee_id, x.code, w.name, sum({value}), avg({value}),
+            max({value}), min({value}), count(*), sum({hours})
+        FROM hr_payslip as hp JOIN {table}
+        JOIN (VALUES {windows}) AS w(name, date_from, date_to)
+            ON hp.date_from >= w.date_from AND hp.date_to <= w.date_to
+        WHERE hp.employee_id IN %s AND hp.state = 'done' AND x.code IN %s
+        GROUP BY hp.employee_id, x.code, w.name""".format(
+        value=value,
+        hours=hours,
+        table=table,
+        windows=", ".join(["(%s, %s::date, %s::date)"] * len(windows)),
+    )
+    env.cr.execute(query, window_params + [employee_ids, codes])
+    return HistoryResult(
+        {
+            (employee_id, code, window): dict(zip(QUERY_FUNCTIONS, values))
+            for employee_id, code, window, *values in env.cr.fetchall()
+        }
+    )
@@ -2,6 +2,8 @@
 
 from odoo import fields, models
 
+from .hr_payslip_run_job import JOB_CHUNK_SIZE
+
 
 class ResConfigSettings(models.TransientModel):
     _inherit = "res.config.settings"
@@ -23,6 +25,39 @@ class ResConfigSettings(models.TransientModel):
         help="Prevent payslips from being recomputed when confirming them",
         default=True,
     )
+    incremental_recompute = fields.Boolean(
+        config_parameter="payroll.incremental_recompute",
+        string="Incremental recomputation",
+        help="When inputs or worked days of a computed payslip are changed, only "
+        "recompute the rules depending on them. Other changes, like contract "
+        "wages, aren't detected and need a full computation.",
+        default=False,
+    )
+    lean_payslip_lines = fields.Boolean(
+        config_parameter="payroll.lean_payslip_lines",
+        string="Lean payslip lines",
+        help="Don't copy the python code and the other definition fields of "
+        "the salary rules on each payslip line. The lines refer to a shared "
+        "snapshot of the rule definition instead.",
+        default=False,
+    )
+    history_aggregate = fields.Boolean(
+        config_parameter="payroll.history_aggregate",
+        string="Monthly history aggregates",
+        help="Maintain the monthly totals of the confirmed payslips, so the "
+        "history helpers of the salary rules (payslips.sum_rule(), "
+        "inputs.sum(), ...) read them for date ranges made of whole months.",
+        default=False,
+    )
+    payslip_run_workers = fields.Integer(
+        config_parameter="payroll.payslip_run_workers",
+        string="Payslip batch workers",
+        help="Number of cron workers processing the payslips of a batch in "
+        "parallel, in the background. The payslips are committed by chunks of "
+        "%s. 0 or 1 computes the payslips generated for a batch in the same "
+        "transaction." % JOB_CHUNK_SIZE,
+        default=0,
+    )
     allow_edit_payslip_lines = fields.Boolean(
         config_parameter="payroll.allow_edit_payslip_lines",
         string="Allow editing payslip lines",
@@ -35,3 +70,24 @@ class ResConfigSettings(models.TransientModel):
         help="Require rule.code, rule.category, category.code, structure.code",
         default=False,
     )
+
+    def set_values(self):
+        lean = (
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("payroll.lean_payslip_lines")
+        )
+        aggregates = self.env["hr.payslip.aggregate"].sudo()
+        aggregated = aggregates._is_enabled()
+        res = super().set_values()
+        self.env["hr.payslip.run.job"].sudo()._set_cron_count(self.payslip_run_workers)
+        if self.lean_payslip_lines and not lean:
+            # move the definitions of the existing lines to snapshots
+            self.env["hr.payslip.line"].sudo()._move_rule_definitions_to_snapshots()
+        if self.history_aggregate and not aggregated:
+            # the payslips confirmed until now weren't aggregated
+            aggregates.rebuild()
+        return res
+
+    def action_rebuild_history_aggregate(self):
+        self.env["hr.payslip.aggregate"].sudo().rebuild()
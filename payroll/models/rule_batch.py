@@ -0,0 +1,143 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import logging
+
+from .rule_code_cache import fast_path, parse_path
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except ImportError:
+    _logger.debug("Cannot import numpy, salary rules are not computed in batches")
+    numpy = None
+
+# localdict values that don't depend on the rules computed before, see
+# HrPayslip._compute_lines_dict()
+BATCH_ROOTS = ("contract", "employee", "payslip", "worked_days", "inputs")
+
+
+def batch_getter(source):
+    """
+    @param source: python expression of a salary rule
+    @return: the fast_path() getter of the expression when it is a numeric
+             literal or an attribute path of one of the BATCH_ROOTS, like
+             contract.wage or inputs.BONUS.amount, None otherwise
+    """
+    try:
+        path = parse_path(source)
+    except (SyntaxError, ValueError):
+        return None
+    if path is None or path[1] is not None and path[0] not in BATCH_ROOTS:
+        return None
+    return fast_path(source)
+
+
+class BatchRule(object):
+    """
+    A fix or percentage salary rule whose condition range, quantity and
+    percentage base only read the BATCH_ROOTS:
+    - rule_id, name, amount_select, amount_fix, amount_percentage,
+      range_min, range_max: the rule values used by the computation
+    - range_getter: getter of the condition range, None when the rule has no
+      condition
+    - quantity_getter, base_getter: getters of the quantity and of the
+      percentage base (None for fix rules)
+    """
+
+    __slots__ = (
+        "rule_id",
+        "name",
+        "amount_select",
+        "amount_fix",
+        "amount_percentage",
+        "range_min",
+        "range_max",
+        "range_getter",
+        "quantity_getter",
+        "base_getter",
+    )
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs[name])
+
+
+def _column(getter, localdicts, numeric=False):
+    """
+    @return: float array of the values of the getter for each localdict, with
+             NaN where the getter fails or the value isn't a number, so the
+             rule computes (and reports) it itself
+    """
+
+    def value(localdict):
+        try:
+            value = getter(localdict)
+            if numeric and type(value) not in (int, float, bool):
+                return numpy.nan
+            return float(value)
+        except Exception:
+            return numpy.nan
+
+    return numpy.fromiter(
+        (value(localdict) for localdict in localdicts),
+        dtype=float,
+        count=len(localdicts),
+    )
+
+
+class RuleBatch(object):
+    """The BatchRules of a RulePlan, computed for many contracts at once"""
+
+    __slots__ = ("rules",)
+
+    def __init__(self, rules):
+        self.rules = rules
+
+    def compute(self, rows):
+        """
+        @param rows: list of (key, localdict) of the contracts to compute
+        @return: dict {key: {rule id: (condition, line values)}} with the
+                 result of the own condition of each rule, and the [name,
+                 quantity, rate, amount, total] of its line, or None when the
+                 line must be computed by the rule
+        """
+        keys = [key for key, _localdict in rows]
+        localdicts = [localdict for _key, localdict in rows]
+        size = len(rows)
+        result = {key: {} for key in keys}
+        for rule in self.rules:
+            if rule.range_getter:
+                values = _column(rule.range_getter, localdicts, numeric=True)
+                # the rule raises its own error for the contracts without value
+                valid = ~numpy.isnan(values)
+                conditions = (rule.range_min <= values) & (values <= rule.range_max)
+            else:
+                valid = conditions = numpy.ones(size, dtype=bool)
+            quantities = _column(rule.quantity_getter, localdicts)
+            if rule.amount_select == "percentage":
+                rates = numpy.full(size, rule.amount_percentage, dtype=float)
+                amounts = _column(rule.base_getter, localdicts)
+            else:
+                rates = numpy.full(size, 100.0)
+                amounts = numpy.full(size, rule.amount_fix, dtype=float)
+            # same operations as HrPayslip._get_lines_dict(), for all the
+            # contracts at once
+            totals = quantities * rates * amounts / 100.0
+            computed = ~(numpy.isnan(quantities) | numpy.isnan(amounts))
+            for key, is_valid, condition, has_line, *line in zip(
+                keys,
+                valid.tolist(),
+                conditions.tolist(),
+                computed.tolist(),
+                quantities.tolist(),
+                rates.tolist(),
+                amounts.tolist(),
+                totals.tolist(),
+            ):
+                if is_valid:
+                    result[key][rule.rule_id] = (
+                        condition,
+                        [rule.name] + line if has_line else None,
+                    )
+        return result
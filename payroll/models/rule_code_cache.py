@@ -0,0 +1,120 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import ast
+import threading
+from collections import OrderedDict
+from types import CodeType
+
+from odoo.tools.safe_eval import _BUILTINS, _SAFE_OPCODES, test_expr
+
+DEFAULT_CACHE_SIZE = 4096
+
+
+def parse_path(source):
+    """Return ``(value, None)`` when ``source`` is a numeric literal (``1.0``,
+    ``-1``), ``(name, attributes)`` when it is a plain attribute path
+    (``contract.wage``, ``worked_days.WORK100.number_of_days``), or None."""
+    source = source.strip()
+    try:
+        value = ast.literal_eval(source)
+    except (ValueError, TypeError, SyntaxError):
+        value = None
+    if type(value) in (int, float):
+        return value, None
+    node = ast.parse(source, mode="eval").body
+    attrs = []
+    while isinstance(node, ast.Attribute):
+        attrs.insert(0, node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    return node.id, attrs
+
+
+def fast_path(source):
+    """Return a function evaluating ``source`` directly when it is a numeric
+    literal or a plain attribute path (see ``parse_path()``), or None when it
+    needs the sandboxed evaluator. ``source`` must already have been
+    validated by ``test_expr()``."""
+    path = parse_path(source)
+    if path is None:
+        return None
+    name, attrs = path
+    if attrs is None:
+        return lambda localdict: name
+
+    def getter(localdict):
+        value = localdict[name] if name in localdict else _BUILTINS[name]
+        for attr in attrs:
+            value = getattr(value, attr)
+        return value
+
+    return getter
+
+
+class RuleCodeCache(object):
+    """Process-wide LRU cache of the code evaluated by salary rules.
+
+    Sources are compiled and validated against the safe_eval opcode whitelist
+    only once. Trivial expressions are stored as direct getters (see
+    ``fast_path()``), anything else as a code object. Entries are keyed by rule
+    id, field name, mode and the source text itself: a rule edited by another
+    worker gets a new key instead of a stale entry, and ``invalidate()``
+    releases the entries of rules written in this process.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, rule_id, field_name, source, mode="eval"):
+        key = (rule_id, field_name, mode, source)
+        with self._lock:
+            code = self._entries.get(key)
+            if code is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return code
+            self.misses += 1
+        code = test_expr(source, _SAFE_OPCODES, mode=mode)
+        if mode == "eval":
+            code = fast_path(source) or code
+        with self._lock:
+            self._entries[key] = code
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return code
+
+    def invalidate(self, rule_ids=None):
+        with self._lock:
+            if rule_ids is None:
+                self._entries.clear()
+                return
+            rule_ids = set(rule_ids)
+            for key in [key for key in self._entries if key[0] in rule_ids]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
+
+
+def eval_code(code, localdict, nocopy=False):
+    """Evaluate an entry returned by ``RuleCodeCache.get()`` the same way
+    ``safe_eval()`` does, without compiling and checking the source again."""
+    if not isinstance(code, CodeType):
+        return code(localdict)
+    globals_dict = localdict if nocopy else dict(localdict)
+    globals_dict["__builtins__"] = _BUILTINS
+    return eval(code, globals_dict)  # pylint: disable=eval-used
+
+
+rule_code_cache = RuleCodeCache()
@@ -0,0 +1,218 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import ast
+
+# localdict objects whose attributes are rule, category, input and worked day
+# codes, see HrPayslip._get_baselocaldict()
+CODE_OBJECTS = ("rules", "result_rules", "categories", "inputs", "worked_days")
+
+# methods of these objects, that are not codes
+CODE_OBJECT_METHODS = ("dict", "env", "employee_id", "sum", "sum_hours", "_sum")
+
+# localdict values reset before each rule, see _reset_localdict_values()
+RESULT_NAMES = ("result", "result_name", "result_qty", "result_rate")
+
+
+class CodeReferences(object):
+    """
+    What the python code of a salary rule refers to:
+    - rules: codes read through rules.X and result_rules.X
+    - categories: codes read through categories.X
+    - inputs, worked_days: codes read through inputs.X and worked_days.X
+    - names: other names read from the localdict, like the total of a rule
+      through its bare code
+    - stores: names assigned in the localdict, that later rules may read
+    - attributes: "name.attribute" read on the other localdict values, like
+      "contract.wage" or "payslip.line_ids"
+    - opaque: the code accesses these objects dynamically (rules.dict[...],
+      getattr(categories, ...), ...), or can't be parsed, so it may read any
+      value computed before it
+    """
+
+    __slots__ = (
+        "rules",
+        "categories",
+        "inputs",
+        "worked_days",
+        "names",
+        "stores",
+        "attributes",
+        "opaque",
+    )
+
+    def __init__(self):
+        self.rules = set()
+        self.categories = set()
+        self.inputs = set()
+        self.worked_days = set()
+        self.names = set()
+        self.stores = set()
+        self.attributes = set()
+        self.opaque = False
+
+    def update(self, other):
+        for name in self.__slots__[:-1]:
+            getattr(self, name).update(getattr(other, name))
+        self.opaque = self.opaque or other.opaque
+
+
+class _ReferenceVisitor(ast.NodeVisitor):
+    def __init__(self, references):
+        self.references = references
+
+    def visit_Attribute(self, node):
+        value = node.value
+        if not isinstance(value, ast.Name):
+            return self.generic_visit(node)
+        if value.id not in CODE_OBJECTS:
+            self.references.attributes.add("%s.%s" % (value.id, node.attr))
+            return self.generic_visit(node)
+        if node.attr in CODE_OBJECT_METHODS:
+            if node.attr == "dict":
+                self.references.opaque = True
+            return
+        if value.id == "result_rules":
+            self.references.rules.add(node.attr)
+        else:
+            getattr(self.references, value.id).add(node.attr)
+
+    def visit_Name(self, node):
+        if node.id in CODE_OBJECTS:
+            # passed around or subscripted: can't be followed
+            self.references.opaque = True
+        elif isinstance(node.ctx, ast.Load):
+            self.references.names.add(node.id)
+        elif node.id not in RESULT_NAMES:
+            self.references.stores.add(node.id)
+
+
+def analyze_code(source, mode="eval"):
+    """
+    @param source: python code of a salary rule
+    @param mode: "eval" for expressions, "exec" for python code
+    @return: the CodeReferences of the code
+    """
+    references = CodeReferences()
+    try:
+        tree = ast.parse(source.strip() if mode == "eval" else source, mode=mode)
+    except (SyntaxError, ValueError):
+        references.opaque = True
+        return references
+    _ReferenceVisitor(references).visit(tree)
+    return references
+
+
+class RuleGraph(object):
+    """
+    Dependency graph of the rules of a RulePlan:
+    - references: rule id => CodeReferences of its condition and amount
+    - dependency_ids: rule id => frozenset of the rule ids it reads
+    - violation_ids: tuple of (rule id, rule id) where the first rule reads
+      the second one, which is computed after it in the sequence order
+    - opaque_ids: frozenset of the rules that may read any earlier value
+    - levels: tuple of tuples of rule ids. The rules of a level only depend
+      on the rules of the previous levels, so evaluating the levels in order
+      gives the same results as the sequence order.
+    """
+
+    __slots__ = (
+        "references",
+        "dependency_ids",
+        "violation_ids",
+        "opaque_ids",
+        "levels",
+    )
+
+    def __init__(self, references, dependency_ids, violation_ids, opaque_ids, levels):
+        self.references = references
+        self.dependency_ids = dependency_ids
+        self.violation_ids = violation_ids
+        self.opaque_ids = opaque_ids
+        self.levels = levels
+
+
+def _compute_levels(rules, before, opaque_ids):
+    """
+    @param before: rule id => set of the rule ids that must be computed before
+                   it, always earlier in the plan order
+    @return: tuple of the levels, as tuples of rule ids
+    """
+    # opaque rules are barriers: they are computed after all the rules before
+    # them, and before all the rules after them
+    last_opaque = None
+    for index, rule in enumerate(rules):
+        rule_id = rule[0]
+        if last_opaque is not None:
+            before[rule_id].add(last_opaque)
+        if rule_id in opaque_ids:
+            before[rule_id].update(r[0] for r in rules[:index])
+            last_opaque = rule_id
+    level_of = {}
+    levels = []
+    for rule in rules:
+        rule_id = rule[0]
+        level = 1 + max((level_of[dep_id] for dep_id in before[rule_id]), default=-1)
+        level_of[rule_id] = level
+        if level == len(levels):
+            levels.append([])
+        levels[level].append(rule_id)
+    return tuple(tuple(level) for level in levels)
+
+
+def build_rule_graph(rules):
+    """
+    @param rules: list of (rule id, code, category codes, CodeReferences) of
+                  the rules of a plan, in plan order. The category codes are
+                  the codes of the rule category and of its parents, the sums
+                  the rule contributes to.
+    @return: the RuleGraph of these rules
+    """
+    by_code = {}
+    by_category = {}
+    by_store = {}
+    for rule_id, code, category_codes, references in rules:
+        by_code.setdefault(code, []).append(rule_id)
+        for category_code in category_codes:
+            by_category.setdefault(category_code, []).append(rule_id)
+        for name in references.stores:
+            by_store.setdefault(name, []).append(rule_id)
+
+    position = {rule[0]: index for index, rule in enumerate(rules)}
+    dependency_ids = {}
+    violation_ids = []
+    opaque_ids = set()
+    # edges between rules, always from the rule computed first in the
+    # sequence order to the other one
+    before = {rule[0]: set() for rule in rules}
+    for index, (rule_id, code, _category_codes, references) in enumerate(rules):
+        read_ids = set()
+        for rule_code in references.rules | references.names:
+            read_ids.update(by_code.get(rule_code, ()))
+        for category_code in references.categories:
+            read_ids.update(by_category.get(category_code, ()))
+        for name in references.names:
+            read_ids.update(by_store.get(name, ()))
+        read_ids.discard(rule_id)
+        dependency_ids[rule_id] = frozenset(read_ids)
+        for read_id in read_ids:
+            if position[read_id] < index:
+                before[rule_id].add(read_id)
+            else:
+                # the rule reads a value that isn't computed yet: the other
+                # rule must stay after it
+                violation_ids.append((rule_id, read_id))
+                before[read_id].add(rule_id)
+        # a rule overwrites the values of the earlier rules with the same code
+        if code:
+            before[rule_id].update(
+                other_id for other_id in by_code[code] if position[other_id] < index
+            )
+        if references.opaque:
+            opaque_ids.add(rule_id)
+    return RuleGraph(
+        {rule[0]: rule[3] for rule in rules},
+        dependency_ids,
+        tuple(violation_ids),
+        frozenset(opaque_ids),
+        _compute_levels(rules, before, opaque_ids),
+    )
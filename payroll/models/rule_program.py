@@ -0,0 +1,375 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import ast
+
+from odoo.tools.safe_eval import _SAFE_OPCODES, assert_valid_codeobj
+
+from .base_browsable import BaseBrowsableObject
+from .rule_code_cache import eval_code
+
+# Names bound in the localdict while a program runs. They are removed
+# afterwards, so rules and localdict_hook() never see them.
+PROGRAM_NAMES = ("_payroll", "_payroll_rule", "_payroll_step")
+
+RULE_TEMPLATE = """
+_payroll_rule = {index}
+{reset}
+if _payroll.allowed({index}):
+    if _payroll.pending({index}):
+        _payroll_step = 1
+{condition}
+    if _payroll.applies({index}):
+        _payroll_step = 2
+{amount}
+    else:
+        _payroll.exclude({index})
+else:
+    _payroll.exclude({index})
+"""
+
+RESET_TEMPLATES = {
+    "inline": (
+        "result_name = None\n"
+        "result_qty = 1.0\n"
+        "result_rate = 100\n"
+        "result = None"
+    ),
+    "call": "_payroll.reset({index})",
+}
+
+CONDITION_TEMPLATES = {
+    "none": "_payroll.satisfied({index}, True)",
+    "range": "_payroll.satisfied({index}, _payroll.in_range({index}, {0}))",
+    "python": "{0}\n_payroll.satisfied({index}, _payroll.condition_result())",
+    "call": "_payroll.satisfied({index}, _payroll.condition({index}))",
+}
+
+AMOUNT_TEMPLATES = {
+    "fix": "_payroll.fix({index}, {0})",
+    "percentage": "_payroll.percentage({index}, {0}, {1})",
+    "code": "{0}\n_payroll.code({index})",
+    "call": "_payroll.compute({index})",
+}
+
+
+def is_overridden(record, base_class, method):
+    """Tell whether ``method`` of ``base_class`` is overridden in the registry
+    class of ``record``, i.e. by a module inheriting the model."""
+    return getattr(type(record), method) is not getattr(base_class, method)
+
+
+class RuleStep(object):
+    """
+    How a compiled program evaluates one salary rule:
+    - reset: "inline" or "call" (_reset_localdict_values() is overridden)
+    - condition, amount: the condition/amount type, or "call" to run the
+      rule method of that type
+    - condition_sources, amount_sources: (source, mode) of the python code
+      spliced in the program for that type, in the order of the template
+    """
+
+    __slots__ = (
+        "reset",
+        "condition",
+        "condition_sources",
+        "amount",
+        "amount_sources",
+    )
+
+    def __init__(self, reset, condition, condition_sources, amount, amount_sources):
+        self.reset = reset
+        self.condition = condition
+        self.condition_sources = condition_sources
+        self.amount = amount
+        self.amount_sources = amount_sources
+
+
+class RuleLine(object):
+    """Static part of the payslip line of a rule, see _get_lines_dict()"""
+
+    __slots__ = (
+        "code",
+        "key",
+        "name",
+        "amount_fix",
+        "amount_percentage",
+        "range_min",
+        "range_max",
+        "category_codes",
+        "values",
+    )
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs[name])
+
+
+class RuleProgram(object):
+    """
+    The salary rules of a RulePlan compiled into a single code object.
+    - plan: the compiled RulePlan
+    - code: the sandbox-validated program, run once per contract
+    - lines: RuleLine of each rule, in plan order
+    - inline_lines: whether RuleProgramRunner fills the lines itself, or
+      calls the _get_lines_dict() of the payslip
+    """
+
+    __slots__ = ("plan", "code", "lines", "inline_lines")
+
+    def __init__(self, plan, code, lines, inline_lines):
+        self.plan = plan
+        self.code = code
+        self.lines = lines
+        self.inline_lines = inline_lines
+
+
+class _Splicer(ast.NodeTransformer):
+    """Replace the placeholders of the templates by the parsed rule code"""
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def visit_Name(self, node):
+        return self.nodes.get(node.id, node)
+
+    def visit_Expr(self, node):
+        if isinstance(node.value, ast.Name) and node.value.id in self.nodes:
+            return self.nodes[node.value.id]
+        return self.generic_visit(node)
+
+
+def _indent(text, level):
+    return "\n".join(" " * level + line for line in text.splitlines())
+
+
+def build_program(steps):
+    """
+    @param steps: RuleStep of each rule, in plan order
+    @return: the code object of the program evaluating all these rules
+    @raise: SyntaxError, ValueError or NameError when the code of a rule is
+            invalid or forbidden by the safe_eval sandbox
+    """
+    chunks = []
+    nodes = {}
+    for index, step in enumerate(steps):
+        placeholders = {}
+        for part, sources in (
+            ("condition", step.condition_sources),
+            ("amount", step.amount_sources),
+        ):
+            names = []
+            for source, mode in sources:
+                name = "_payroll_code_%s" % len(nodes)
+                if mode == "eval":
+                    source = source.strip()
+                nodes[name] = ast.parse(source, mode=mode).body
+                names.append(name)
+            placeholders[part] = names
+        chunks.append(
+            RULE_TEMPLATE.format(
+                index=index,
+                reset=RESET_TEMPLATES[step.reset].format(index=index),
+                condition=_indent(
+                    CONDITION_TEMPLATES[step.condition].format(
+                        *placeholders["condition"], index=index
+                    ),
+                    8,
+                ),
+                amount=_indent(
+                    AMOUNT_TEMPLATES[step.amount].format(
+                        *placeholders["amount"], index=index
+                    ),
+                    8,
+                ),
+            )
+        )
+    tree = _Splicer(nodes).visit(ast.parse("".join(chunks), mode="exec"))
+    code = compile(ast.fix_missing_locations(tree), "<salary rule program>", "exec")
+    assert_valid_codeobj(_SAFE_OPCODES, code, "<salary rule program>")
+    return code
+
+
+class RuleProgramCallbacks(object):
+    """
+    The callbacks of a RuleProgramRunner that the program calls, bound as
+    ``_payroll`` in the localdict. Only these bound methods are reachable
+    from the code of the rules: the sandbox rejects the dunder attributes
+    leading back to the runner, its payslip and its localdict.
+    """
+
+    __slots__ = (
+        "reset",
+        "allowed",
+        "pending",
+        "satisfied",
+        "applies",
+        "exclude",
+        "in_range",
+        "condition_result",
+        "condition",
+        "fix",
+        "percentage",
+        "code",
+        "compute",
+    )
+
+    def __init__(self, runner):
+        for name in self.__slots__:
+            setattr(self, name, getattr(runner, name))
+
+
+class RuleProgramRunner(object):
+    """
+    Callbacks of a RuleProgram, run for the localdict of the contract being
+    computed. They keep the semantics of get_lines_dict(): the blacklist of
+    excluded rules, the memoized conditions and the payslip line bookkeeping.
+    """
+
+    def __init__(self, program, payslip, localdict, lines_dict, blacklist):
+        self.program = program
+        self.payslip = payslip
+        self.rule_ids = program.plan.rule_ids
+        self.rules = list(payslip.env["hr.salary.rule"].browse(self.rule_ids))
+        self.localdict = localdict
+        self.lines_dict = lines_dict
+        self.blacklist = blacklist
+        self.conditions = {}
+        self.previous_amount = 0.0
+        # error raised by a rule method, already reported by the rule
+        self.rule_error = None
+
+    def run(self):
+        localdict = self.localdict
+        has_builtins = "__builtins__" in localdict
+        localdict["_payroll"] = RuleProgramCallbacks(self)
+        try:
+            eval_code(self.program.code, localdict, nocopy=True)
+        except Exception as e:
+            if e is self.rule_error:
+                raise
+            # The error comes from the code of the rule spliced in the
+            # program: report it the same way as the rule methods
+            rule = self.rules[localdict["_payroll_rule"]]
+            if localdict.get("_payroll_step") == 1:
+                raise rule._get_condition_error(localdict, e) from e
+            raise rule._get_amount_error(localdict, e) from e
+        finally:
+            for name in PROGRAM_NAMES:
+                localdict.pop(name, None)
+            if not has_builtins:
+                localdict.pop("__builtins__", None)
+        return localdict
+
+    def _call_rule(self, method, *args):
+        try:
+            return method(*args)
+        except Exception as e:
+            self.rule_error = e
+            raise
+
+    # rule selection
+    def reset(self, index):
+        self._call_rule(self.rules[index]._reset_localdict_values, self.localdict)
+
+    def allowed(self, index):
+        return self.rule_ids[index] not in self.blacklist
+
+    def pending(self, index):
+        return self.rule_ids[index] not in self.conditions
+
+    def satisfied(self, index, result):
+        self.conditions[self.rule_ids[index]] = result
+
+    def applies(self, index):
+        rule = self.rules[index]
+        applies = self.conditions[rule.id]
+        if applies and rule.parent_rule_id:
+            applies = self._call_rule(
+                rule._satisfy_parent_conditions, self.localdict, self.conditions
+            )
+        if applies:
+            code = rule.code
+            localdict = self.localdict
+            self.previous_amount = code in localdict and localdict[code] or 0.0
+        return applies
+
+    def exclude(self, index):
+        self.blacklist |= self.program.plan.descendant_ids[self.rule_ids[index]]
+
+    # conditions
+    def in_range(self, index, value):
+        line = self.program.lines[index]
+        return line.range_min <= value <= line.range_max or False
+
+    def condition_result(self):
+        return "result" in self.localdict and self.localdict["result"] or False
+
+    def condition(self, index):
+        return self._call_rule(self.rules[index]._satisfy_own_condition, self.localdict)
+
+    # amounts
+    def fix(self, index, quantity):
+        line = self.program.lines[index]
+        values = {
+            "name": line.name,
+            "quantity": float(quantity),
+            "rate": 100.0,
+            "amount": line.amount_fix,
+        }
+        self._add_line(index, values)
+
+    def percentage(self, index, quantity, base):
+        line = self.program.lines[index]
+        values = {
+            "name": line.name,
+            "quantity": float(quantity),
+            "rate": line.amount_percentage,
+            "amount": float(base),
+        }
+        self._add_line(index, values)
+
+    def code(self, index):
+        self._add_line(index, self.rules[index]._get_rule_dict(self.localdict))
+
+    def compute(self, index):
+        localdict, lines_dict = self._call_rule(
+            self.payslip._compute_payslip_line,
+            self.rules[index],
+            self.localdict,
+            self.lines_dict,
+        )
+        self.lines_dict.update(lines_dict)
+
+    def _add_line(self, index, values):
+        rule = self.rules[index]
+        localdict = self.localdict
+        key = self.program.lines[index].key + str(localdict["contract"].id)
+        if not self.program.inline_lines:
+            self._call_rule(
+                self.payslip._get_lines_dict,
+                rule,
+                localdict,
+                self.lines_dict,
+                key,
+                values,
+                self.previous_amount,
+            )
+            return
+        line = self.program.lines[index]
+        total = values["quantity"] * values["rate"] * values["amount"] / 100.0
+        values["total"] = total
+        localdict[line.code] = total
+        localdict["rules"].dict[line.code] = rule
+        localdict["result_rules"].dict[line.code] = BaseBrowsableObject(values)
+        amount = total - self.previous_amount
+        categories = localdict["categories"].dict
+        for category_code in line.category_codes:
+            categories[category_code] = categories.get(category_code, 0) + amount
+        line_dict = {
+            "salary_rule_id": rule.id,
+            "employee_id": localdict["employee"].id,
+            "contract_id": localdict["contract"].id,
+        }
+        line_dict.update(line.values)
+        line_dict.update(values)
+        self.lines_dict[key] = line_dict
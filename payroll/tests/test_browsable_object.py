@@ -1,10 +1,29 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
+from datetime import timedelta
+from unittest.mock import patch
 
-
-from odoo.addons.payroll.models.hr_payslip import BaseBrowsableObject, BrowsableObject
+from odoo.addons.payroll.models.hr_payslip import (
+    BaseBrowsableObject,
+    BrowsableObject,
+    InputLine,
+    Payslips,
+    WorkedDays,
+)
+from odoo.addons.payroll.models.payslip_history import PayslipHistory
 
 from .common import TestPayslipBase
 
+# Payslips history helpers, for rules and categories
+HISTORY_HELPERS = (
+    "sum_{}",
+    "average_{}",
+    "average_{}_monthly",
+    "max_{}",
+    "max_{}_monthly",
+    "min_{}",
+    "min_{}_monthly",
+)
+
 
 class TestBrowsableObject(TestPayslipBase):
     def setUp(self):
@@ -71,3 +90,178 @@ class TestBrowsableObject(TestPayslipBase):
             350.0,
             "Updating of attribute using dot ('.') notation succeeded",
         )
+
+    def test_payslips_history(self):
+        self.apply_contract_cron()
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        payslip.compute_sheet()
+        payslip.action_payslip_done()
+        payslip.refund_sheet()
+        other_payslip = payslip.copy()
+        other_payslip.input_line_ids.filtered(
+            lambda line: line.code == "SALEURO"
+        ).amount = 500.0
+        other_payslip.compute_sheet()
+        other_payslip.action_payslip_done()
+
+        date_from, date_to = payslip.date_from, payslip.date_to
+        history = PayslipHistory(self.env, self.richard_emp.ids, date_from, date_to)
+        cached = Payslips(self.richard_emp.id, payslip, self.env, history)
+        uncached = Payslips(self.richard_emp.id, payslip, self.env)
+        for helper in HISTORY_HELPERS:
+            for code in ("NET", "SALE", "UNKNOWN"):
+                name = helper.format("rule")
+                self.assertAlmostEqual(
+                    getattr(cached, name)(code, date_from, date_to),
+                    getattr(uncached, name)(code, date_from, date_to),
+                    msg="%s(%s)" % (name, code),
+                )
+            for code in ("ALW", "BASIC", "UNKNOWN"):
+                name = helper.format("category")
+                self.assertAlmostEqual(
+                    getattr(cached, name)(code, date_from, date_to),
+                    getattr(uncached, name)(code, date_from, date_to),
+                    msg="%s(%s)" % (name, code),
+                )
+
+        # The lines of a code are loaded once for all the helpers
+        with patch.object(history, "_load", wraps=history._load) as load:
+            cached.sum_rule("BASIC", date_from, date_to)
+            cached.max_rule("BASIC", date_from, date_to)
+            cached.average_rule_monthly("BASIC", date_from, date_to)
+        self.assertEqual(load.call_count, 1)
+
+        # Dates outside of the history are queried
+        before = date_from - timedelta(days=1)
+        self.assertFalse(history.covers(before, date_to))
+        with patch.object(history, "_load", wraps=history._load) as load:
+            self.assertEqual(
+                cached.sum_rule("NET", before, date_to),
+                uncached.sum_rule("NET", before, date_to),
+            )
+        self.assertFalse(load.called)
+
+    def test_payslips_aggregate(self):
+        self.apply_contract_cron()
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        payslip.compute_sheet()
+        payslip.action_payslip_done()
+        payslip.refund_sheet()
+        other_payslip = payslip.copy()
+        other_payslip.input_line_ids.filtered(
+            lambda line: line.code == "SALEURO"
+        ).amount = 500.0
+        other_payslip.compute_sheet()
+        other_payslip.action_payslip_done()
+
+        date_from, date_to = payslip.date_from, payslip.date_to
+        payslips = Payslips(self.richard_emp.id, payslip, self.env)
+        inputs = InputLine(self.richard_emp.id, {}, self.env)
+        worked_days = WorkedDays(self.richard_emp.id, {}, self.env)
+        config = self.env["ir.config_parameter"].sudo()
+        aggregates = self.env["hr.payslip.aggregate"]
+
+        def get_values():
+            values = {}
+            for helper in HISTORY_HELPERS:
+                for code in ("NET", "SALE", "UNKNOWN"):
+                    name = helper.format("rule")
+                    values[name, code] = getattr(payslips, name)(
+                        code, date_from, date_to
+                    )
+                for code in ("ALW", "BASIC", "UNKNOWN"):
+                    name = helper.format("category")
+                    values[name, code] = getattr(payslips, name)(
+                        code, date_from, date_to
+                    )
+            values["inputs"] = inputs.sum("SALEURO", date_from, date_to)
+            values["days"] = worked_days.sum("WORK100", date_from, date_to)
+            values["hours"] = worked_days.sum_hours("WORK100", date_from, date_to)
+            return values
+
+        def assert_values(expected):
+            self.assertIsNotNone(aggregates._get_months(date_from, date_to))
+            for key, value in get_values().items():
+                self.assertAlmostEqual(value, expected[key], msg=str(key))
+
+        expected = get_values()
+        config.set_param("payroll.history_aggregate", True)
+        aggregates.rebuild()
+        self.assertTrue(aggregates.search([("employee_id", "=", self.richard_emp.id)]))
+        assert_values(expected)
+
+        # Confirmed payslips update the aggregates of their month
+        other_payslip.refund_sheet()
+        config.set_param("payroll.history_aggregate", False)
+        self.assertIsNone(aggregates._get_months(date_from, date_to))
+        expected = get_values()
+        config.set_param("payroll.history_aggregate", True)
+        assert_values(expected)
+
+        # Inserting the aggregates again replaces them instead of adding them
+        count = aggregates.search_count([])
+        aggregates._insert()
+        self.assertEqual(aggregates.search_count([]), count)
+        assert_values(expected)
+
+        # Date ranges which aren't whole months are queried
+        self.assertIsNone(
+            aggregates._get_months(date_from + timedelta(days=1), date_to)
+        )
+
+    def test_query_history(self):
+        self.apply_contract_cron()
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        payslip.compute_sheet()
+        payslip.action_payslip_done()
+        payslip.refund_sheet()
+        other_payslip = payslip.copy()
+        other_payslip.compute_sheet()
+        other_payslip.action_payslip_done()
+
+        date_from, date_to = payslip.date_from, payslip.date_to
+        windows = {
+            "month": (date_from, date_to),
+            "before": (date_from - timedelta(days=365), date_from),
+        }
+        payslips = Payslips(self.richard_emp.id, payslip, self.env)
+        result = payslips.query_rules(["NET", "SALE", "UNKNOWN"], windows)
+        for code in ("NET", "SALE", "UNKNOWN"):
+            for window, (start, end) in windows.items():
+                for function, helper in (
+                    ("sum", "sum_rule"),
+                    ("avg", "average_rule"),
+                    ("max", "max_rule"),
+                    ("min", "min_rule"),
+                ):
+                    self.assertAlmostEqual(
+                        result.get(code, window, function),
+                        getattr(payslips, helper)(code, start, end),
+                        msg="%s(%s, %s)" % (helper, code, window),
+                    )
+
+        inputs = InputLine(self.richard_emp.id, {}, self.env)
+        result = inputs.query(["SALEURO"], windows)
+        self.assertAlmostEqual(
+            result.get("SALEURO", "month"), inputs.sum("SALEURO", date_from, date_to)
+        )
+        worked_days = WorkedDays(self.richard_emp.id, {}, self.env)
+        result = worked_days.query(["WORK100"], windows)
+        self.assertAlmostEqual(
+            result.get("WORK100", "month", "hours"),
+            worked_days.sum_hours("WORK100", date_from, date_to),
+        )
+
+        # All the employees of a batch at once
+        run = self.env["hr.payslip.run"].create(
+            {"name": "History", "slip_ids": [(6, 0, other_payslip.ids)]}
+        )
+        result = run.query_history("rule", ["NET"], windows)
+        self.assertAlmostEqual(
+            result.get("NET", "month", employee_id=self.richard_emp.id),
+            payslips.sum_rule("NET", date_from, date_to),
+        )
+        self.assertEqual(result.get("NET", "month", employee_id=0), 0.0)
@@ -0,0 +1,121 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from .common import TestPayslipBase
+
+SEED_EMPLOYEES = 20
+SEED_MONTHS = 24
+
+
+class TestHistoryIndexes(TestPayslipBase):
+    def setUp(self):
+        super().setUp()
+        self.apply_contract_cron()
+        payslips = self.Payslip.create(
+            [
+                {"employee_id": self.richard_emp.id},
+                {"employee_id": self.sally.id},
+            ]
+        )
+        payslips.onchange_employee()
+        payslips.compute_sheet()
+        payslips.action_payslip_done()
+        employees = self.env["hr.employee"].create(
+            [{"name": "Employee %s" % i} for i in range(SEED_EMPLOYEES)]
+        )
+        self._seed_history(payslips, employees)
+        self.env.cr.execute("ANALYZE hr_payslip")
+        self.env.cr.execute("ANALYZE hr_payslip_line")
+        # the tables of a test database stay small, make sure the plans use
+        # the indexes whenever they can
+        self.env.cr.execute("SET LOCAL enable_seqscan = off")
+
+    def _get_columns(self, table):
+        self.env.cr.execute(
+            """
+            SELECT column_name FROM information_schema.columns
+            WHERE table_name = %s AND column_name != 'id'""",
+            (table,),
+        )
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    def _seed_history(self, payslips, employees):
+        """Copy the done payslips and their lines for the employees over the
+        previous months"""
+        self.Payslip.flush()
+        overrides = {
+            "employee_id": "e.id",
+            "date_from": "(hp.date_from - make_interval(months => m))::date",
+            "date_to": """(hp.date_from - make_interval(months => m)
+                + interval '1 month' - interval '1 day')::date""",
+            "number": "'SEED-' || hp.id || '-' || m || '-' || e.id",
+        }
+        columns = self._get_columns("hr_payslip")
+        self.env.cr.execute(
+            """
+            INSERT INTO hr_payslip ({})
+            SELECT {} FROM hr_payslip as hp, generate_series(1, %s) as m,
+                unnest(%s) as e(id)
+            WHERE hp.id IN %s""".format(
+                ", ".join(columns),
+                ", ".join(overrides.get(name, "hp." + name) for name in columns),
+            ),
+            (SEED_MONTHS, employees.ids, tuple(payslips.ids)),
+        )
+        overrides = {
+            "slip_id": "hp.id",
+            "employee_id": "hp.employee_id",
+            "date_from": "hp.date_from",
+        }
+        columns = self._get_columns("hr_payslip_line")
+        self.env.cr.execute(
+            """
+            INSERT INTO hr_payslip_line ({})
+            SELECT {} FROM hr_payslip_line as pl
+            JOIN hr_payslip as hp ON hp.number LIKE 'SEED-' || pl.slip_id || '-%%'
+            WHERE pl.slip_id IN %s""".format(
+                ", ".join(columns),
+                ", ".join(overrides.get(name, "pl." + name) for name in columns),
+            ),
+            (tuple(payslips.ids),),
+        )
+
+    def _explain(self, query, params):
+        self.env.cr.execute("EXPLAIN " + query, params)
+        return "\n".join(row[0] for row in self.env.cr.fetchall())
+
+    def test_rule_history_plan(self):
+        plan = self._explain(
+            """
+            SELECT sum(case when hp.credit_note = False then
+                (pl.total) else (-pl.total) end)
+            FROM hr_payslip as hp, hr_payslip_line as pl
+            WHERE hp.employee_id = %s AND hp.state = 'done'
+            AND hp.date_from >= %s AND hp.date_to <= %s AND
+            hp.id = pl.slip_id AND pl.code = %s""",
+            (self.richard_emp.id, "2000-01-01", "2100-01-01", "NET"),
+        )
+        self.assertIn("hr_payslip_done_employee_dates_idx", plan)
+        self.assertIn("hr_payslip_line_slip_id_code_idx", plan)
+
+    def test_contribution_register_plan(self):
+        plan = self._explain(
+            """
+            SELECT pl.id from hr_payslip_line as pl
+            LEFT JOIN hr_payslip AS hp on (pl.slip_id = hp.id)
+            WHERE (hp.date_from >= %s) AND (hp.date_to <= %s)
+            AND pl.register_id in %s
+            AND hp.state = 'done'
+            ORDER BY pl.slip_id, pl.sequence""",
+            ("2000-01-01", "2100-01-01", (0,)),
+        )
+        self.assertIn("hr_payslip_line_register_id_idx", plan)
+
+    def test_done_dates_plan(self):
+        plan = self._explain(
+            """
+            SELECT hp.id FROM hr_payslip AS hp
+            WHERE hp.date_from >= %s AND hp.date_to <= %s
+            AND hp.state = 'done'""",
+            ("2100-01-01", "2100-01-31"),
+        )
+        self.assertIn("hr_payslip_done_dates_idx", plan)
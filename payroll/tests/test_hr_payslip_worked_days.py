@@ -136,3 +136,58 @@ class TestWorkedDays(TestPayslipBase):
             8.0,
             "The hours worked value is a POSITIVE number",
         )
+
+    def test_worked_days_batch(self):
+
+        self._common_contract_leave_setup()
+        self.sally.resource_id.calendar_id = self.full_calendar
+        self.sally.contract_ids.resource_calendar_id = self.full_calendar
+        contracts = self.richard_emp.contract_id | self.sally.contract_id
+        date_from = date.today().replace(day=1)
+        date_to = date.today()
+
+        # The lines of the contracts computed together are the ones computed
+        # contract by contract
+        lines = self.Payslip._get_worked_day_lines_batch(contracts, date_from, date_to)
+        for contract in contracts:
+            self.assertEqual(
+                [dict(line) for line in lines[contract.id]],
+                [
+                    dict(line)
+                    for line in self.Payslip.get_worked_day_lines(
+                        contract, date_from, date_to
+                    )
+                ],
+            )
+        self.assertIn(
+            "TESTLV",
+            [line["code"] for line in lines[self.richard_emp.contract_id.id]],
+        )
+
+    def test_worked_days_batch_timezones(self):
+
+        self._common_contract_leave_setup()
+        self.sally.resource_id.calendar_id = self.full_calendar
+        self.sally.contract_ids.resource_calendar_id = self.full_calendar
+        # The employees of the same calendar work in their own timezone
+        self.richard_emp.resource_id.tz = "Pacific/Honolulu"
+        self.sally.resource_id.tz = "Asia/Tokyo"
+        contracts = self.richard_emp.contract_id | self.sally.contract_id
+        date_from = date.today().replace(day=1)
+        date_to = date.today()
+
+        lines = self.Payslip._get_worked_day_lines_batch(contracts, date_from, date_to)
+        for contract in contracts:
+            self.assertEqual(
+                [dict(line) for line in lines[contract.id]],
+                [
+                    dict(line)
+                    for line in self.Payslip.get_worked_day_lines(
+                        contract, date_from, date_to
+                    )
+                ],
+            )
+        self.assertIn(
+            "TESTLV",
+            [line["code"] for line in lines[self.richard_emp.contract_id.id]],
+        )
@@ -1,5 +1,7 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+from unittest.mock import patch
+
 from .common import TestPayslipBase
 
 
@@ -140,6 +142,82 @@ class TestSalaryRule(TestPayslipBase):
         self.assertEqual(len(parent_line), 0, "No parent line found")
         self.assertEqual(len(child_line), 0, "No child line found")
 
+    def _compute_richard_payslip(self):
+        self.apply_contract_cron()
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        payslip.compute_sheet()
+        return payslip
+
+    def test_parent_condition_position(self):
+        # The parent rule condition reads a rule computed between its child
+        # and itself
+        parent = self.Rule.create(
+            {
+                "name": "Late parent",
+                "code": "LATE_PARENT",
+                "sequence": 30,
+                "condition_select": "python",
+                "condition_python": "result = 'MIDDLE' in rules.dict",
+                "amount_select": "fix",
+                "amount_fix": 1.0,
+            }
+        )
+        middle = self.Rule.create(
+            {
+                "name": "Middle",
+                "code": "MIDDLE",
+                "sequence": 25,
+                "amount_select": "fix",
+                "amount_fix": 1.0,
+            }
+        )
+        self.Rule.create(
+            {
+                "name": "Early child",
+                "code": "EARLY_CHILD",
+                "sequence": 20,
+                "parent_rule_id": parent.id,
+                "amount_select": "fix",
+                "amount_fix": 1.0,
+            }
+        )
+        self.developer_pay_structure.write(
+            {"rule_ids": [(4, parent.id), (4, middle.id)]}
+        )
+        payslip = self._compute_richard_payslip()
+        codes = payslip.line_ids.mapped("code")
+        # The parent condition is evaluated at the position of the child, where
+        # it is not satisfied, and again at its own position, where it is
+        self.assertNotIn("EARLY_CHILD", codes)
+        self.assertIn("MIDDLE", codes)
+        self.assertIn("LATE_PARENT", codes)
+
+    def test_excluded_rule_condition(self):
+        self.test_rule.write(
+            {"condition_select": "python", "condition_python": "result = False"}
+        )
+        self.child_test_rule.write(
+            {"condition_select": "python", "condition_python": "result = True"}
+        )
+        evaluated = []
+        satisfy_condition_python = type(self.Rule)._satisfy_condition_python
+
+        def _satisfy_condition_python(rule, localdict):
+            evaluated.append(rule.code)
+            return satisfy_condition_python(rule, localdict)
+
+        with patch.object(
+            type(self.Rule), "_satisfy_condition_python", _satisfy_condition_python
+        ):
+            payslip = self._compute_richard_payslip()
+        self.assertNotIn("CHILD_TEST", payslip.line_ids.mapped("code"))
+        # The children of a rule whose condition is not satisfied are excluded
+        # before their own condition is evaluated, so its side effects don't
+        # happen
+        self.assertIn("TEST", evaluated)
+        self.assertNotIn("CHILD_TEST", evaluated)
+
     def test_rule_and_category_with_and_without_code(self):
         rule_test_code = self.SalaryRule.create(
             {
@@ -239,3 +317,205 @@ class TestSalaryRule(TestPayslipBase):
         payslip.compute_sheet()
         line = payslip.line_ids.filtered(lambda l: l.name == "Total fixed values")
         self.assertEqual(line.total, 300, "Fixed rules: 100 + 200 = 300")
+
+    def test_code_cache(self):
+        payslip = self.Payslip.create(
+            {
+                "employee_id": self.richard_emp.id,
+                "contract_id": self.richard_contract.id,
+                "struct_id": self.developer_pay_structure.id,
+            }
+        )
+        payslip.compute_sheet()
+        stats = self.Rule.get_code_cache_stats()
+        payslip.compute_sheet()
+        new_stats = self.Rule.get_code_cache_stats()
+        self.assertEqual(
+            new_stats["misses"], stats["misses"], "Second computation hits the cache"
+        )
+        self.assertGreater(new_stats["hits"], stats["hits"])
+
+        # Editing the code of a rule must never reuse the old code object
+        self.test_rule.amount_python_compute = "result = 42"
+        payslip.compute_sheet()
+        line = payslip.line_ids.filtered(lambda line: line.code == "TEST")
+        self.assertEqual(line.amount, 42.0, "The new code is evaluated")
+
+    def test_invalid_code_logged(self):
+        with self.assertLogs(
+            "odoo.addons.payroll.models.hr_salary_rule", "WARNING"
+        ) as logs:
+            self.test_rule.amount_python_compute = "result = ("
+        self.assertIn("amount_python_compute", logs.output[0])
+
+    def test_rule_plan(self):
+        Structure = self.env["hr.payroll.structure"]
+        structure_ids = (self.developer_pay_structure.id,)
+        plan = Structure._get_rule_plan(structure_ids)
+        self.assertIs(
+            plan, Structure._get_rule_plan(structure_ids), "The plan is cached"
+        )
+        self.assertIn(self.child_test_rule.id, plan.rule_ids)
+        self.assertEqual(
+            plan.descendant_ids[self.test_rule.id],
+            {self.test_rule.id, self.parent_test_rule.id, self.child_test_rule.id},
+        )
+        self.assertEqual(plan.parent_ids[self.child_test_rule.id], (self.test_rule.id,))
+
+        # The version of the cached rules is read once per transaction
+        Structure._get_rule_program(structure_ids)
+        cr = self.env.cr
+        with patch.object(cr, "execute", wraps=cr.execute) as execute:
+            Structure._get_rule_plan(structure_ids)
+            Structure._get_rule_program(structure_ids)
+        execute.assert_not_called()
+
+        # Modifying a rule rebuilds the plan, without clearing the other
+        # caches of the registry
+        with patch.object(type(self.env.registry), "_clear_cache") as clear_cache:
+            self.child_test_rule.sequence = 0
+        clear_cache.assert_not_called()
+        new_plan = Structure._get_rule_plan(structure_ids)
+        self.assertIsNot(plan, new_plan)
+        self.assertEqual(new_plan.rule_ids[0], self.child_test_rule.id)
+
+    def test_rule_plan_salary_rules(self):
+        payslip = self.Payslip.create(
+            {
+                "employee_id": self.richard_emp.id,
+                "contract_id": self.richard_contract.id,
+                "struct_id": self.developer_pay_structure.id,
+            }
+        )
+        get_salary_rules = type(payslip)._get_salary_rules
+
+        # The plan of the payslip follows the rules of _get_salary_rules()
+        def _get_salary_rules(payslip):
+            return get_salary_rules(payslip) - self.child_test_rule
+
+        with patch.object(type(payslip), "_get_salary_rules", _get_salary_rules):
+            plan = payslip._get_rule_plan(payslip._get_employee_contracts())
+            payslip.compute_sheet()
+        self.assertNotIn(self.child_test_rule.id, plan.rule_ids)
+        self.assertIn(self.parent_test_rule.id, plan.rule_ids)
+        self.assertNotIn("CHILD_TEST", payslip.line_ids.mapped("code"))
+        self.assertIn("PARENT_TEST", payslip.line_ids.mapped("code"))
+
+    def test_code_fast_path(self):
+        # range "contract.wage", quantity "2" and percentage base
+        # "categories.BASIC" are compiled when the rule is saved
+        rule = self.Rule.create(
+            {
+                "name": "Fast path rule",
+                "code": "FAST",
+                "sequence": 20,
+                "condition_select": "range",
+                "condition_range": "contract.wage",
+                "condition_range_min": 1000,
+                "condition_range_max": 6000,
+                "amount_select": "percentage",
+                "amount_percentage": 10.0,
+                "amount_percentage_base": "categories.BASIC",
+                "quantity": "2",
+            }
+        )
+        self.developer_pay_structure.write({"rule_ids": [(4, rule.id)]})
+        stats = self.Rule.get_code_cache_stats()
+        payslip = self.Payslip.create(
+            {
+                "employee_id": self.richard_emp.id,
+                "contract_id": self.richard_contract.id,
+                "struct_id": self.developer_pay_structure.id,
+            }
+        )
+        payslip.compute_sheet()
+        line = payslip.line_ids.filtered(lambda line: line.code == "FAST")
+        self.assertEqual(line.quantity, 2.0)
+        self.assertEqual(line.amount, 5000.0, "categories.BASIC")
+        self.assertEqual(line.total, 1000.0)
+        self.assertEqual(
+            self.Rule.get_code_cache_stats()["misses"],
+            stats["misses"],
+            "Rules are compiled when saved",
+        )
+
+        # Out of range: the rule is not applied
+        self.richard_contract.wage = 7000.0
+        payslip.compute_sheet()
+        line = payslip.line_ids.filtered(lambda line: line.code == "FAST")
+        self.assertFalse(line)
+
+    def test_rule_graph(self):
+        graph = self.developer_pay_structure.get_rule_graph()
+        self.assertEqual(graph.references[self.rule_commission.id].inputs, {"SALEURO"})
+        self.assertEqual(
+            graph.dependency_ids[self.rule_gross.id],
+            {
+                self.rule_basic.id,
+                self.rule_hra.id,
+                self.rule_meal.id,
+                self.rule_commission.id,
+                self.test_rule.id,
+                self.parent_test_rule.id,
+                self.child_test_rule.id,
+            },
+            "GROSS reads the BASIC and ALW categories",
+        )
+        self.assertFalse(graph.violation_ids)
+        self.assertFalse(self.developer_pay_structure.rule_order_warning)
+        levels = {
+            rule_id: level
+            for level, rule_ids in enumerate(graph.levels)
+            for rule_id in rule_ids
+        }
+        self.assertEqual(levels[self.rule_basic.id], 0)
+        self.assertEqual(levels[self.rule_gross.id], 1)
+        self.assertEqual(levels[self.rule_net.id], 1)
+
+        # A rule reading a total computed after it
+        rule = self.Rule.create(
+            {
+                "name": "Early Rule",
+                "code": "EARLY",
+                "sequence": 2,
+                "amount_select": "code",
+                "amount_python_compute": "result = GROSS * 0.1",
+            }
+        )
+        self.developer_pay_structure.write({"rule_ids": [(4, rule.id)]})
+        graph = self.developer_pay_structure.get_rule_graph()
+        self.assertEqual(graph.violation_ids, ((rule.id, self.rule_gross.id),))
+        self.assertIn("Early Rule", self.developer_pay_structure.rule_order_warning)
+        levels = {
+            rule_id: level
+            for level, rule_ids in enumerate(graph.levels)
+            for rule_id in rule_ids
+        }
+        self.assertLess(levels[rule.id], levels[self.rule_gross.id])
+
+        # Dynamic accesses can't be followed
+        rule.amount_python_compute = "result = rules.dict['GROSS'] and 1"
+        graph = self.developer_pay_structure.get_rule_graph()
+        self.assertIn(rule.id, graph.opaque_ids)
+
+    def test_category_closure(self):
+        top = self.SalaryRuleCateg.create({"name": "Top", "code": "TOP"})
+        middle = self.SalaryRuleCateg.create({"name": "Middle", "parent_id": top.id})
+        bottom = self.SalaryRuleCateg.create(
+            {"name": "Bottom", "code": "BOTTOM", "parent_id": middle.id}
+        )
+        self.assertEqual(bottom._get_sum_codes(), ("BOTTOM", "TOP"))
+        self.assertEqual(middle._get_sum_codes(), ("TOP",))
+        self.assertEqual(
+            self.SalaryRuleCateg._get_descendant_codes("TOP"), ("BOTTOM", "TOP")
+        )
+        self.assertEqual(self.SalaryRuleCateg._get_descendant_codes("NONE"), ("NONE",))
+
+        # Moving a category updates the closure, and the rule caches version
+        structures = self.env["hr.payroll.structure"]
+        version = structures._get_rule_cache_version()
+        bottom.parent_id = self.categ_alw
+        self.assertNotEqual(structures._get_rule_cache_version(), version)
+        self.assertEqual(bottom._get_sum_codes(), ("BOTTOM", "ALW"))
+        self.assertEqual(self.SalaryRuleCateg._get_descendant_codes("TOP"), ("TOP",))
+        self.assertIn("BOTTOM", self.SalaryRuleCateg._get_descendant_codes("ALW"))
@@ -1,9 +1,16 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+from unittest import skipIf
+from unittest.mock import patch
+
+from dateutil.relativedelta import relativedelta
+
 from odoo.fields import Date
 from odoo.tests import Form
 from odoo.tools import test_reports
 
+from odoo.addons.payroll.models.rule_batch import numpy
+
 from .common import TestPayslipBase
 
 
@@ -186,6 +193,225 @@ class TestPayslipFlow(TestPayslipBase):
             line[0].amount, 1.0, "The calculated dictionary value 'contracts.qty' is 1"
         )
 
+    def test_compute_sheet_incremental(self):
+        self.env["ir.config_parameter"].sudo().set_param(
+            "payroll.incremental_recompute", True
+        )
+        self.apply_contract_cron()
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        payslip.compute_sheet()
+        self.assertTrue(payslip.line_values)
+        basic_line = payslip.line_ids.filtered(lambda line: line.code == "BASIC")
+        net_line = payslip.line_ids.filtered(lambda line: line.code == "NET")
+
+        payslip.input_line_ids.filtered(
+            lambda line: line.code == "SALEURO"
+        ).amount = 1000.0
+        self.assertEqual(payslip.recompute_codes, "inputs.SALEURO")
+        rule_class = type(self.SalaryRule)
+        with patch.object(
+            rule_class, "_compute_rule", autospec=True, wraps=rule_class._compute_rule
+        ) as compute_rule:
+            payslip.compute_sheet()
+        self.assertEqual(
+            {call[0][0].code for call in compute_rule.call_args_list},
+            {"SALE", "GROSS", "NET", "NET_CHILD"},
+            "Only the rules reading SALEURO directly or through categories "
+            "are evaluated",
+        )
+        self.assertFalse(payslip.recompute_codes)
+        self.assertEqual(
+            payslip.line_ids.filtered(lambda line: line.code == "SALE").total, 10
+        )
+        self.assertIn(basic_line, payslip.line_ids, "Unchanged lines are kept")
+        self.assertIn(net_line, payslip.line_ids, "Changed lines are updated")
+        totals = {line.code: line.total for line in payslip.line_ids}
+
+        # Same results as a full computation
+        self.env["ir.config_parameter"].sudo().set_param(
+            "payroll.incremental_recompute", False
+        )
+        payslip.compute_sheet()
+        self.assertEqual({line.code: line.total for line in payslip.line_ids}, totals)
+
+    def test_compute_sheet_incremental_rule_change(self):
+        self.env["ir.config_parameter"].sudo().set_param(
+            "payroll.incremental_recompute", True
+        )
+        self.apply_contract_cron()
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        payslip.compute_sheet()
+
+        # The values saved before a rule change are not reused
+        self.rule_hra.amount_percentage = 50.0
+        payslip.input_line_ids.filtered(
+            lambda line: line.code == "SALEURO"
+        ).amount = 1000.0
+        rule_class = type(self.SalaryRule)
+        with patch.object(
+            rule_class, "_compute_rule", autospec=True, wraps=rule_class._compute_rule
+        ) as compute_rule:
+            payslip.compute_sheet()
+        codes = {call[0][0].code for call in compute_rule.call_args_list}
+        self.assertIn("HRA", codes, "The payslip is fully computed")
+        self.assertIn("BASIC", codes)
+        hra_line = payslip.line_ids.filtered(lambda line: line.code == "HRA")
+        self.assertAlmostEqual(hra_line.total, hra_line.amount * 0.5)
+
+    def test_compute_sheet_incremental_batch(self):
+        self.env["ir.config_parameter"].sudo().set_param(
+            "payroll.incremental_recompute", True
+        )
+        self.apply_contract_cron()
+        payslips = self.Payslip.create(
+            [{"employee_id": self.richard_emp.id}, {"employee_id": self.richard_emp.id}]
+        )
+        for payslip in payslips:
+            payslip.onchange_employee()
+        payslips.compute_sheet()
+        payslips[0].input_line_ids.filtered(
+            lambda line: line.code == "SALEURO"
+        ).amount = 1000.0
+        payslip_class = type(self.Payslip)
+        with patch.object(
+            payslip_class,
+            "_compute_batch_rules",
+            autospec=True,
+            wraps=payslip_class._compute_batch_rules,
+        ) as compute_batch_rules:
+            payslips.compute_sheet()
+        compute_batch_rules.assert_called_once()
+        self.assertEqual(
+            compute_batch_rules.call_args[0][0],
+            payslips[1],
+            "The payslip computed incrementally is not batched",
+        )
+
+    def test_compute_codes(self):
+        self.apply_contract_cron()
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        rule_class = type(self.SalaryRule)
+        with patch.object(
+            rule_class, "_compute_rule", autospec=True, wraps=rule_class._compute_rule
+        ) as compute_rule:
+            totals = payslip.compute_codes(["GROSS", "ALW"])
+        self.assertEqual(
+            {call[0][0].code for call in compute_rule.call_args_list},
+            {"BASIC", "HRA", "MA", "SALE", "GROSS"},
+            "Only GROSS and the rules of the BASIC and ALW categories are evaluated",
+        )
+        self.assertFalse(payslip.line_ids, "Nothing is written")
+
+        payslip.compute_sheet()
+        lines = payslip.line_ids
+        self.assertEqual(
+            totals,
+            {
+                "GROSS": lines.filtered(lambda line: line.code == "GROSS").total,
+                "ALW": sum(
+                    lines.filtered(lambda line: line.category_id.code == "ALW").mapped(
+                        "total"
+                    )
+                ),
+            },
+        )
+        self.assertEqual(
+            payslip.compute_codes(["NET"])["NET"],
+            lines.filtered(lambda line: line.code == "NET").total,
+        )
+
+    def test_line_total_stored(self):
+        self.test_rule.write(
+            {"amount_select": "fix", "quantity": "1.555", "amount_fix": 10.01}
+        )
+        self.developer_pay_structure.write({"rule_ids": [(4, self.test_rule.id)]})
+        self.apply_contract_cron()
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        line_class = type(self.env["hr.payslip.line"])
+        with patch.object(
+            line_class, "_compute_total", autospec=True, wraps=line_class._compute_total
+        ) as compute_total:
+            payslip.compute_sheet()
+            payslip.flush()
+        self.assertFalse(compute_total.called, "The totals are not recomputed")
+
+        payslip.line_ids.invalidate_cache()
+        total_field = self.env["hr.payslip.line"]._fields["total"]
+        for line in payslip.line_ids:
+            self.assertEqual(
+                line.total,
+                total_field.convert_to_cache(
+                    float(line.quantity) * line.amount * line.rate / 100, line
+                ),
+                "The stored total of %s is the computed one" % line.code,
+            )
+        line = payslip.line_ids.filtered(lambda line: line.code == "TEST")
+        self.assertEqual(line.total, 15.62, "The total of the rounded quantity")
+
+        # Manual changes still recompute the total
+        line.quantity = 2.0
+        self.assertEqual(line.total, 20.02)
+
+    def test_lean_payslip_lines(self):
+        self.apply_contract_cron()
+        payslips = self.Payslip.create(
+            [
+                {"employee_id": self.richard_emp.id},
+                {"employee_id": self.richard_emp.id},
+            ]
+        )
+        payslips.onchange_employee()
+        payslips[0].compute_sheet()
+        hra_line = payslips[0].line_ids.filtered(lambda line: line.code == "HRA")
+        self.assertFalse(
+            hra_line.rule_snapshot_id, "Snapshots are only made for lean lines"
+        )
+        self.assertEqual(hra_line.amount_percentage_base, "contract.wage")
+
+        self.env["res.config.settings"].create({"lean_payslip_lines": True}).execute()
+        hra_line.invalidate_cache()
+        self.assertFalse(
+            hra_line.amount_percentage_base,
+            "Enabling lean lines empties the definitions of the existing lines",
+        )
+        snapshot = hra_line.rule_snapshot_id
+        self.assertTrue(snapshot, "Lines are linked to their rule definition")
+        self.assertEqual(snapshot.amount_percentage_base, "contract.wage")
+        self.assertEqual(snapshot.amount_percentage, 40.0)
+        self.assertFalse(
+            payslips[0].line_ids.filtered(lambda line: not line.rule_snapshot_id),
+            "Every existing line is linked to its definition",
+        )
+
+        payslips[1].compute_sheet()
+        lines = payslips[1].line_ids
+        self.assertEqual(
+            lines.filtered(lambda line: line.code == "HRA").rule_snapshot_id,
+            snapshot,
+            "Snapshots are shared by the lines of the same definition",
+        )
+        self.assertFalse(any(lines.mapped("condition_python")))
+        self.assertFalse(any(lines.mapped("amount_python_compute")))
+        self.assertEqual(
+            {line.code: line.total for line in lines},
+            {line.code: line.total for line in payslips[0].line_ids},
+        )
+
+        # A new rule definition gets a new snapshot
+        self.rule_hra.amount_percentage = 50.0
+        payslips[1].compute_sheet()
+        new_snapshot = (
+            payslips[1]
+            .line_ids.filtered(lambda line: line.code == "HRA")
+            .rule_snapshot_id
+        )
+        self.assertNotEqual(new_snapshot, snapshot)
+        self.assertEqual(new_snapshot.amount_percentage, 50.0)
+
     def test_compute_multiple_payslips(self):
 
         self.apply_contract_cron()
@@ -205,6 +431,306 @@ class TestPayslipFlow(TestPayslipBase):
         self.assertTrue(
             payslips[1].number, "The second payslip as been assigned a number"
         )
+        self.assertEqual(payslips.mapped("state"), ["verify", "verify"])
+        for payslip in payslips:
+            self.assertTrue(payslip.line_ids)
+            self.assertEqual(payslip.line_ids.mapped("slip_id"), payslip)
+            child_line = payslip.line_ids.filtered(
+                lambda line: line.code == "NET_CHILD"
+            )
+            self.assertEqual(
+                child_line.parent_line_id,
+                payslip.line_ids.filtered(lambda line: line.code == "NET"),
+                "The parent line is the line of the same payslip",
+            )
+
+        # Computing again replaces the lines and keeps the numbers
+        numbers = payslips.mapped("number")
+        old_lines = payslips.mapped("line_ids")
+        payslips.compute_sheet()
+        self.assertFalse(old_lines.exists(), "The old lines are deleted")
+        self.assertEqual(payslips.mapped("number"), numbers)
+        self.assertEqual(len(payslips.mapped("line_ids")), len(old_lines))
+
+    @skipIf(numpy is None, "The salary rule batches need numpy")
+    def test_compute_sheet_batch(self):
+        self.apply_contract_cron()
+        payslips = self.Payslip.create(
+            [
+                {"employee_id": self.richard_emp.id},
+                {"employee_id": self.sally.id},
+            ]
+        )
+        payslips.onchange_employee()
+        rule_class = type(self.SalaryRule)
+        payslip_class = type(self.Payslip)
+        with patch.object(
+            rule_class, "_compute_rule", autospec=True, wraps=rule_class._compute_rule
+        ) as compute_rule, patch.object(
+            payslip_class,
+            "_get_baselocaldict",
+            autospec=True,
+            wraps=payslip_class._get_baselocaldict,
+        ) as get_baselocaldict:
+            payslips.compute_sheet()
+        self.assertEqual(
+            get_baselocaldict.call_count,
+            2,
+            "The batch and the rules share the localdicts of the payslips",
+        )
+        codes = {call[0][0].code for call in compute_rule.call_args_list}
+        self.assertNotIn("HRA", codes, "contract.wage percentages are batched")
+        self.assertNotIn("PT", codes, "constant quantities are batched")
+        totals = [
+            {line.code: line.total for line in payslip.line_ids} for payslip in payslips
+        ]
+        self.assertIn("HRA", totals[0])
+
+        # Same results as the payslips computed one by one
+        for payslip, payslip_totals in zip(payslips, totals):
+            payslip.compute_sheet()
+            self.assertEqual(
+                {line.code: line.total for line in payslip.line_ids}, payslip_totals
+            )
+
+    def test_year_to_date(self):
+        self.apply_contract_cron()
+        Ytd = self.env["hr.payslip.ytd"]
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        payslip.compute_sheet()
+        payslip.action_payslip_done()
+        net = payslip.line_ids.filtered(lambda line: line.code == "NET").total
+        contracts = payslip._get_employee_contracts()
+        ytd = payslip._get_baselocaldict(contracts)["ytd"]
+        self.assertAlmostEqual(ytd.rule("NET"), net)
+        self.assertAlmostEqual(
+            ytd.category("BASIC"),
+            sum(
+                payslip.line_ids.filtered(
+                    lambda line: "BASIC" in line.category_id._get_sum_codes()
+                ).mapped("total")
+            ),
+        )
+        self.assertEqual(ytd.rule("UNKNOWN"), 0.0)
+        self.assertEqual(Ytd.check_consistency(self.richard_emp.ids), [])
+
+        other_payslip = payslip.copy()
+        other_payslip.compute_sheet()
+        other_payslip.action_payslip_done()
+        ytd = other_payslip._get_baselocaldict(contracts)["ytd"]
+        self.assertAlmostEqual(ytd.rule("NET"), 2 * net)
+
+        # Refunds are subtracted
+        payslip.refund_sheet()
+        ytd = other_payslip._get_baselocaldict(contracts)["ytd"]
+        self.assertAlmostEqual(ytd.rule("NET"), net)
+        self.assertEqual(Ytd.check_consistency(self.richard_emp.ids), [])
+
+        # The checker finds the totals out of sync with the lines
+        self.env.cr.execute(
+            "UPDATE hr_payslip_ytd SET total = 0 WHERE employee_id = %s",
+            (self.richard_emp.id,),
+        )
+        Ytd.invalidate_cache()
+        self.assertTrue(Ytd.check_consistency(self.richard_emp.ids))
+        Ytd.rebuild()
+        self.assertEqual(Ytd.check_consistency(self.richard_emp.ids), [])
+
+        # The totals grouped in SQL are the ones of the payslip lines
+        expected = Ytd._get_payslip_totals(
+            self.Payslip.search(
+                [("employee_id", "=", self.richard_emp.id), ("state", "=", "done")]
+            )
+        )
+        totals = Ytd._get_expected_totals(self.richard_emp.ids)
+        self.assertEqual(set(totals), set(expected))
+        for key, total in expected.items():
+            self.assertAlmostEqual(totals[key], total)
+
+    def test_compute_run_parallel(self):
+        self.apply_contract_cron()
+        Job = self.env["hr.payslip.run.job"]
+        run = self.env["hr.payslip.run"].create({"name": "Parallel"})
+        payslips = self.Payslip.create(
+            [
+                {"employee_id": self.richard_emp.id, "payslip_run_id": run.id},
+                {"employee_id": self.sally.id, "payslip_run_id": run.id},
+            ]
+        )
+        payslips.onchange_employee()
+        self.env["res.config.settings"].create({"payslip_run_workers": 2}).execute()
+        self.assertEqual(len(Job._get_crons()), 2, "A cron job per worker")
+
+        # Large batches are computed by the cron workers, a job each
+        with patch("odoo.addons.payroll.models.hr_payslip_run.JOB_CHUNK_SIZE", 1):
+            run._compute_payslips(payslips)
+        self.assertEqual(set(payslips.mapped("state")), {"draft"})
+        jobs = run.job_ids
+        self.assertEqual(len(jobs), 2)
+        self.assertEqual(jobs.mapped("payslip_ids"), payslips)
+
+        # The jobs locked by another cron worker are skipped
+        locked = jobs[0]
+        job_class = type(Job)
+        lock = job_class._lock
+        with patch.object(
+            job_class,
+            "_lock",
+            autospec=True,
+            side_effect=lambda job: job != locked and lock(job),
+        ):
+            Job._cron_process()
+        self.assertEqual(locked.state, "queued")
+        self.assertEqual(jobs[1].state, "done")
+        Job._cron_process()
+        self.assertEqual(locked.state, "done")
+        self.assertEqual(set(payslips.mapped("state")), {"verify"})
+        self.assertTrue(all(payslips.mapped("line_ids")))
+
+        self.env["res.config.settings"].create({"payslip_run_workers": 0}).execute()
+        self.assertEqual(
+            Job._get_crons(), self.env.ref("payroll.ir_cron_payslip_run_job")
+        )
+
+    def test_run_jobs(self):
+        self.apply_contract_cron()
+        Job = self.env["hr.payslip.run.job"]
+        run = self.env["hr.payslip.run"].create({"name": "Jobs"})
+        payslips = self.Payslip.create(
+            [
+                {"employee_id": self.richard_emp.id, "payslip_run_id": run.id},
+                {"employee_id": self.sally.id, "payslip_run_id": run.id},
+            ]
+        )
+        payslips.onchange_employee()
+
+        # An interrupted job resumes after its processed payslips, as the
+        # user who requested it
+        job = Job.with_context(tz="Europe/Brussels")._enqueue(run, "compute")
+        self.assertEqual(job.payslip_ids, payslips)
+        self.assertEqual(job.user_id, self.env.user)
+        self.assertEqual(job.tz, "Europe/Brussels")
+        job.write({"state": "running", "done_payslip_ids": [(4, payslips[0].id)]})
+        job_class = type(Job)
+        with patch.object(
+            job_class, "_process", autospec=True, wraps=job_class._process
+        ) as process:
+            Job.with_context(tz=False)._cron_process()
+        processed = process.call_args[0][0]
+        self.assertEqual(processed.env.user, self.env.user)
+        self.assertEqual(processed.env.context["tz"], "Europe/Brussels")
+        self.assertEqual(
+            processed.env.context["allowed_company_ids"], self.env.companies.ids
+        )
+        self.assertEqual(job.state, "done")
+        self.assertEqual(job.progress, 100.0)
+        self.assertEqual(payslips.mapped("state"), ["draft", "verify"])
+
+        job = Job._enqueue(run, "confirm")
+        Job._cron_process()
+        self.assertEqual(job.state, "done")
+        self.assertEqual(set(payslips.mapped("state")), {"done"})
+
+        # The errors of the payslips are recorded
+        job = Job._enqueue(run, "cancel")
+        Job._cron_process()
+        self.assertEqual(job.state, "failed")
+        self.assertEqual(job.error_ids.mapped("payslip_id"), payslips)
+        self.assertEqual(set(payslips.mapped("state")), {"done"})
+
+        # A failing job is logged, rolled back and unlocked, and resumed on
+        # the next run
+        job = Job._enqueue(run, "cancel")
+        with patch.object(
+            job_class, "_process", autospec=True, side_effect=ValueError("Failure")
+        ), self.assertLogs(
+            "odoo.addons.payroll.models.hr_payslip_run_job", level="ERROR"
+        ):
+            Job._cron_process()
+        self.assertEqual(job.state, "queued")
+        self.assertTrue(job._lock(), "The job is unlocked")
+        job._unlock()
+        Job._cron_process()
+        self.assertEqual(job.state, "failed")
+
+    def test_generate_run_payslips(self):
+        self.apply_contract_cron()
+        no_contract = self.env["hr.employee"].create({"name": "No Contract"})
+        employees = self.richard_emp | self.sally | no_contract
+        run = self.env["hr.payslip.run"].create(
+            {
+                "name": "Generate",
+                "date_start": Date.today().replace(day=1),
+                "date_end": Date.today() + relativedelta(day=31),
+            }
+        )
+        wizard = self.env["hr.payslip.employees"].create(
+            {"employee_ids": [(6, 0, employees.ids)]}
+        )
+        wizard.with_context(active_id=run.id).compute_sheet()
+        self.assertEqual(run.slip_ids.employee_id, employees)
+
+        # The payslips are generated like one by one
+        for payslip in run.slip_ids:
+            expected = self.Payslip.get_payslip_vals(
+                run.date_start, run.date_end, payslip.employee_id.id
+            )["value"]
+            self.assertEqual(payslip.contract_id.id, expected["contract_id"])
+            self.assertEqual(payslip.struct_id.id, expected["struct_id"])
+            self.assertEqual(
+                payslip.input_line_ids.mapped("code"),
+                [line["code"] for line in expected["input_line_ids"]],
+            )
+            self.assertEqual(
+                [
+                    (line.code, line.number_of_days, line.number_of_hours)
+                    for line in payslip.worked_days_line_ids
+                ],
+                [
+                    (line["code"], line["number_of_days"], line["number_of_hours"])
+                    for line in expected["worked_days_line_ids"]
+                ],
+            )
+            self.assertEqual(
+                payslip.name,
+                "Salary Slip of %s for %s"
+                % (
+                    payslip.employee_id.name,
+                    self.Payslip._get_name_month(run.date_start),
+                ),
+            )
+        self.assertTrue(run.slip_ids.filtered("contract_id").worked_days_line_ids)
+        self.assertFalse(run.slip_ids.filtered(lambda p: not p.contract_id).line_ids)
+
+        # The names are computed, whatever the name of the payslip values
+        payslip_class = type(self.Payslip)
+        get_payslip_vals = payslip_class.get_payslip_vals
+
+        def get_named_payslip_vals(payslip, *args, **kwargs):
+            res = get_payslip_vals(payslip, *args, **kwargs)
+            res["value"]["name"] = "Custom"
+            return res
+
+        other_run = run.copy({"name": "Generate Again"})
+        with patch.object(
+            payslip_class,
+            "get_payslip_vals",
+            autospec=True,
+            side_effect=get_named_payslip_vals,
+        ):
+            wizard.with_context(active_id=other_run.id).compute_sheet()
+        self.assertEqual(
+            other_run.slip_ids.mapped("name"),
+            [
+                "Salary Slip of %s for %s"
+                % (
+                    payslip.employee_id.name,
+                    self.Payslip._get_name_month(run.date_start),
+                )
+                for payslip in other_run.slip_ids
+            ],
+        )
 
     def test_get_contracts_singleton(self):
 
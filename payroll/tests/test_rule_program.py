@@ -0,0 +1,157 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from unittest.mock import patch
+
+from odoo.exceptions import UserError
+
+from odoo.addons.payroll.models import rule_program
+
+from . import test_hr_payslip_worked_days, test_hr_salary_rule, test_payslip_flow
+
+
+class RuleProgramDifferentialMixin(object):
+    """
+    Run the scenarios of a test case with the compiled rule engine. Every
+    get_lines_dict() call is computed by both engines, and the results (or
+    the errors) must be identical.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.PayrollStructure = self.PayrollStructure.with_context(
+            default_rule_engine="compiled"
+        )
+        self.env["hr.payroll.structure"].search([]).write({"rule_engine": "compiled"})
+        get_lines_dict = type(self.env["hr.payslip"]).get_lines_dict
+        test = self
+
+        def get_lines_dict_differential(payslips):
+            compiled = payslips.env["hr.payroll.structure"].search(
+                [("rule_engine", "=", "compiled")]
+            )
+            compiled.write({"rule_engine": "interpreter"})
+            try:
+                expected = get_lines_dict(payslips)
+            except Exception as e:
+                expected = e
+            finally:
+                compiled.write({"rule_engine": "compiled"})
+            if isinstance(expected, Exception):
+                with test.assertRaises(type(expected)) as error:
+                    get_lines_dict(payslips)
+                test.assertEqual(str(error.exception), str(expected))
+                raise expected
+            lines_dict = get_lines_dict(payslips)
+            test.assertEqual(lines_dict, expected)
+            return lines_dict
+
+        patcher = patch.object(
+            type(self.env["hr.payslip"]), "get_lines_dict", get_lines_dict_differential
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestPayslipFlowProgram(
+    RuleProgramDifferentialMixin, test_payslip_flow.TestPayslipFlow
+):
+    pass
+
+
+class TestWorkedDaysProgram(
+    RuleProgramDifferentialMixin, test_hr_payslip_worked_days.TestWorkedDays
+):
+    pass
+
+
+class TestSalaryRuleProgram(
+    RuleProgramDifferentialMixin, test_hr_salary_rule.TestSalaryRule
+):
+    def test_program(self):
+        structure_ids = (self.developer_pay_structure.id,)
+        program = self.PayrollStructure._get_rule_program(structure_ids)
+        self.assertTrue(program, "The structure is compiled")
+        self.assertIs(
+            program,
+            self.PayrollStructure._get_rule_program(structure_ids),
+            "The program is cached",
+        )
+        self.assertIs(program.plan, self.PayrollStructure._get_rule_plan(structure_ids))
+        self.assertEqual(len(program.lines), len(program.plan.rule_ids))
+
+        # Modifying a rule regenerates the program
+        self.test_rule.amount_python_compute = "result = 42"
+        new_program = self.PayrollStructure._get_rule_program(structure_ids)
+        self.assertIsNot(program, new_program)
+
+        # The localdict doesn't keep the names used by the program
+        payslip = self.Payslip.create(
+            {
+                "employee_id": self.richard_emp.id,
+                "contract_id": self.richard_contract.id,
+                "struct_id": self.developer_pay_structure.id,
+            }
+        )
+        localdicts = []
+        payslip_class = type(self.Payslip)
+        with patch.object(
+            payslip_class,
+            "localdict_hook",
+            autospec=True,
+            side_effect=lambda payslip, localdict: localdicts.append(localdict)
+            or localdict,
+        ):
+            payslip.compute_sheet()
+        self.assertTrue(localdicts)
+        for localdict in localdicts:
+            self.assertFalse(
+                [name for name in localdict if name.startswith("_payroll")]
+            )
+        line = payslip.line_ids.filtered(lambda line: line.code == "TEST")
+        self.assertEqual(line.amount, 42.0)
+
+    def test_program_invalid_code(self):
+        # Code rejected by the sandbox can't be compiled: the rules are
+        # computed one by one, and the error is raised by the rule
+        self.test_rule.amount_python_compute = "result = ().__class__"
+        structure_ids = (self.developer_pay_structure.id,)
+        self.assertIsNone(self.PayrollStructure._get_rule_program(structure_ids))
+
+    def test_program_callbacks(self):
+        callbacks = []
+        eval_code = rule_program.eval_code
+
+        def eval_program(code, localdict, **kwargs):
+            callbacks.append(localdict["_payroll"])
+            return eval_code(code, localdict, **kwargs)
+
+        payslip = self.Payslip.create(
+            {
+                "employee_id": self.richard_emp.id,
+                "contract_id": self.richard_contract.id,
+                "struct_id": self.developer_pay_structure.id,
+            }
+        )
+        with patch.object(rule_program, "eval_code", side_effect=eval_program):
+            payslip.compute_sheet()
+        self.assertTrue(callbacks)
+        for name in ("payslip", "localdict", "lines_dict", "blacklist", "rules"):
+            self.assertFalse(hasattr(callbacks[0], name))
+
+        # The runner behind the callbacks can't be reached from the rules
+        self.test_rule.amount_python_compute = "result = _payroll.fix.__self__"
+        structure_ids = (self.developer_pay_structure.id,)
+        self.assertIsNone(self.PayrollStructure._get_rule_program(structure_ids))
+
+    def test_program_error(self):
+        # The error of the code spliced in the program is reported by the rule
+        self.test_rule.amount_python_compute = "result = 1 / 0"
+        payslip = self.Payslip.create(
+            {
+                "employee_id": self.richard_emp.id,
+                "contract_id": self.richard_contract.id,
+                "struct_id": self.developer_pay_structure.id,
+            }
+        )
+        with self.assertRaisesRegex(UserError, "ZeroDivisionError"):
+            payslip.compute_sheet()
@@ -0,0 +1,134 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import logging
+import time
+from unittest.mock import patch
+
+from .common import TestPayslipBase
+
+_logger = logging.getLogger(__name__)
+
+TREE_RULES = 500
+TREE_LEVELS = 6
+BATCH_PAYSLIPS = 20
+
+
+class TestRuleTreeBenchmark(TestPayslipBase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        SalaryRule = cls.env["hr.salary.rule"]
+        # Build a tree of TREE_RULES rules on TREE_LEVELS levels; only the
+        # root rules are linked to the structure, children are found through
+        # the parent/child relation.
+        cls.level_sizes = [
+            TREE_RULES // TREE_LEVELS + (1 if level < TREE_RULES % TREE_LEVELS else 0)
+            for level in range(TREE_LEVELS)
+        ]
+        parents = SalaryRule
+        cls.tree_rules = SalaryRule
+        for level, size in enumerate(cls.level_sizes):
+            vals_list = []
+            for i in range(size):
+                vals_list.append(
+                    {
+                        "name": "Tree rule %s-%s" % (level, i),
+                        "code": "TREE_%s_%s" % (level, i),
+                        "sequence": 10 + level,
+                        "parent_rule_id": parents[i % len(parents)].id
+                        if parents
+                        else False,
+                        "condition_select": "python",
+                        "condition_python": "result = True",
+                        "amount_select": "fix",
+                        "amount_fix": 1.0,
+                    }
+                )
+            parents = SalaryRule.create(vals_list)
+            cls.tree_rules |= parents
+        cls.tree_structure = cls.env["hr.payroll.structure"].create(
+            {
+                "name": "Rule tree benchmark",
+                "code": "TREE",
+                "rule_ids": [
+                    (6, 0, cls.tree_rules.filtered(lambda r: not r.parent_rule_id).ids)
+                ],
+            }
+        )
+
+    def test_rule_tree_scaling(self):
+        payslip = self.Payslip.create(
+            {
+                "employee_id": self.richard_emp.id,
+                "contract_id": self.richard_contract.id,
+                "struct_id": self.tree_structure.id,
+            }
+        )
+        rule_class = type(self.SalaryRule)
+        original = rule_class._satisfy_condition_python
+        with patch.object(
+            rule_class, "_satisfy_condition_python", autospec=True, wraps=original
+        ) as condition:
+            start = time.perf_counter()
+            lines_dict = payslip.get_lines_dict()
+            elapsed = time.perf_counter() - start
+
+        # Each condition is evaluated once per contract: the number of
+        # evaluations grows linearly with the number of rules, instead of
+        # with the sum of the rule depths.
+        depth_sum = sum(
+            (level + 1) * size for level, size in enumerate(self.level_sizes)
+        )
+        _logger.info(
+            "Rule tree of %s rules on %s levels: %s condition evaluations "
+            "(%s without memoization), computed in %.3fs",
+            TREE_RULES,
+            TREE_LEVELS,
+            condition.call_count,
+            depth_sum,
+            elapsed,
+        )
+        self.assertEqual(condition.call_count, TREE_RULES)
+        self.assertEqual(len(lines_dict), TREE_RULES)
+
+        # A failing condition at the top of the tree excludes its whole subtree
+        root = self.tree_rules.filtered(lambda r: not r.parent_rule_id)[0]
+        root.condition_python = "result = False"
+        plan = self.PayrollStructure._get_rule_plan((self.tree_structure.id,))
+        excluded = plan.descendant_ids[root.id]
+        lines_dict = payslip.get_lines_dict()
+        self.assertEqual(len(lines_dict), TREE_RULES - len(excluded))
+
+    def test_rule_dispatch_batch(self):
+        payslips = self.Payslip.create(
+            [
+                {
+                    "employee_id": self.richard_emp.id,
+                    "contract_id": self.richard_contract.id,
+                    "struct_id": self.tree_structure.id,
+                }
+                for i in range(BATCH_PAYSLIPS)
+            ]
+        )
+        start = time.perf_counter()
+        payslips.compute_sheet()
+        elapsed = time.perf_counter() - start
+
+        # The condition and amount methods of the rules are looked up by name
+        # for each rule of each payslip: time these lookups alone
+        rules = list(self.tree_rules) * BATCH_PAYSLIPS
+        start = time.perf_counter()
+        for rule in rules:
+            getattr(rule, "_satisfy_condition_{}".format(rule.condition_select))
+            getattr(rule, "_compute_rule_{}".format(rule.amount_select))
+        dispatch = time.perf_counter() - start
+        _logger.info(
+            "Batch of %s payslips of %s rules computed in %.3fs, of which "
+            "%.3fs (%.1f%%) to look the rule methods up",
+            BATCH_PAYSLIPS,
+            TREE_RULES,
+            elapsed,
+            dispatch,
+            100.0 * dispatch / elapsed,
+        )
+        self.assertEqual(len(payslips.line_ids), BATCH_PAYSLIPS * TREE_RULES)
@@ -12,7 +12,6 @@ class HrPayslipEmployees(models.TransientModel):
 
     def compute_sheet(self):
         payslips = self.env["hr.payslip"]
-        [data] = self.read()
         active_id = self.env.context.get("active_id")
         if active_id:
             [run_data] = (
@@ -20,33 +19,51 @@ class HrPayslipEmployees(models.TransientModel):
                 .browse(active_id)
                 .read(["date_start", "date_end", "credit_note", "struct_id"])
             )
+        for employees in self._get_employee_chunks():
+            payslips += self._create_payslips(employees, run_data, active_id)
+        if not payslips:
+            raise UserError(_("You must select employee(s) to generate payslip(s)."))
+        payslips._compute_name()
+        if active_id:
+            self.env["hr.payslip.run"].browse(active_id)._compute_payslips(payslips)
+        else:
+            payslips.compute_sheet()
+        return {"type": "ir.actions.act_window_close"}
+
+    def _get_employee_chunks(self):
+        """@return: iterator of the employees to generate payslips for, by
+        chunks of employees generated together"""
+        self.ensure_one()
+        yield self.employee_ids
+
+    def _create_payslips(self, employees, run_data, run_id):
         from_date = run_data.get("date_start")
         to_date = run_data.get("date_end")
         struct_id = run_data.get("struct_id")
-        if not data["employee_ids"]:
-            raise UserError(_("You must select employee(s) to generate payslip(s)."))
-        for employee in self.env["hr.employee"].browse(data["employee_ids"]):
-            slip_data = self.env["hr.payslip"].get_payslip_vals(
-                from_date, to_date, employee.id, contract_id=False, struct_id=struct_id
+        payslips = self.env["hr.payslip"]
+        slips_data = payslips.get_payslip_vals_batch(
+            employees, from_date, to_date, struct_id=struct_id and struct_id[0]
+        )
+        vals_list = []
+        for employee in employees:
+            slip_data = slips_data[employee.id]
+            vals_list.append(
+                {
+                    "employee_id": employee.id,
+                    "name": slip_data.get("name"),
+                    "struct_id": slip_data.get("struct_id"),
+                    "contract_id": slip_data.get("contract_id"),
+                    "payslip_run_id": run_id,
+                    "input_line_ids": [
+                        (0, 0, x) for x in slip_data.get("input_line_ids")
+                    ],
+                    "worked_days_line_ids": [
+                        (0, 0, x) for x in slip_data.get("worked_days_line_ids")
+                    ],
+                    "date_from": from_date,
+                    "date_to": to_date,
+                    "credit_note": run_data.get("credit_note"),
+                    "company_id": employee.company_id.id,
+                }
             )
-            res = {
-                "employee_id": employee.id,
-                "name": slip_data["value"].get("name"),
-                "struct_id": slip_data["value"].get("struct_id"),
-                "contract_id": slip_data["value"].get("contract_id"),
-                "payslip_run_id": active_id,
-                "input_line_ids": [
-                    (0, 0, x) for x in slip_data["value"].get("input_line_ids")
-                ],
-                "worked_days_line_ids": [
-                    (0, 0, x) for x in slip_data["value"].get("worked_days_line_ids")
-                ],
-                "date_from": from_date,
-                "date_to": to_date,
-                "credit_note": run_data.get("credit_note"),
-                "company_id": employee.company_id.id,
-            }
-            payslips += self.env["hr.payslip"].create(res)
-        payslips._compute_name()
-        payslips.compute_sheet()
-        return {"type": "ir.actions.act_window_close"}
+        return payslips.create(vals_list)